@@ -0,0 +1,105 @@
+"""Startup benchmark of the application
+
+Reports, as the median of several runs in new Python processes:
+- the time of the --version command line and of the hyspecppt-batch imports
+- the import time of the slowest modules of the main window, from python -X importtime
+- the time from the start of the process to the first painted plot
+
+To run: `python scripts/startup_benchmark.py --repeat 5`
+The plot is painted offscreen, unless --show is given.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# script run in a new process: open the main window and print the time of the first painted plot
+FIRST_PLOT_SCRIPT = """
+import sys, time
+start = float(sys.argv[1])
+from qtpy.QtWidgets import QApplication
+from hyspecppt.mainwindow import HyspecPPT
+app = QApplication([])
+window = HyspecPPT()
+canvas = window.main_window.HPPT_view.plot_widget.static_canvas
+def painted(_event):
+    print(time.time() - start, flush=True)
+    app.quit()
+canvas.mpl_connect("draw_event", painted)
+window.show()
+app.exec_()
+"""
+
+
+def parse_importtime(output: str) -> dict[str, float]:
+    """Returns the cumulative import time of each module in seconds, from the output of python -X importtime
+
+    Args:
+        output: standard error of the process
+
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        times[module.strip()] = int(cumulative) * 1e-6
+    return times
+
+
+def run_python(arguments: list[str], environment: dict[str, str]) -> subprocess.CompletedProcess:
+    """Run the Python interpreter with arguments, and raise an error if it fails"""
+    return subprocess.run([sys.executable, *arguments], capture_output=True, text=True, env=environment, check=True)
+
+
+def wall_time(arguments: list[str], environment: dict[str, str]) -> float:
+    """Returns the wall time of a Python process"""
+    start = time.perf_counter()
+    run_python(arguments, environment)
+    return time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark and print the report"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="number of runs of each measurement")
+    parser.add_argument("-n", "--modules", type=int, default=15, help="number of modules in the import report")
+    parser.add_argument("--show", action="store_true", help="paint the plot on the screen, not offscreen")
+    args = parser.parse_args()
+
+    environment = dict(os.environ)
+    if not args.show:
+        environment["QT_QPA_PLATFORM"] = "offscreen"
+
+    version = "import sys; from hyspecppt.hyspecpptmain import gui; sys.argv = ['hyspecppt', '--version']; gui()"
+    report = {
+        "python startup": [wall_time(["-c", "pass"], environment) for _ in range(args.repeat)],
+        "hyspecppt --version": [wall_time(["-c", version], environment) for _ in range(args.repeat)],
+        "import hyspecppt.batch": [
+            wall_time(["-c", "import hyspecppt.batch"], environment) for _ in range(args.repeat)
+        ],
+        "first painted plot": [
+            float(run_python(["-c", FIRST_PLOT_SCRIPT, str(time.time())], environment).stdout.split()[-1])
+            for _ in range(args.repeat)
+        ],
+    }
+    print(f"Median of {args.repeat} runs, in seconds")
+    for name, times in report.items():
+        print(f"  {name:<24}{statistics.median(times):8.3f}  (min {min(times):.3f}, max {max(times):.3f})")
+
+    # import times of the main window; each run is a new process, so nothing is cached in sys.modules
+    runs = [
+        parse_importtime(run_python(["-X", "importtime", "-c", "import hyspecppt.mainwindow"], environment).stderr)
+        for _ in range(args.repeat)
+    ]
+    modules = {module: statistics.median(run.get(module, 0.0) for run in runs) for module in runs[0]}
+    print(f"\nSlowest imports of the main window (cumulative median, {len(modules)} modules)")
+    for module, cumulative in sorted(modules.items(), key=lambda item: item[1], reverse=True)[: args.modules]:
+        print(f"  {module:<48}{cumulative:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
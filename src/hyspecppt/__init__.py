@@ -12,6 +12,6 @@ def Hyspecppt():  # noqa: N802
     This is needed for backward compatibility because mantid workbench does
     "from hyspecppt import Hyspecppt"
     """
-    from .hyspecpptmain import HyspecPPT as hyspecppt  # noqa: E501, N813
+    from .mainwindow import HyspecPPT as hyspecppt  # noqa: E501, N813
 
     return hyspecppt()
@@ -0,0 +1,334 @@
+"""Batch calculation of polarization maps, without a graphical interface
+
+The configurations are read from a JSON, CSV or INI file. Each configuration sets any of the
+experiment parameters (Ei, S2, alpha_p, plot_type), the crosshair (mode, DeltaE, modQ) and the lattice
+(a, b, c, alpha, beta, gamma, h, k, l); the missing parameters take the default values of the
+application. The maps and summary metrics are written to a NPZ file, or to a HDF5 file if h5py
+is installed. Qt is never imported, and matplotlib only if the maps are rendered.
+"""
+
+import argparse
+import csv
+import importlib.util
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from configparser import ConfigParser
+from functools import partial
+
+import numpy as np
+
+from hyspecppt import __version__
+from hyspecppt.cache import DEFAULT_MAX_SIZE_MB, ResultCache
+from hyspecppt.configuration import get_configuration
+from hyspecppt.hppt import hppt_model
+from hyspecppt.hppt.experiment_settings import (
+    DEFAULT_CROSSHAIR,
+    DEFAULT_EXPERIMENT,
+    DEFAULT_LATTICE,
+    DEFAULT_MODE,
+    N_POINTS,
+    PLOT_TYPES,
+)
+from hyspecppt.hppt.hppt_model import HyspecPPTModel, set_geometry_cache
+
+logger = logging.getLogger("hyspecppt")
+
+# parameters of a configuration; nested sections of a JSON configuration are flattened
+FLOAT_PARAMETERS = ("Ei", "S2", "alpha_p", "DeltaE", "modQ", *DEFAULT_LATTICE)
+SECTIONS = ("experiment", "crosshair", "lattice")
+MODES = ("single_crystal", "powder")
+
+# arrays of each map, and scalar metrics of the summary
+MAP_KEYS = ("Q", "E", "Q_low", "Q_hi", "intensity")
+SUMMARY_KEYS = (
+    "Ei",
+    "S2",
+    "alpha_p",
+    "DeltaE",
+    "modQ",
+    "Emin",
+    "alpha_s",
+    "intensity_at_crosshair",
+    "ang_Q_beam",
+    "in_coverage",
+    "coverage_fraction",
+    "intensity_min",
+    "intensity_max",
+    "intensity_mean",
+)
+
+
+def normalize_configuration(configuration: dict, index: int = 0) -> dict:
+    """Returns a complete configuration, with the default values for the missing parameters
+
+    Args:
+        configuration: parameters, flat or nested in experiment, crosshair and lattice sections
+        index: position in the input file, used for the default name
+
+    Raises:
+        ValueError: if a parameter is unknown or invalid
+
+    """
+    flat = {}
+    for key, value in configuration.items():
+        if key in SECTIONS and isinstance(value, dict):
+            flat.update(value)
+        else:
+            flat[key] = value
+    if "current_experiment_type" in flat:
+        flat["mode"] = flat.pop("current_experiment_type")
+
+    result = dict(
+        name=f"config_{index:04d}",
+        **DEFAULT_EXPERIMENT,
+        mode=DEFAULT_MODE["current_experiment_type"],
+        **DEFAULT_CROSSHAIR,
+        **DEFAULT_LATTICE,
+    )
+    for key, value in flat.items():
+        # empty cells of a CSV file take the default value
+        if value is None or value == "":
+            continue
+        if key not in result:
+            raise ValueError(f"Unknown parameter {key} in configuration {index}")
+        result[key] = _parse_value(key, value)
+    return result
+
+
+def _parse_value(key: str, value: str) -> float | str:
+    """Returns the value of a parameter; the plot type can be given by its index in PLOT_TYPES"""
+    if key in FLOAT_PARAMETERS:
+        return float(value)
+    if key == "plot_type" and value not in PLOT_TYPES:
+        try:
+            return PLOT_TYPES[int(value)]
+        except (ValueError, IndexError):
+            raise ValueError(f"Invalid plot_type {value}, expected an index up to {len(PLOT_TYPES) - 1}") from None
+    if key == "mode" and value not in MODES:
+        raise ValueError(f"Invalid mode {value}, expected one of {MODES}")
+    return str(value)
+
+
+def read_configurations(file_path: str) -> list[dict]:
+    """Read the configurations from a JSON, CSV or INI file
+
+    A JSON file contains a list of configurations, or an object with the list in "configurations".
+    A CSV file has one configuration per row, with the parameter names in the header. An INI file
+    has one configuration per section, named after the section.
+
+    Args:
+        file_path: path of the file, the format is given by the extension
+
+    Returns:
+        list of complete configurations
+
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".json":
+        with open(file_path, encoding="utf8") as json_file:
+            configurations = json.load(json_file)
+        if isinstance(configurations, dict):
+            configurations = configurations["configurations"]
+    elif extension == ".csv":
+        with open(file_path, newline="", encoding="utf8") as csv_file:
+            configurations = list(csv.DictReader(csv_file))
+    elif extension in (".ini", ".cfg"):
+        config = ConfigParser()
+        config.optionxform = str
+        config.read(file_path, encoding="utf8")
+        configurations = [dict(config[section], name=section) for section in config.sections()]
+    else:
+        raise ValueError(f"Unsupported configuration file {file_path}, expected .json, .csv or .ini")
+    configurations = [
+        normalize_configuration(configuration, index) for index, configuration in enumerate(configurations)
+    ]
+    names = [configuration["name"] for configuration in configurations]
+    if len(set(names)) != len(names):
+        raise ValueError("The names of the configurations must be unique")
+    return configurations
+
+
+def compute_configuration(configuration: dict, n_points: int = N_POINTS) -> dict[str, np.array]:
+    """Calculate the map and the summary metrics of one configuration
+
+    Args:
+        configuration: complete configuration, as returned by normalize_configuration
+        n_points: number of points along each axis of the map
+
+    Returns:
+        dictionary with the arrays of MAP_KEYS and the scalars of SUMMARY_KEYS, the name and the plot_type
+
+    """
+    model = HyspecPPTModel()
+    model.set_session_state(configuration)
+
+    # n_points x n_points from Emin, instead of the extended grid of the interactive maps
+    graph_data = model.calculate_graph_data(n_points=n_points, exact_grid=True)
+    crosshair = model.get_crosshair_data()
+    point = model.calculate_point_data(crosshair["modQ"], crosshair["DeltaE"])
+    intensity = np.array(graph_data["intensity"])
+    covered = np.isfinite(intensity)
+
+    result = dict(
+        name=configuration["name"],
+        plot_type=graph_data["plot_type"],
+        Q=np.array(graph_data["Q"]),
+        E=np.array(graph_data["E"]),
+        Q_low=np.array(graph_data["Q_low"]),
+        Q_hi=np.array(graph_data["Q_hi"]),
+        intensity=intensity,
+        Ei=model.Ei,
+        S2=model.S2,
+        alpha_p=model.alpha_p,
+        DeltaE=crosshair["DeltaE"],
+        modQ=crosshair["modQ"],
+        Emin=model.Emin,
+        alpha_s=float(point["alpha_s"]),
+        intensity_at_crosshair=float(point[model.plot_type]),
+        ang_Q_beam=float(point["ang_Q_beam"]),
+        in_coverage=bool(point["in_coverage"]),
+        coverage_fraction=covered.mean(),
+    )
+    result.update(
+        intensity_min=intensity[covered].min() if covered.any() else np.nan,
+        intensity_max=intensity[covered].max() if covered.any() else np.nan,
+        intensity_mean=intensity[covered].mean() if covered.any() else np.nan,
+    )
+    return result
+
+
+def run_batch(configurations: list[dict], n_points: int = N_POINTS, processes: int = 0) -> list[dict]:
+    """Calculate all the configurations, in a process pool if processes is larger than 1
+
+    The worker processes use the geometry cache set in this process by set_geometry_cache.
+
+    Args:
+        configurations: complete configurations
+        n_points: number of points along each axis of the maps
+        processes: number of worker processes, 0 or 1 to run in this process
+
+    """
+    calculate = partial(compute_configuration, n_points=n_points)
+    if processes > 1 and len(configurations) > 1:
+        with ProcessPoolExecutor(
+            max_workers=processes, initializer=set_geometry_cache, initargs=(hppt_model.GEOMETRY_CACHE,)
+        ) as executor:
+            return list(executor.map(calculate, configurations))
+    return [calculate(configuration) for configuration in configurations]
+
+
+def collect_arrays(results: list[dict]) -> dict[str, np.array]:
+    """Returns the results as arrays named <configuration name>/<key>, and summary/<key> with one element per map"""
+    names = [result["name"] for result in results]
+    arrays = {}
+    for result in results:
+        for key in MAP_KEYS:
+            arrays[f"{result['name']}/{key}"] = result[key]
+        arrays[f"{result['name']}/plot_type"] = np.array(result["plot_type"])
+    arrays["summary/name"] = np.array(names)
+    arrays["summary/plot_type"] = np.array([result["plot_type"] for result in results])
+    for key in SUMMARY_KEYS:
+        arrays[f"summary/{key}"] = np.array([result[key] for result in results])
+    return arrays
+
+
+def write_results(results: list[dict], file_path: str) -> None:
+    """Write the maps and the summary to a NPZ or HDF5 file
+
+    Args:
+        results: results of compute_configuration
+        file_path: output path; .h5 or .hdf5 write a HDF5 file, anything else a compressed NPZ file
+
+    """
+    arrays = collect_arrays(results)
+    if os.path.splitext(file_path)[1].lower() in (".h5", ".hdf5"):
+        import h5py
+
+        with h5py.File(file_path, "w") as h5_file:
+            h5_file.attrs["hyspecppt_version"] = __version__
+            for key, value in arrays.items():
+                if value.dtype.kind == "U":
+                    h5_file.create_dataset(key, data=value.astype(object), dtype=h5py.string_dtype())
+                else:
+                    h5_file.create_dataset(key, data=value)
+    else:
+        np.savez_compressed(file_path, **arrays)
+
+
+def render_results(results: list[dict], directory: str) -> list[str]:
+    """Save a PNG image of each map
+
+    Args:
+        results: results of compute_configuration
+        directory: output directory, created if needed
+
+    Returns:
+        paths of the images
+
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for result in results:
+        figure, ax = plt.subplots()
+        mesh = ax.pcolormesh(result["Q"], result["E"], result["intensity"].T, cmap="jet", shading="nearest")
+        ax.plot(result["Q_low"], result["E"], result["Q_hi"], result["E"])
+        ax.plot(result["modQ"], result["DeltaE"], "k+", markersize=12)
+        figure.colorbar(mesh, ax=ax, label=result["plot_type"])
+        ax.set_xlabel(r"$|Q| (\AA^{-1})$")
+        ax.set_ylabel(r"$\Delta E$ (meV)")
+        ax.set_title(result["name"])
+        path = os.path.join(directory, f"{result['name']}.png")
+        figure.savefig(path)
+        plt.close(figure)
+        paths.append(path)
+    return paths
+
+
+def main(argv: list[str] = None) -> int:
+    """Entry point of the hyspecppt-batch console script
+
+    Args:
+        argv: command line arguments, sys.argv if not set
+
+    """
+    parser = argparse.ArgumentParser(prog="hyspecppt-batch", description="Calculate polarization maps in batch")
+    parser.add_argument("configurations", help="JSON, CSV or INI file with the configurations")
+    parser.add_argument("-o", "--output", default="hyspecppt_maps.npz", help="output NPZ, or HDF5 (.h5) file")
+    parser.add_argument("-n", "--grid-points", type=int, default=N_POINTS, help="points along each axis of the maps")
+    parser.add_argument("-j", "--processes", type=int, default=0, help="number of worker processes")
+    parser.add_argument(
+        "--cache-size", type=float, help="size limit of the result cache in MB, 0 disables it (default: configuration)"
+    )
+    parser.add_argument("--render", metavar="DIRECTORY", help="save a PNG image of each map in this directory")
+    parser.add_argument("-v", "--version", action="version", version=__version__)
+    args = parser.parse_args(argv)
+
+    try:
+        configurations = read_configurations(args.configurations)
+    except (OSError, ValueError, KeyError) as err:
+        parser.error(f"cannot read {args.configurations}: {err}")
+    if os.path.splitext(args.output)[1].lower() in (".h5", ".hdf5") and importlib.util.find_spec("h5py") is None:
+        parser.error("h5py is required to write HDF5 files")
+
+    cache_size = args.cache_size
+    if cache_size is None:
+        cache_size = get_configuration().get_float("global.performance", "cache_size_mb", DEFAULT_MAX_SIZE_MB)
+    set_geometry_cache(ResultCache(max_size_mb=cache_size) if cache_size > 0 else None)
+    results = run_batch(configurations, n_points=args.grid_points, processes=args.processes)
+    write_results(results, args.output)
+    logger.info(f"{len(results)} maps written to {args.output}")
+    if args.render:
+        render_results(results, args.render)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
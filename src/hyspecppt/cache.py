@@ -0,0 +1,176 @@
+"""Persistent cache of calculated arrays in the SHOME/.hyspecppt/cache directory
+
+The arrays are stored as .npy files, named after a hash of the quantized inputs and the version
+of the package, and loaded memory-mapped. The least recently used files are removed when the
+size of the directory exceeds the limit.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from hyspecppt import __version__
+
+logger = logging.getLogger("hyspecppt")
+
+# cache directory, next to the configuration file
+CACHE_DIRECTORY = os.path.join(Path.home(), ".hyspecppt", "cache")
+# default size limit in MB
+DEFAULT_MAX_SIZE_MB = 512
+# number of significant digits of the floating point inputs in the keys
+QUANTIZATION_DIGITS = 10
+
+
+def _quantize(value):
+    """Returns a JSON serializable value, with floating point numbers rounded to QUANTIZATION_DIGITS"""
+    if isinstance(value, (float, np.floating)):
+        return float(f"{value:.{QUANTIZATION_DIGITS}g}")
+    if isinstance(value, (int, np.integer, str, bool)) or value is None:
+        return value.item() if isinstance(value, np.generic) else value
+    if isinstance(value, dict):
+        return {str(key): _quantize(item) for key, item in sorted(value.items())}
+    return [_quantize(item) for item in value]
+
+
+class ResultCache:
+    """Content addressed cache of arrays on disk, with a size bounded least recently used eviction"""
+
+    directory: str
+    max_size: int
+    hits: int
+    misses: int
+
+    def __init__(self, directory: str = None, max_size_mb: float = DEFAULT_MAX_SIZE_MB) -> None:
+        """Constructor
+
+        Args:
+            directory: cache directory, created when the first array is stored, CACHE_DIRECTORY if not set
+            max_size_mb: maximum size of the stored arrays in MB
+
+        """
+        self.directory = directory or CACHE_DIRECTORY
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        """State sent to worker processes, without the lock"""
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        """Restore the state in a worker process"""
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name: str, **inputs) -> str:
+        """Returns the key of a result from its name and its inputs
+
+        Args:
+            name: name of the calculation
+            inputs: inputs of the calculation; floating point numbers are quantized
+
+        """
+        description = json.dumps([name, __version__, _quantize(inputs)], sort_keys=True)
+        return hashlib.sha256(description.encode("utf8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        """Returns the path of the file of a key"""
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def load(self, key: str) -> np.array:
+        """Returns the read-only, memory-mapped array of a key, or None if it is not in the cache"""
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            array = None
+        except (OSError, ValueError) as err:
+            logger.warning(f"Removing the invalid cache file {path}: {err}")
+            self._remove(path)
+            array = None
+        if array is not None:
+            # the modification time orders the files for the eviction; a read-only cache keeps its order
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        with self._lock:
+            if array is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return array
+
+    def save(self, key: str, array: np.array) -> None:
+        """Store an array, then evict the least recently used arrays if the cache is too large"""
+        if self.max_size <= 0:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file, so that other threads and processes never read a partial file
+        temporary_path = os.path.join(self.directory, f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(temporary_path, "wb") as npy_file:
+                np.save(npy_file, np.asarray(array))
+            os.replace(temporary_path, self._path(key))
+        except OSError as err:
+            logger.warning(f"Cannot write to the cache {self.directory}: {err}")
+            self._remove(temporary_path)
+            return
+        self.evict()
+
+    def get_or_calculate(self, name: str, calculate: Callable[[], np.array], **inputs) -> np.array:
+        """Returns the cached result of a calculation, and stores it if it is not in the cache
+
+        Args:
+            name: name of the calculation
+            calculate: function that returns the array
+            inputs: inputs of the calculation
+
+        """
+        if self.max_size <= 0:
+            return calculate()
+        key = self.key(name, **inputs)
+        array = self.load(key)
+        if array is None:
+            array = calculate()
+            self.save(key, array)
+        return array
+
+    def evict(self) -> None:
+        """Remove the least recently used arrays until the cache is within its size limit"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".npy")]
+            files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries)
+        except OSError:
+            return
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in files:
+            if size <= self.max_size:
+                break
+            self._remove(path)
+            size -= file_size
+
+    def clear(self) -> None:
+        """Remove all the arrays"""
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".npy"):
+                    self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        """Remove a file, ignoring the files already removed by another process"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -8,6 +8,7 @@ import os
 import shutil
 from configparser import ConfigParser
 from pathlib import Path
+from typing import Any, Callable
 
 logger = logging.getLogger("hyspecppt")
 
@@ -55,22 +56,28 @@ class Configuration:
     def validate(self):
         """Validates that the fields exist at the config_file_path and writes any missing fields/data
         using the template configuration file: configuration_template.ini as a guide
+
+        The file is only written if fields are added.
         """
         template_config = ConfigParser(allow_no_value=True, comment_prefixes="/")
         template_config.read(self.template_file_path)
+        changed = False
         for section in template_config.sections():
             # if section is missing
             if section not in self.config.sections():
                 # copy the whole section
                 self.config.add_section(section)
+                changed = True
 
             for item in template_config.items(section):
                 field, _ = item
                 if field not in self.config[section]:
                     # copy the field
                     self.config[section][field] = template_config[section][field]
-        with open(self.config_file_path, "w", encoding="utf8") as config_file:
-            self.config.write(config_file)
+                    changed = True
+        if changed:
+            with open(self.config_file_path, "w", encoding="utf8") as config_file:
+                self.config.write(config_file)
         self.valid = True
 
     def is_valid(self):
@@ -78,14 +85,52 @@ class Configuration:
         return self.valid
 
 
-def get_data(section, name=None):
-    """Retrieves the configuration data for a variable with name"""
-    # default file path location
-    config_file_path = CONFIG_PATH_FILE
-    if os.path.exists(config_file_path):
-        config = ConfigParser()
-        # parse the file
-        config.read(config_file_path)
+class ConfigurationService:
+    """Parsed configuration file, read again only when the file changes
+
+    The modification time and the size of the file are checked at each access. The typed values
+    are cached until the file changes.
+    """
+
+    def __init__(self, config_file_path: str):
+        """Constructor
+
+        Args:
+            config_file_path: path of the configuration file
+
+        """
+        self.config_file_path = config_file_path
+        self._signature = None
+        self._config = None
+        self._values = {}
+
+    def _load(self) -> ConfigParser:
+        """Returns the parsed file, None if it does not exist"""
+        try:
+            stat = os.stat(self.config_file_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+        if signature != self._signature:
+            self._signature = signature
+            self._values = {}
+            self._config = None
+            if signature is not None:
+                self._config = ConfigParser()
+                self._config.read(self.config_file_path)
+        return self._config
+
+    def get(self, section: str, name: str = None):
+        """Retrieves the configuration data for a variable with name, or the section if name is empty
+
+        Returns:
+            the value, cast to bool for True and False and to None for None; None if the file,
+            the section or the field do not exist
+
+        """
+        config = self._load()
+        if config is None:
+            return None
         try:
             if name:
                 value = config[section][name]
@@ -101,4 +146,53 @@ def get_data(section, name=None):
             # requested section/field do not exist
             logger.error(str(err))
             return None
-    return None
+
+    def get_typed(self, section: str, name: str, value_type: Callable[[str], Any], default: Any = None) -> Any:
+        """Retrieves a value converted to a type, or the default if it is missing or invalid
+
+        Args:
+            section: section of the file
+            name: name of the field
+            value_type: conversion function, for example int or float
+            default: value returned if the field is missing, empty or invalid
+
+        """
+        self._load()
+        key = (section, name, value_type)
+        if key not in self._values:
+            value = self.get(section, name)
+            try:
+                self._values[key] = None if value in (None, "") else value_type(value)
+            except (TypeError, ValueError):
+                logger.error(f"Invalid value {value} for {name} in {self.config_file_path}")
+                self._values[key] = None
+        value = self._values[key]
+        return default if value is None else value
+
+    def get_int(self, section: str, name: str, default: int = None) -> int:
+        """Retrieves an integer value"""
+        return self.get_typed(section, name, int, default)
+
+    def get_float(self, section: str, name: str, default: float = None) -> float:
+        """Retrieves a floating point value"""
+        return self.get_typed(section, name, float, default)
+
+    def get_str(self, section: str, name: str, default: str = None) -> str:
+        """Retrieves a string value"""
+        return self.get_typed(section, name, str, default)
+
+
+# one service per configuration file path
+_services = {}
+
+
+def get_configuration() -> ConfigurationService:
+    """Returns the configuration service of the current configuration file path"""
+    if CONFIG_PATH_FILE not in _services:
+        _services[CONFIG_PATH_FILE] = ConfigurationService(CONFIG_PATH_FILE)
+    return _services[CONFIG_PATH_FILE]
+
+
+def get_data(section, name=None):
+    """Retrieves the configuration data for a variable with name"""
+    return get_configuration().get(section, name)
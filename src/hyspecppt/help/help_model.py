@@ -1,12 +1,13 @@
 """single help module"""
 
-import webbrowser
-
 from hyspecppt.configuration import get_data
 
 
 def help_function(context):
     """Open a browser with the appropriate help page"""
+    # imported when the help is opened, not at startup
+    import webbrowser
+
     help_url = get_data("global.other", "help_url")
     if context:
         webbrowser.open(help_url)
@@ -0,0 +1,103 @@
+"""Pixel geometry of the detector tank"""
+
+import numpy as np
+
+from .experiment_settings import SE2K, TANK_HALF_WIDTH
+
+# nominal HYSPEC tank: 20 eight-packs of 128 pixel tubes over 2 * TANK_HALF_WIDTH,
+# at 4.5 m from the sample, with 1.2 m long tubes
+N_PACKS = 20
+TUBES_PER_PACK = 8
+PIXELS_PER_TUBE = 128
+# angle between neighbouring tubes of an eight-pack, the remainder of the pack width is a gap
+TUBE_SPACING = 0.34
+# vertical half-width of the tubes
+VERTICAL_HALF_WIDTH = np.degrees(np.arctan2(0.6, 4.5))
+
+
+class DetectorGeometry:
+    """Angles of the detector pixels, relative to the center of the tank
+
+    The horizontal angles are measured from the center of the tank towards larger scattering angles,
+    and the vertical angles from the horizontal plane. Both are stored as read-only float32 arrays
+    with one element per pixel.
+    """
+
+    horizontal: np.array
+    vertical: np.array
+
+    def __init__(self, horizontal: np.array, vertical: np.array) -> None:
+        """Constructor
+
+        Args:
+            horizontal: horizontal angles of the pixels in degrees, relative to the center of the tank
+            vertical: vertical angles of the pixels in degrees, with the same shape as horizontal
+
+        """
+        horizontal, vertical = np.broadcast_arrays(np.asarray(horizontal), np.asarray(vertical))
+        self.horizontal = np.array(horizontal, dtype=np.float32).ravel()
+        self.vertical = np.array(vertical, dtype=np.float32).ravel()
+        self.horizontal.flags.writeable = False
+        self.vertical.flags.writeable = False
+
+    def __len__(self) -> int:
+        """Number of pixels"""
+        return len(self.horizontal)
+
+    @classmethod
+    def hyspec(cls, pixels_per_tube: int = PIXELS_PER_TUBE) -> "DetectorGeometry":
+        """Returns the nominal geometry of the HYSPEC tank
+
+        Args:
+            pixels_per_tube: number of pixels along each tube
+
+        """
+        pack_width = 2 * TANK_HALF_WIDTH / N_PACKS
+        pack_centers = -TANK_HALF_WIDTH + pack_width * (np.arange(N_PACKS) + 0.5)
+        tube_offsets = TUBE_SPACING * (np.arange(TUBES_PER_PACK) - (TUBES_PER_PACK - 1) / 2)
+        tubes = (pack_centers[:, None] + tube_offsets).ravel()
+        # pixels are equally spaced along the vertical tubes
+        heights = np.linspace(-1, 1, 2 * pixels_per_tube + 1)[1::2] * np.tan(np.radians(VERTICAL_HALF_WIDTH))
+        return cls(tubes[:, None], np.degrees(np.arctan(heights))[None, :])
+
+
+def pixel_kinematics(
+    geometry: DetectorGeometry, Ei: float, S2: float, alpha_p: float, DeltaE: np.array
+) -> dict[str, np.array]:
+    """Calculate the momentum transfer and the Scharpf angle for each pixel and energy transfer
+
+    The tank is centered at S2. Q = ki - kf includes the vertical component for pixels out of the
+    horizontal plane; the polarization is in the horizontal plane, at alpha_p from the beam.
+
+    Args:
+        geometry: pixel angles
+        Ei: incident energy
+        S2: detector angle S2
+        alpha_p: polarization angle
+        DeltaE: energy transfers, with shape (E,)
+
+    Returns:
+        dictionary with modQ and cos_ang_PQ, the cosine of the Scharpf angle, with shape (pixels, E),
+        NAN where DeltaE is not smaller than Ei
+
+    """
+    DeltaE = np.asarray(DeltaE, dtype=float).ravel()
+    ki = np.sqrt(Ei) * SE2K
+    with np.errstate(invalid="ignore"):
+        kf = np.sqrt(Ei - DeltaE) * SE2K
+
+    # direction of kf for each pixel; the tank is mirrored for negative S2
+    horizontal = np.radians(S2 + np.sign(S2 or 1) * geometry.horizontal.astype(float))
+    vertical = np.radians(geometry.vertical.astype(float))
+    direction = np.stack(
+        [np.cos(vertical) * np.sin(horizontal), np.sin(vertical), np.cos(vertical) * np.cos(horizontal)], axis=1
+    )
+
+    # Q = ki - kf, with shape (pixels, E) for each component
+    Qx = -direction[:, 0, None] * kf
+    Qy = -direction[:, 1, None] * kf
+    Qz = ki - direction[:, 2, None] * kf
+    modQ = np.sqrt(Qx**2 + Qy**2 + Qz**2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cos_ang_PQ = (Qx * np.sin(np.radians(alpha_p)) + Qz * np.cos(np.radians(alpha_p))) / modQ
+    return dict(modQ=modQ, cos_ang_PQ=cos_ang_PQ)
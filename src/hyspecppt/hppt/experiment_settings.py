@@ -1,5 +1,7 @@
 """Definition of constants and default parameters"""
 
+import numpy as np
+
 # unicode
 alpha = "\u03b1"
 beta = "\u03b2"
@@ -24,8 +26,16 @@ DEFAULT_MODE = dict(current_experiment_type="single_crystal")
 MAX_MODQ = 15
 # number of points in the plot
 N_POINTS = 200
+# number of points in the first plot of the progressive refinement
+N_POINTS_COARSE = 50
 # tank half-width
 TANK_HALF_WIDTH = 30.0
+# physical constants in SI units (CODATA 2022), instead of importing scipy at startup
+ELEMENTARY_CHARGE = 1.602176634e-19
+PLANCK_CONSTANT = 6.62607015e-34
+NEUTRON_MASS = 1.67492750056e-27
+# constant to transform from energy in meV to momentum in Angstrom^-1
+SE2K = np.sqrt(2e-3 * ELEMENTARY_CHARGE * NEUTRON_MASS) * 1e-10 / (PLANCK_CONSTANT / (2 * np.pi))
 
 
 # invalid style
@@ -1,10 +1,17 @@
 """Model for the polarization planning tool"""
 
 import logging
+import threading
+import weakref
+from collections import OrderedDict, namedtuple
+from functools import lru_cache, partial, update_wrapper
+from typing import Callable, Optional
 
 import numpy as np
-from scipy.constants import e, hbar, m_n
 
+from hyspecppt.cache import ResultCache
+
+from .detector import DetectorGeometry, pixel_kinematics
 from .experiment_settings import (
     DEFAULT_CROSSHAIR,
     DEFAULT_EXPERIMENT,
@@ -12,12 +19,537 @@ from .experiment_settings import (
     DEFAULT_MODE,
     MAX_MODQ,
     N_POINTS,
+    N_POINTS_COARSE,
     PLOT_TYPES,
+    SE2K,
     TANK_HALF_WIDTH,
 )
+from .orientation import rotation_sweep, ub_matrix
+from .reflections import ReflectionIndex
 
 logger = logging.getLogger("hyspecppt")
 
+# plotted quantity as a function of the cosine of the Scharpf angle
+PLOT_FUNCTIONS = {
+    PLOT_TYPES[0]: lambda cos_ang_PQ: np.degrees(np.arccos(cos_ang_PQ)),  # alpha
+    PLOT_TYPES[1]: lambda cos_ang_PQ: cos_ang_PQ**2,  # cos^2(alpha)
+    PLOT_TYPES[2]: lambda cos_ang_PQ: (cos_ang_PQ**2 + 1) / 2,  # "(cos^2(a)+1)/2"
+    PLOT_TYPES[3]: lambda cos_ang_PQ: 2 * cos_ang_PQ**2 - 1,  # cos^2(alpha) - sin^2(alpha)
+}
+
+# the plotted quantities written into an output array, which can be the input array, without temporaries
+PLOT_KERNELS = {
+    PLOT_TYPES[0]: lambda cos_ang_PQ, out: np.degrees(np.arccos(cos_ang_PQ, out=out), out=out),
+    PLOT_TYPES[1]: lambda cos_ang_PQ, out: np.square(cos_ang_PQ, out=out),
+    PLOT_TYPES[2]: lambda cos_ang_PQ, out: np.divide(np.add(np.square(cos_ang_PQ, out=out), 1, out=out), 2, out=out),
+    PLOT_TYPES[3]: lambda cos_ang_PQ, out: np.subtract(
+        np.multiply(np.square(cos_ang_PQ, out=out), 2, out=out), 1, out=out
+    ),
+}
+
+# derived products of the model and the inputs they depend on; Emin is derived from Ei and DeltaE,
+# so a new DeltaE only changes the map if it changes Emin
+PRODUCT_INPUTS = {
+    "E": ("Ei", "Emin"),
+    "coverage": ("Ei", "S2", "Emin"),
+    "geometry": ("Ei", "S2", "Emin"),
+    "intensity": ("Ei", "S2", "Emin", "alpha_p", "plot_type"),
+    "ang_Q_beam": ("Ei", "S2", "DeltaE", "mode", "modQ", "lattice", "hkl"),
+    "reflections": ("Ei", "S2", "Emin", "DeltaE", "mode", "lattice"),
+}
+
+
+# persistent cache of the reduced geometry, shared by all the models; not used if None
+GEOMETRY_CACHE: ResultCache = None
+# reduced geometry of the maps restored from sessions, by (S2, e_min, n_points)
+_RESTORED_GEOMETRY: dict[tuple[float, float, int], dict[str, np.array]] = {}
+# memory of the geometry kept in this process, in bytes: the extensible grids, the grids of the maps beyond
+# their extension, and the maps restored from sessions. An extended grid of 2000 points is 128 MB
+MAX_GRID_BYTES = 1 << 30
+MAX_REGRIDDED_BYTES = 1 << 28
+MAX_RESTORED_BYTES = 1 << 28
+# geometry grids in the cache of _geometry_grid, by (S2, n_points), to find the calculated resolutions
+_GEOMETRY_GRIDS: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+# largest size of an extended geometry grid along each axis, in units of n_points; a map that needs
+# a larger grid is calculated on a new grid with n_points along each axis
+MAX_GRID_EXTENSION = 2
+# arrays of the reduced geometry, and the arrays stored in a session for each map
+GEOMETRY_KEYS = ("e", "q_low", "q_hi", "q", "phi_Q")
+MAP_ARRAY_KEYS = ("S2", "e_min", "n_points", "alpha_p", *GEOMETRY_KEYS, "plot_type", "intensity")
+
+
+class GridWorkspace:
+    """Preallocated buffers of the grid kernels
+
+    Each buffer grows to the largest grid requested, and smaller grids are views of its beginning,
+    so the stages of the progressive refinement and the blocks of a sweep reuse the same memory.
+    A buffer is overwritten by the next request with the same name, so the arrays that are kept,
+    such as the cached geometry and the memoized intensities, are never workspace buffers.
+    """
+
+    def __init__(self) -> None:
+        """Constructor"""
+        self._buffers = {}
+
+    def get(self, name: str, shape: tuple[int, ...], dtype: np.dtype = np.float64) -> np.array:
+        """Returns an uninitialized buffer
+
+        Args:
+            name: name of the buffer, different for the buffers used at the same time
+            shape: shape of the grid
+            dtype: type of the elements
+
+        """
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        buffer = self._buffers.get((name, dtype))
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, dtype=dtype)
+            self._buffers[(name, dtype)] = buffer
+        return buffer[:size].reshape(shape)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the buffers in bytes"""
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def clear(self) -> None:
+        """Release the buffers"""
+        self._buffers = {}
+
+
+# workspace of the grid kernels in each thread, since the maps are calculated in worker threads
+_THREAD_DATA = threading.local()
+
+
+def _thread_workspace() -> GridWorkspace:
+    """Returns the workspace of the current thread"""
+    if not hasattr(_THREAD_DATA, "workspace"):
+        _THREAD_DATA.workspace = GridWorkspace()
+    return _THREAD_DATA.workspace
+
+
+def _reduced_phi_Q(S2: float, e_axis: np.array, q_axis: np.array, workspace: GridWorkspace = None) -> np.array:
+    """Returns the direction of Q on a grid of reduced energy and momentum transfers
+
+    The intermediate grids are buffers of the workspace; only phi_Q is a new array.
+
+    Args:
+        S2: detector angle S2
+        e_axis: energy transfers in units of Ei
+        q_axis: momentum transfers in units of ki
+        workspace: buffers of the intermediate grids, the workspace of the current thread if not set
+
+    Returns:
+        phi_Q with shape (len(q_axis), len(e_axis)), NAN outside the detector tank
+
+    """
+    workspace = workspace or _thread_workspace()
+    # the axes are broadcast against each other: q along the rows, e along the columns
+    r2d = np.sqrt(1 - np.asarray(e_axis, dtype=float))[np.newaxis, :]
+    q2d = np.asarray(q_axis, dtype=float)[:, np.newaxis]
+    shape = (len(q_axis), len(e_axis))
+
+    # Calculate the angle between Q and z axis. Set to NAN values outside the detector range
+    # (with a small tolerance, so that points on the edges of the tank are kept)
+    cos_theta = workspace.get("cos_theta", shape)
+    np.subtract(1 + r2d**2, q2d**2, out=cos_theta)
+    cos_theta /= 2 * r2d
+    outside = workspace.get("outside", shape, bool)
+    np.less(cos_theta, np.cos(np.radians(np.abs(S2) + TANK_HALF_WIDTH)) - 1e-12, out=outside)
+    np.copyto(cos_theta, np.nan, where=outside)
+    np.greater(cos_theta, np.cos(np.radians(np.abs(S2) - TANK_HALF_WIDTH)) + 1e-12, out=outside)
+    np.copyto(cos_theta, np.nan, where=outside)
+
+    # Calculate Qz/ki
+    qz = workspace.get("qz", shape)
+    np.multiply(r2d, cos_theta, out=qz)
+    np.subtract(1, qz, out=qz)
+
+    # Calculate Qx/ki. Note that is in the opposite direction as detector position
+    qx = workspace.get("qx", shape)
+    np.square(cos_theta, out=qx)
+    np.subtract(1, qx, out=qx)
+    np.maximum(qx, 0, out=qx)
+    np.sqrt(qx, out=qx)
+    qx *= r2d
+    if S2 >= TANK_HALF_WIDTH:
+        np.negative(qx, out=qx)
+
+    # Calculate the direction of Q in the horizontal plane. It is undefined for Q = 0
+    phi_Q = np.arctan2(qx, qz)
+    phi_Q[q2d[:, 0] == 0] = np.nan
+    return phi_Q
+
+
+def _tank_edges(S2: float, e_axis: np.array) -> tuple[np.array, np.array]:
+    """Returns the edges of the tank in units of ki, for energy transfers in units of Ei"""
+    # kf/ki for each energy transfer
+    r = np.sqrt(1 - e_axis)
+    q_low = np.sqrt(1 + r**2 - 2 * r * np.cos(np.radians(np.abs(S2) - TANK_HALF_WIDTH)))
+    q_hi = np.sqrt(1 + r**2 - 2 * r * np.cos(np.radians(np.abs(S2) + TANK_HALF_WIDTH)))
+    return q_low, q_hi
+
+
+class _GeometryGrid:
+    """Reduced geometry on a grid with a fixed spacing, extended when lower energy transfers are needed
+
+    The grid starts as n_points x n_points over e in [-1, 0.9] and q in [0, max(q_hi)]. When a lower
+    e_min is requested, rows are added below -1 with the same energy step, and columns are added with
+    the same |Q| step if the tank reaches larger |Q|. Only the new rows and the new columns of the old
+    rows are calculated. The grid is not extended beyond MAX_GRID_EXTENSION * n_points along each axis.
+    The grid is shared by the worker threads, so it is extended under a lock.
+    """
+
+    def __init__(self, S2: float, n_points: int) -> None:
+        """Constructor
+
+        Args:
+            S2: detector angle S2
+            n_points: number of points along each axis for e_min = -1
+
+        """
+        self.S2 = S2
+        self.n_points = n_points
+        self.lock = threading.Lock()
+        self.e = np.linspace(-1, 0.9, n_points)
+        self.q_low, self.q_hi = _tank_edges(S2, self.e)
+        self.q = np.linspace(0, np.max(self.q_hi), n_points)
+        self.e_step = self.e[1] - self.e[0] if n_points > 1 else 1.0
+        self.q_step = self.q[1] - self.q[0] if n_points > 1 and self.q[-1] > 0 else 1.0
+        calculate = partial(_reduced_phi_Q, S2, self.e, self.q)
+        if GEOMETRY_CACHE is None:
+            self.phi_Q = calculate()
+        else:
+            self.phi_Q = GEOMETRY_CACHE.get_or_calculate("reduced_geometry", calculate, S2=S2, n_points=n_points)
+        for array in (self.e, self.q_low, self.q_hi, self.q, self.phi_Q):
+            array.flags.writeable = False
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the arrays of the grid in bytes"""
+        return sum(array.nbytes for array in (self.e, self.q_low, self.q_hi, self.q, self.phi_Q))
+
+    def _extend(self, e_min: float) -> bool:
+        """Add the rows down to e_min, and the columns up to the largest |Q| of the tank
+
+        Returns:
+            False if the extended grid would be larger than MAX_GRID_EXTENSION * n_points along an axis
+
+        """
+        n_rows = int(np.ceil((self.e[0] - e_min) / self.e_step - 1e-9))
+        if len(self.e) + n_rows > MAX_GRID_EXTENSION * self.n_points:
+            return False
+        new_e = self.e[0] - self.e_step * np.arange(n_rows, 0, -1)
+        new_q_low, new_q_hi = _tank_edges(self.S2, new_e)
+        n_columns = max(0, int(np.ceil((np.max(new_q_hi) - self.q[-1]) / self.q_step - 1e-9)))
+        if len(self.q) + n_columns > MAX_GRID_EXTENSION * self.n_points:
+            return False
+        new_q = self.q[-1] + self.q_step * np.arange(1, n_columns + 1)
+
+        e = np.concatenate([new_e, self.e])
+        q = np.concatenate([self.q, new_q])
+        phi_Q = np.empty((len(q), len(e)))
+        phi_Q[:, :n_rows] = _reduced_phi_Q(self.S2, new_e, q)
+        phi_Q[: len(self.q), n_rows:] = self.phi_Q
+        phi_Q[len(self.q) :, n_rows:] = _reduced_phi_Q(self.S2, self.e, new_q)
+
+        # replace the arrays together, the previous ones are still valid for the views already returned
+        self.q_low = np.concatenate([new_q_low, self.q_low])
+        self.q_hi = np.concatenate([new_q_hi, self.q_hi])
+        self.e, self.q, self.phi_Q = e, q, phi_Q
+        for array in (self.e, self.q_low, self.q_hi, self.q, self.phi_Q):
+            array.flags.writeable = False
+        return True
+
+    def get(self, e_min: float) -> Optional[dict[str, np.array]]:
+        """Returns views of the grid from the last row not above e_min
+
+        Args:
+            e_min: minimum energy transfer in units of Ei
+
+        Returns:
+            the geometry, or None if the grid cannot be extended down to e_min
+
+        """
+        with self.lock:
+            if e_min < self.e[0] - 1e-9 * self.e_step and not self._extend(e_min):
+                return None
+            first = max(0, int(np.searchsorted(self.e, e_min + 1e-9 * self.e_step, side="right")) - 1)
+            q_low, q_hi = self.q_low[first:], self.q_hi[first:]
+            n_q = int(np.searchsorted(self.q, np.max(q_hi) - 1e-9 * self.q_step)) + 1
+            return dict(
+                e=self.e[first:],
+                q_low=q_low,
+                q_hi=q_hi,
+                q=self.q[:n_q],
+                phi_Q=self.phi_Q[:n_q, first:],
+            )
+
+
+def _geometry_nbytes(geometry: any) -> int:
+    """Returns the memory of a geometry: a dictionary of arrays, or a geometry grid"""
+    if isinstance(geometry, dict):
+        return sum(np.asarray(array).nbytes for array in geometry.values())
+    return geometry.nbytes
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "currsize", "nbytes"])
+
+
+class _MemoryCache:
+    """Least recently used cache of a function of the geometry, bounded by the memory of the results
+
+    The memory of the geometry grows with the square of the number of points, so the results are
+    evicted when their total memory is above max_bytes; the most recent result is always kept. The memory
+    is measured when a result is added, since an extensible grid grows after it is cached. The views of
+    the evicted results cached by reduced_geometry are dropped, to release them.
+    """
+
+    def __init__(self, function: Callable, max_bytes: int) -> None:
+        """Constructor
+
+        Args:
+            function: function of hashable arguments
+            max_bytes: memory of the cached results
+
+        """
+        update_wrapper(self, function)
+        self.max_bytes = max_bytes
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def __call__(self, *args: any) -> any:
+        """Returns the cached result, or calculates it"""
+        with self._lock:
+            if args in self._results:
+                self._hits += 1
+                self._results.move_to_end(args)
+                return self._results[args]
+            self._misses += 1
+        # calculated outside the lock, like functools.lru_cache
+        result = self.__wrapped__(*args)
+        with self._lock:
+            result = self._results.setdefault(args, result)
+            self._results.move_to_end(args)
+            nbytes = [_geometry_nbytes(cached) for cached in self._results.values()]
+            n_evicted = 0
+            while sum(nbytes[n_evicted:]) > self.max_bytes and n_evicted < len(nbytes) - 1:
+                self._results.popitem(last=False)
+                n_evicted += 1
+        if n_evicted:
+            reduced_geometry.cache_clear()
+        return result
+
+    def cache_info(self) -> CacheInfo:
+        """Returns the hits, the misses, the number of results and their memory"""
+        with self._lock:
+            nbytes = sum(_geometry_nbytes(result) for result in self._results.values())
+            return CacheInfo(self._hits, self._misses, len(self._results), nbytes)
+
+    def cache_clear(self) -> None:
+        """Remove the results"""
+        with self._lock:
+            self._results.clear()
+            self._hits = self._misses = 0
+
+
+def _memory_cache(max_bytes: int) -> Callable[[Callable], _MemoryCache]:
+    """Decorator caching a function of the geometry in a _MemoryCache of max_bytes"""
+    return partial(_MemoryCache, max_bytes=max_bytes)
+
+
+def set_geometry_cache(cache: ResultCache = None) -> None:
+    """Set the persistent cache of the reduced geometry, shared by all the models of the process
+
+    Args:
+        cache: result cache, None to always calculate the geometry
+
+    """
+    global GEOMETRY_CACHE
+    GEOMETRY_CACHE = cache
+
+
+@_memory_cache(MAX_GRID_BYTES)
+def _geometry_grid(S2: float, n_points: int) -> _GeometryGrid:
+    """Returns the extensible geometry grid for a detector angle and a resolution"""
+    grid = _GeometryGrid(S2, n_points)
+    _GEOMETRY_GRIDS[(S2, n_points)] = grid
+    return grid
+
+
+def geometry_calculated(S2: float, e_min: float, n_points: int) -> bool:
+    """Returns True if reduced_geometry returns the geometry without calculating it
+
+    Args:
+        S2: detector angle S2
+        e_min: minimum energy transfer in units of Ei
+        n_points: number of points along each axis, for e_min = -1
+
+    """
+    if (S2, e_min, n_points) in _RESTORED_GEOMETRY:
+        return True
+    grid = _GEOMETRY_GRIDS.get((S2, n_points))
+    return grid is not None and e_min >= grid.e[0] - 1e-9 * grid.e_step
+
+
+@lru_cache(maxsize=32)
+def reduced_geometry(S2: float, e_min: float, n_points: int) -> dict[str, np.array]:
+    r"""Returns the detector coverage and the direction of Q in dimensionless coordinates
+
+    The kinematics only depend on \|Q\|/ki and DeltaE/Ei, so the geometry for any incident energy
+    is obtained by scaling the axes: \|Q\| = ki * q and DeltaE = Ei * e. The in-plane angle
+    phi_Q = atan2(Qx, Qz) does not depend on the polarization, so the cosine of the Scharpf angle
+    is cos(phi_Q - alpha_p). The arrays are cached and read-only.
+
+    The grid spacing only depends on S2 and n_points: the e axis is linspace(-1, 0.9, n_points),
+    extended below -1 with the same step, so that a lower e_min reuses the rows already calculated.
+    The first row is the last grid row not above e_min.
+
+    Args:
+        S2: detector angle S2
+        e_min: minimum energy transfer in units of Ei
+        n_points: number of points along each axis, for e_min = -1
+
+    A geometry restored from a session is returned as it was stored.
+
+    Returns:
+        dictionary with the e and q axes, the edges of the tank q_low and q_hi along e,
+        and phi_Q with shape (len(q), len(e))
+
+    """
+    restored = _RESTORED_GEOMETRY.get((S2, e_min, n_points))
+    if restored is not None:
+        return restored
+    grid = _geometry_grid(S2, n_points)
+    n_rows = len(grid.e)
+    geometry = grid.get(e_min)
+    if geometry is None:
+        return _regridded_geometry(S2, e_min, n_points)
+    if len(geometry["e"]) > n_rows:
+        # the grid was extended: the cached views of its previous arrays are dropped, to release them
+        reduced_geometry.cache_clear()
+    return geometry
+
+
+@_memory_cache(MAX_REGRIDDED_BYTES)
+def _regridded_geometry(S2: float, e_min: float, n_points: int) -> dict[str, np.array]:
+    """Returns the reduced geometry on a new grid with n_points from e_min, for the maps beyond the extended grid"""
+    e = np.linspace(e_min, 0.9, n_points)
+    q_low, q_hi = _tank_edges(S2, e)
+    q = np.linspace(0, np.max(q_hi), n_points)
+    calculate = partial(_reduced_phi_Q, S2, e, q)
+    if GEOMETRY_CACHE is None:
+        phi_Q = calculate()
+    else:
+        phi_Q = GEOMETRY_CACHE.get_or_calculate("regridded_geometry", calculate, S2=S2, e_min=e_min, n_points=n_points)
+    geometry = dict(e=e, q_low=q_low, q_hi=q_hi, q=q, phi_Q=phi_Q)
+    for array in geometry.values():
+        array.flags.writeable = False
+    return geometry
+
+
+def map_geometry(S2: float, e_min: float, n_points: int, exact_grid: bool = False) -> dict[str, np.array]:
+    """Returns the reduced geometry of a map
+
+    Args:
+        S2: detector angle S2
+        e_min: minimum energy transfer in units of Ei
+        n_points: number of points along each axis
+        exact_grid: if True, the grid has n_points along each axis from e_min, instead of the rows of
+                    the extended grid of reduced_geometry below -1
+
+    """
+    if exact_grid and e_min < -1:
+        return _regridded_geometry(S2, e_min, n_points)
+    return reduced_geometry(S2, e_min, n_points)
+
+
+def _restore_geometry(S2: float, e_min: float, n_points: int, geometry: dict[str, np.array]) -> None:
+    """Keep a reduced geometry restored from a session, returned by reduced_geometry for the same inputs"""
+    for array in geometry.values():
+        array.flags.writeable = False
+    _RESTORED_GEOMETRY.pop((S2, e_min, n_points), None)
+    _RESTORED_GEOMETRY[(S2, e_min, n_points)] = geometry
+    # the oldest restored maps are calculated again if they are needed
+    nbytes = sum(_geometry_nbytes(restored) for restored in _RESTORED_GEOMETRY.values())
+    evicted = False
+    while nbytes > MAX_RESTORED_BYTES and len(_RESTORED_GEOMETRY) > 1:
+        nbytes -= _geometry_nbytes(_RESTORED_GEOMETRY.pop(next(iter(_RESTORED_GEOMETRY))))
+        evicted = True
+    if evicted:
+        reduced_geometry.cache_clear()
+
+
+def _plot_intensity(cos_ang_PQ: np.array, plot_type: str) -> np.array:
+    """Returns the plotted quantity of plot_type in a new read-only array, NAN outside the detector tank"""
+    intensity = np.empty_like(cos_ang_PQ)
+    with np.errstate(invalid="ignore"):
+        PLOT_KERNELS[plot_type](cos_ang_PQ, intensity)
+    intensity.flags.writeable = False
+    return intensity
+
+
+def _graph_data(
+    Ei: float,
+    key: tuple,
+    plot_type: str,
+    intensity: Optional[np.array] = None,
+) -> dict[str, np.array]:
+    """Calculate the graph data of a map from the parameters captured by HyspecPPTModel.get_graph_task
+
+    The cosine of the Scharpf angle is a buffer of the workspace of the current thread, so the
+    intensity, which is drawn and kept by the model, is the only new grid.
+
+    Args:
+        Ei: incident energy
+        key: S2, e_min, n_points, alpha_p, dtype and exact_grid of the map
+        plot_type: plotted quantity, one of PLOT_TYPES
+        intensity: read-only intensity of plot_type for key, calculated if None
+
+    """
+    S2, e_min, n_points, alpha_p, dtype, exact_grid = key
+    geometry = map_geometry(S2, e_min, n_points, exact_grid)
+    if intensity is None:
+        cos_ang_PQ = _thread_workspace().get("cos_ang_PQ", geometry["phi_Q"].shape, dtype)
+        np.subtract(geometry["phi_Q"], np.radians(alpha_p), out=cos_ang_PQ)
+        np.cos(cos_ang_PQ, out=cos_ang_PQ)
+        intensity = _plot_intensity(cos_ang_PQ, plot_type)
+
+    # the geometry is calculated in units of ki and Ei, then the axes are scaled
+    ki = np.sqrt(Ei) * SE2K
+    return dict(
+        Q_low=ki * geometry["q_low"],
+        Q_hi=ki * geometry["q_hi"],
+        E=Ei * geometry["e"],
+        Q=ki * geometry["q"],
+        intensity=intensity,
+        plot_type=plot_type,
+        key=key,
+    )
+
+
+def tank_modQ_range(Ei: float, S2: float, DeltaE: float) -> tuple[float, float]:
+    r"""Returns the range of \|Q\| covered by the detector tank at one energy transfer
+
+    Args:
+        Ei: incident energy
+        S2: detector angle S2
+        DeltaE: energy transfer
+
+    Returns:
+        minimum and maximum \|Q\|, NAN if DeltaE is not smaller than Ei
+
+    """
+    ki = np.sqrt(Ei) * SE2K
+    with np.errstate(invalid="ignore"):
+        kf = np.sqrt(Ei - DeltaE) * SE2K
+    q_low = np.sqrt(ki**2 + kf**2 - 2 * ki * kf * np.cos(np.radians(np.abs(S2) - TANK_HALF_WIDTH)))
+    q_hi = np.sqrt(ki**2 + kf**2 - 2 * ki * kf * np.cos(np.radians(np.abs(S2) + TANK_HALF_WIDTH)))
+    return float(q_low), float(q_hi)
+
 
 class SingleCrystalParameters:
     """Model for single crystal calculations"""
@@ -34,6 +566,8 @@ class SingleCrystalParameters:
 
     def __init__(self) -> None:
         """Constructor"""
+        # B matrix of the last lattice, calculated when needed
+        self._B = None
         self.set_parameters(DEFAULT_LATTICE)
 
     def set_parameters(self, params: dict[str, float]) -> None:
@@ -44,6 +578,9 @@ class SingleCrystalParameters:
                 a, b, c, alpha, beta, gamma, h, k, l
 
         """
+        lattice = tuple(params[key] for key in ("a", "b", "c", "alpha", "beta", "gamma"))
+        if self._B is not None and lattice != self._lattice():
+            self._B = None
         self.a = params["a"]
         self.b = params["b"]
         self.c = params["c"]
@@ -72,37 +609,59 @@ class SingleCrystalParameters:
             l=self.l,
         )
 
+    def _lattice(self) -> tuple[float, ...]:
+        """Returns the lattice parameters a, b, c, alpha, beta, gamma"""
+        return (self.a, self.b, self.c, self.alpha, self.beta, self.gamma)
+
+    def get_B_matrix(self) -> np.array:
+        """Returns the B matrix of the lattice, without the 2 pi factor
+
+        The matrix is calculated once for each lattice and is read-only.
+
+        Args:
+
+        """
+        if self._B is None:
+            ca = np.cos(np.radians(self.alpha))
+            sa = np.sin(np.radians(self.alpha))
+            cb = np.cos(np.radians(self.beta))
+            sb = np.sin(np.radians(self.beta))
+            cg = np.cos(np.radians(self.gamma))
+            sg = np.sin(np.radians(self.gamma))
+            vabg = np.sqrt(1 - ca**2 - cb**2 - cg**2 + 2 * ca * cb * cg)
+            astar = sa / (self.a * vabg)
+            bstar = sb / (self.b * vabg)
+            cstar = sg / (self.c * vabg)
+            cbs = (cg * ca - cb) / (sg * sa)
+            cgs = (ca * cb - cg) / (sa * sb)
+
+            # B matrix
+            self._B = np.array(
+                [
+                    [astar, bstar * cgs, cstar * cbs],
+                    [0, bstar * np.sqrt(1 - cgs**2), -cstar * np.sqrt(1 - cbs**2) * ca],
+                    [0, 0, 1.0 / self.c],
+                ]
+            )
+            self._B.flags.writeable = False
+        return self._B
+
     def calculate_modQ(self) -> float:
         r"""Returns \|Q\| from lattice parameters and h, k, l
 
         Args:
 
         """
-        ca = np.cos(np.radians(self.alpha))
-        sa = np.sin(np.radians(self.alpha))
-        cb = np.cos(np.radians(self.beta))
-        sb = np.sin(np.radians(self.beta))
-        cg = np.cos(np.radians(self.gamma))
-        sg = np.sin(np.radians(self.gamma))
-        vabg = np.sqrt(1 - ca**2 - cb**2 - cg**2 + 2 * ca * cb * cg)
-        astar = sa / (self.a * vabg)
-        bstar = sb / (self.b * vabg)
-        cstar = sg / (self.c * vabg)
-        cas = (cb * cg - ca) / (sb * sg)  # noqa: F841
-        cbs = (cg * ca - cb) / (sg * sa)
-        cgs = (ca * cb - cg) / (sa * sb)
-
-        # B matrix
-        B = np.array(
-            [
-                [astar, bstar * cgs, cstar * cbs],
-                [0, bstar * np.sqrt(1 - cgs**2), -cstar * np.sqrt(1 - cbs**2) * ca],
-                [0, 0, 1.0 / self.c],
-            ]
-        )
+        return float(self.calculate_modQ_hkl(np.array([self.h, self.k, self.l])))
 
-        modQ = 2 * np.pi * np.linalg.norm(B.dot([self.h, self.k, self.l]))
-        return modQ
+    def calculate_modQ_hkl(self, hkl: np.array) -> np.array:
+        r"""Returns \|Q\| for an array of reflections, from lattice parameters
+
+        Args:
+            hkl: array of h, k, l with shape (N, 3), or (3,) for a single reflection
+
+        """
+        return 2 * np.pi * np.linalg.norm(np.asarray(hkl, dtype=float) @ self.get_B_matrix().T, axis=-1)
 
 
 class CrosshairParameters:
@@ -165,12 +724,31 @@ class HyspecPPTModel:
     Emin: float
     alpha_p: float
     plot_type: str
+    n_points: int
+    dtype: np.dtype
+    progressive_grid_points: list[int]
     cp: CrosshairParameters
 
     def __init__(self):
         """Constructor"""
         self.set_experiment_data(**DEFAULT_EXPERIMENT)
         self.cp = CrosshairParameters()
+        self.n_points = N_POINTS
+        self.set_progressive_grid_points()
+        # S2, e_min, n_points, alpha_p, dtype and exact_grid of the last calculated map, and its intensity for each
+        # plot type; the cosine of the Scharpf angle is not kept, it is a buffer of a thread workspace
+        self._map_key = None
+        self.dtype = np.dtype(np.float64)
+        self._intensity = {}
+        # reflections of the last lattice
+        self._reflections = None
+        self.detector = DetectorGeometry.hyspec()
+        # dependency tracking: last value and version of each input, and the versions of the inputs
+        # of each product when it was last marked clean
+        self._input_values = {}
+        self._input_versions = {}
+        self._clean_products = {}
+        self._ang_Q_beam = (None, None)
 
     def set_single_crystal_data(self, params: dict[str, float]) -> None:
         """Return experiment type
@@ -189,6 +767,136 @@ class HyspecPPTModel:
         """
         return self.cp.sc_parameters.get_parameters()
 
+    def get_reflections(self, centering: str = "P", max_modQ: float = MAX_MODQ) -> ReflectionIndex:
+        r"""Returns the reflections of the lattice with \|Q\| below max_modQ, sorted by \|Q\|
+
+        The index is kept until the lattice or the centering change, or a larger \|Q\| is requested.
+        It is enumerated up to the next integer \|Q\|, so that small changes of the map reuse it.
+
+        Args:
+            centering: lattice centering for the systematic extinctions, one of P, A, B, C, I, F, R
+            max_modQ: maximum \|Q\|, at most MAX_MODQ
+
+        """
+        return self._get_reflections(self.cp.sc_parameters.get_B_matrix(), centering, max_modQ)
+
+    def _get_reflections(self, B: np.array, centering: str, max_modQ: float) -> ReflectionIndex:
+        """Returns the index of the reflections of a B matrix, enumerated again if it does not reach max_modQ"""
+        # NAN if the tank does not cover the energy transfer
+        max_modQ = min(float(np.ceil(max_modQ)), MAX_MODQ) if np.isfinite(max_modQ) else 0.0
+        # the index is replaced at once, so that it can be filled by a worker thread
+        reflections = self._reflections
+        if (
+            reflections is None
+            or reflections[0] is not B
+            or reflections[1] < max_modQ
+            or reflections[2].centering != centering
+        ):
+            reflections = (B, max_modQ, ReflectionIndex(B, max_modQ, centering))
+            self._reflections = reflections
+        return reflections[2]
+
+    def get_reflections_task(self, centering: str = "P") -> Callable[[], ReflectionIndex]:
+        r"""Returns a function that enumerates the reflections of the overlay of the current map
+
+        The parameters are captured when this method is called. The returned function only fills
+        the index of the reflections, so it can run on a worker thread ahead of calculate_reflection_overlay.
+
+        Args:
+            centering: lattice centering for the systematic extinctions
+
+        """
+        self._update_Emin()
+        max_modQ = tank_modQ_range(self.Ei, self.S2, self.Emin)[1]
+        return partial(self._get_reflections, self.cp.sc_parameters.get_B_matrix(), centering, max_modQ)
+
+    def get_reflections_in_coverage(self, DeltaE: float = None, centering: str = "P") -> tuple[np.array, np.array]:
+        r"""Returns the h, k, l and \|Q\| of the reflections inside the detector tank
+
+        Args:
+            DeltaE: energy transfer, the crosshair DeltaE if not set
+            centering: lattice centering for the systematic extinctions
+
+        """
+        if DeltaE is None:
+            DeltaE = self.cp.DeltaE
+        q_low, q_hi = tank_modQ_range(self.Ei, self.S2, DeltaE)
+        reflections = self.get_reflections(centering, q_hi)
+        selection = reflections.modQ_range(q_low, q_hi)
+        return reflections.hkl[selection], reflections.modQ[selection]
+
+    def calculate_reflection_overlay(
+        self, hkl: np.array = None, DeltaE: float = None, centering: str = "P"
+    ) -> dict[str, np.array]:
+        r"""Returns the position of reflections on the map, their detector coverage and Scharpf angle
+
+        Args:
+            hkl: array of h, k, l with shape (N, 3); if not set, the reflections of the lattice
+                 up to the largest \|Q\| of the map
+            DeltaE: energy transfer of the reflections, the crosshair DeltaE if not set
+            centering: lattice centering for the systematic extinctions, if hkl is not set
+
+        Returns:
+            dictionary with hkl, modQ, DeltaE, in_coverage (bool) and alpha_s (degrees)
+
+        """
+        if DeltaE is None:
+            DeltaE = self.cp.DeltaE
+        if hkl is None:
+            # the tank covers the largest |Q| at the lowest energy transfer of the map
+            self._update_Emin()
+            q_hi = tank_modQ_range(self.Ei, self.S2, self.Emin)[1]
+            reflections = self.get_reflections(centering, q_hi)
+            selection = reflections.modQ_range(0, q_hi)
+            hkl, modQ = reflections.hkl[selection], reflections.modQ[selection]
+        else:
+            hkl = np.asarray(hkl).reshape(-1, 3)
+            modQ = self.cp.sc_parameters.calculate_modQ_hkl(hkl)
+        point_data = self.calculate_point_data(modQ, DeltaE)
+        return dict(
+            hkl=hkl,
+            modQ=modQ,
+            DeltaE=DeltaE,
+            in_coverage=point_data["in_coverage"],
+            alpha_s=point_data["alpha_s"],
+        )
+
+    def calculate_rotation_sweep(
+        self,
+        u: np.array,
+        v: np.array,
+        psi: np.array,
+        DeltaE: np.array = None,
+        hkl: np.array = None,
+        processes: int = 0,
+    ) -> dict[str, np.array]:
+        r"""Sweep the sample rotation angle psi for the current experiment and lattice
+
+        Args:
+            u: h, k, l of the vector along the beam at psi = 0
+            v: h, k, l of a second vector in the horizontal plane
+            psi: rotation angles in degrees, in increasing order
+            DeltaE: energy transfers, the crosshair DeltaE if not set
+            hkl: array of h, k, l with shape (N, 3); if not set, the reflections of the lattice
+                 up to the largest \|Q\| of the map
+            processes: number of worker processes for large sweeps, 0 to run in this process
+
+        Returns:
+            the dictionary from rotation_sweep, with the hkl of the reflections
+
+        """
+        if DeltaE is None:
+            DeltaE = self.cp.DeltaE
+        if hkl is None:
+            self._update_Emin()
+            q_hi = tank_modQ_range(self.Ei, self.S2, self.Emin)[1]
+            reflections = self.get_reflections(max_modQ=q_hi)
+            hkl = reflections.hkl[reflections.modQ_range(0, q_hi)]
+        UB = ub_matrix(self.cp.sc_parameters.get_B_matrix(), u, v)
+        data = rotation_sweep(UB, hkl, psi, DeltaE, self.Ei, self.S2, self.alpha_p, processes=processes)
+        data["hkl"] = np.asarray(hkl).reshape(-1, 3)
+        return data
+
     def set_crosshair_data(self, current_experiment_type: str, DeltaE: float = None, modQ: float = None) -> None:
         """Return experiment type
 
@@ -232,91 +940,347 @@ class HyspecPPTModel:
         data = dict(Ei=self.Ei, S2=self.S2, alpha_p=self.alpha_p, plot_type=self.plot_type)
         return data
 
-    def check_plot_update(self, deltaE) -> bool:
-        """Returns bool to indicate whether the Emin is different and indicate replotting
+    def get_session_state(self) -> dict[str, float | str]:
+        """Returns the experiment, the mode, the crosshair and the lattice in a flat dictionary
+
+        The keys are the parameters of the configurations of hyspecppt-batch, without the name.
 
         Args:
-            deltaE: new DeltaE value
 
         """
-        # calculate the new Emin
-        if deltaE is not None and deltaE <= -self.Ei:
-            Emin = 1.2 * deltaE
-        else:
-            Emin = -self.Ei
-        # check if it is the same
-        return self.Emin != Emin
+        # the crosshair |Q| is updated from the lattice in single crystal mode
+        self.get_crosshair_data()
+        return dict(
+            **self.get_experiment_data(),
+            mode=self.cp.current_experiment_type,
+            DeltaE=self.cp.DeltaE,
+            modQ=self.cp.modQ,
+            **self.get_single_crystal_data(),
+        )
+
+    def set_session_state(self, state: dict[str, float | str]) -> None:
+        """Set the experiment, the mode, the crosshair and the lattice
+
+        Args:
+            state: dictionary returned by get_session_state, other keys are ignored
+
+        """
+        self.set_experiment_data(Ei=state["Ei"], S2=state["S2"], alpha_p=state["alpha_p"], plot_type=state["plot_type"])
+        self.set_single_crystal_data({key: state[key] for key in DEFAULT_LATTICE})
+        self.set_crosshair_data(current_experiment_type=state["mode"], DeltaE=state["DeltaE"], modQ=state["modQ"])
+
+    def get_map_arrays(self) -> Optional[dict[str, np.array]]:
+        """Returns the arrays of the last calculated map, with the keys in MAP_ARRAY_KEYS
+
+        The arrays are stored in a session, and given to restore_map_arrays to draw the map again
+        without calculating it. Returns None if no map was calculated for the current state, for example
+        while the map is calculated in a worker thread.
+
+        Args:
+
+        """
+        if self._map_key is None or self.plot_type not in self._intensity:
+            return None
+        S2, e_min, n_points, alpha_p, _, exact_grid = self._map_key
+        if (S2, e_min, alpha_p) != (self.S2, self._update_Emin(), self.alpha_p):
+            return None
+        arrays = dict(S2=S2, e_min=e_min, n_points=n_points, alpha_p=alpha_p)
+        arrays.update(map_geometry(S2, e_min, n_points, exact_grid))
+        arrays.update(plot_type=self.plot_type, intensity=self._intensity[self.plot_type])
+        return {key: np.asarray(value) for key, value in arrays.items()}
+
+    def restore_map_arrays(self, arrays: dict[str, np.array]) -> None:
+        """Restore a map from the arrays returned by get_map_arrays
+
+        The geometry is returned by reduced_geometry instead of being calculated. The intensity is restored
+        if it matches the current state of the model; the other plot types are calculated from the geometry.
+
+        Args:
+            arrays: dictionary with the keys in MAP_ARRAY_KEYS
+
+        Raises:
+            KeyError: if an array is missing
+
+        """
+        S2, e_min, n_points = float(arrays["S2"]), float(arrays["e_min"]), int(arrays["n_points"])
+        _restore_geometry(S2, e_min, n_points, {key: np.array(arrays[key]) for key in GEOMETRY_KEYS})
+        self.n_points = n_points
+        intensity = np.array(arrays["intensity"])
+        if (S2, e_min, float(arrays["alpha_p"])) != (self.S2, self._update_Emin(), self.alpha_p):
+            return
+        if str(arrays["plot_type"]) != self.plot_type or intensity.dtype != self.dtype:
+            return
+        intensity.flags.writeable = False
+        self._map_key = (self.S2, e_min, n_points, self.alpha_p, self.dtype, False)
+        self._intensity = {self.plot_type: intensity}
+
+    def get_calculated_grid_points(self) -> list[int]:
+        """Returns the resolutions of the progressive refinement and of the restored maps whose geometry
+        is calculated for the current experiment
+
+        Args:
+
+        """
+        e_min = self._update_Emin()
+        grid_points = set(self.progressive_grid_points) | set(self.get_restored_grid_points())
+        return sorted(n_points for n_points in grid_points if geometry_calculated(self.S2, e_min, n_points))
+
+    def get_restored_grid_points(self) -> list[int]:
+        """Returns the resolutions of the maps restored from sessions for the current experiment
+
+        Args:
+
+        """
+        e_min = self._update_Emin()
+        return sorted(n_points for S2, restored, n_points in _RESTORED_GEOMETRY if (S2, restored) == (self.S2, e_min))
+
+    def set_dtype(self, dtype: str) -> None:
+        """Set the floating point type of the intensity of the map
+
+        Args:
+            dtype: float64, or float32 to halve the memory of the maps
+
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError(f"The type of the maps must be float32 or float64, not {dtype}")
+        self.dtype = dtype
+
+    def set_progressive_grid_points(self, coarse: int = N_POINTS_COARSE, maximum: int = N_POINTS) -> None:
+        """Set the grid resolutions of the progressive plot refinement
+
+        The map is drawn first on the coarse grid, then the number of points is doubled
+        at each stage until the maximum is reached.
+
+        Args:
+            coarse: number of points along each axis of the first stage
+            maximum: number of points along each axis of the last stage
+
+        """
+        stages = [min(coarse, maximum)]
+        while stages[-1] < maximum:
+            stages.append(min(2 * stages[-1], maximum))
+        self.progressive_grid_points = stages
+
+    def get_dirty_products(self) -> set[str]:
+        """Returns the derived products with an input that changed since they were marked clean
+
+        The products and their inputs are listed in PRODUCT_INPUTS. The inputs are compared by value,
+        so setting the same value again does not make a product dirty.
+
+        Args:
+
+        """
+        self._refresh_inputs()
+        return {product for product in PRODUCT_INPUTS if self._clean_products.get(product) != self._stamp(product)}
+
+    def mark_clean(self, *products: str) -> None:
+        """Mark products as up to date with the current inputs
+
+        Args:
+            products: names of products in PRODUCT_INPUTS
+
+        """
+        self._refresh_inputs()
+        for product in products:
+            self._clean_products[product] = self._stamp(product)
+
+    def _refresh_inputs(self) -> None:
+        """Increase the version of the inputs that changed value"""
+        sc_parameters = self.cp.sc_parameters
+        values = dict(
+            Ei=self.Ei,
+            S2=self.S2,
+            alpha_p=self.alpha_p,
+            plot_type=self.plot_type,
+            Emin=self._calculate_Emin(self.cp.DeltaE),
+            DeltaE=self.cp.DeltaE,
+            modQ=self.cp.modQ,
+            mode=self.cp.current_experiment_type,
+            lattice=(
+                sc_parameters.a,
+                sc_parameters.b,
+                sc_parameters.c,
+                sc_parameters.alpha,
+                sc_parameters.beta,
+                sc_parameters.gamma,
+            ),
+            hkl=(sc_parameters.h, sc_parameters.k, sc_parameters.l),
+        )
+        for name, value in values.items():
+            if name not in self._input_values or self._input_values[name] != value:
+                self._input_values[name] = value
+                self._input_versions[name] = self._input_versions.get(name, 0) + 1
+
+    def _stamp(self, product: str) -> tuple[int, ...]:
+        """Returns the versions of the inputs of a product"""
+        return tuple(self._input_versions[name] for name in PRODUCT_INPUTS[product])
 
     def get_ang_Q_beam(self) -> float:
-        """Returns the angle between Q and the beam"""
-        SE2K = np.sqrt(2e-3 * e * m_n) * 1e-10 / hbar
-        crosshair_data = self.get_crosshair_data()
-        deltaE = crosshair_data["DeltaE"]
-        modQ = crosshair_data["modQ"]
+        """Returns the angle between Q and the beam, recalculated only if its inputs changed"""
+        self._refresh_inputs()
+        stamp = self._stamp("ang_Q_beam")
+        if self._ang_Q_beam[0] != stamp:
+            crosshair_data = self.get_crosshair_data()
+            self._ang_Q_beam = (stamp, self._ang_Q_beam_at(crosshair_data["modQ"], crosshair_data["DeltaE"]))
+        return self._ang_Q_beam[1]
+
+    def _ang_Q_beam_at(self, modQ: np.array, DeltaE: np.array) -> np.array:
+        """Returns the angle between Q and the beam, NAN if the scattering triangle is not closed"""
         ki = np.sqrt(self.Ei) * SE2K
-        kf = np.sqrt(self.Ei - deltaE) * SE2K
         with np.errstate(all="ignore"):  # ignore the state when momentum energy not conserved
+            kf = np.sqrt(self.Ei - DeltaE) * SE2K
             cos_kiQ = (ki**2 + modQ**2 - kf**2) / (2 * ki * modQ)
             return np.degrees(np.arccos(cos_kiQ)) if self.S2 < 0 else -np.degrees(np.arccos(cos_kiQ))
 
-    def calculate_graph_data(self) -> dict[str, np.array]:
-        """Returns a dictionary of arrays [Q_low, Q_hi, E, Q2d, E2d, data of plot_types]
+    def calculate_point_data(self, modQ: np.array, DeltaE: np.array) -> dict[str, np.array]:
+        r"""Returns the Scharpf angle and the plotted quantities at arbitrary (\|Q\|, DeltaE) points
+
+        The values are calculated analytically for each point, with the same conventions as the map
+        from calculate_graph_data, so the cost does not depend on the grid size. The values of points
+        outside the detector coverage are calculated as well, and flagged by in_coverage. Points where
+        the scattering triangle is not closed are NAN.
 
         Args:
+            modQ: array of momentum transfers
+            DeltaE: array of energy transfers, with the same shape as modQ
+
+        Returns:
+            dictionary with alpha_s (degrees), one array for each of PLOT_TYPES,
+            ang_Q_beam (degrees) and in_coverage (bool)
 
         """
-        # constant to transform from energy in meV to momentum in Angstrom^-1
-        SE2K = np.sqrt(2e-3 * e * m_n) * 1e-10 / hbar
+        modQ, DeltaE = np.broadcast_arrays(np.asarray(modQ, dtype=float), np.asarray(DeltaE, dtype=float))
+        ki = np.sqrt(self.Ei) * SE2K
+        with np.errstate(all="ignore"):
+            kf = np.sqrt(self.Ei - DeltaE) * SE2K
+
+            # scattering angle, and the components of Q. Qx is in the opposite direction as the detector
+            cos_theta = (ki**2 + kf**2 - modQ**2) / (2 * ki * kf)
+            cos_theta = np.where(np.abs(cos_theta) > 1, np.nan, cos_theta)
+            qz = ki - kf * cos_theta
+            qx = kf * np.sqrt(1 - cos_theta**2)
+            if self.S2 >= TANK_HALF_WIDTH:
+                qx *= -1
+            phi_Q = np.where(modQ == 0, np.nan, np.arctan2(qx, qz))
+
+            cos_ang_PQ = np.cos(phi_Q - np.radians(self.alpha_p))
+            data = {plot_type: function(cos_ang_PQ) for plot_type, function in PLOT_FUNCTIONS.items()}
+
+        # same tolerance on the edges of the tank as the map
+        in_coverage = (cos_theta >= np.cos(np.radians(np.abs(self.S2) + TANK_HALF_WIDTH)) - 1e-12) & (
+            cos_theta <= np.cos(np.radians(np.abs(self.S2) - TANK_HALF_WIDTH)) + 1e-12
+        )
+        data.update(alpha_s=data[PLOT_TYPES[0]], ang_Q_beam=self._ang_Q_beam_at(modQ, DeltaE), in_coverage=in_coverage)
+        return data
 
-        # adjust minimum energy
-        if self.cp.DeltaE is not None and self.cp.DeltaE <= -self.Ei:
-            self.Emin = 1.2 * self.cp.DeltaE
-        else:
-            self.Emin = -self.Ei
+    def calculate_graph_data(self, n_points: int = None, exact_grid: bool = False) -> dict[str, np.array]:
+        """Returns a dictionary of arrays [Q_low, Q_hi, E, Q, intensity] and the plot_type
+
+        The intensity has the shape (len(Q), len(E)) on the 1-D axes Q and E; the edges of the tank
+        Q_low and Q_hi are given along E.
+
+        The map is calculated in this thread by the function of get_graph_task, and kept as the last
+        calculated map. For Emin below -Ei, the interactive maps extend the grid of -Ei with the same
+        spacing, so that the rows already calculated are reused, and have more than n_points along each axis.
+
+        Args:
+            n_points: number of points along each axis, N_POINTS if not set
+            exact_grid: if True, the map has n_points along each axis from Emin
+
+        """
+        data = self.get_graph_task(n_points, exact_grid)()
+        self.set_graph_data(data)
+        return {key: data[key] for key in ("Q_low", "Q_hi", "E", "Q", "intensity", "plot_type")}
+
+    def calculate_pixel_data(self, DeltaE: np.array = None) -> dict[str, np.array]:
+        r"""Returns \|Q\| and the plotted quantities for each detector pixel and energy transfer
 
-        E = np.linspace(self.Emin, self.Ei * 0.9, N_POINTS)
+        Args:
+            DeltaE: energy transfers, the energy axis of the map if not set
+
+        Returns:
+            dictionary with modQ, DeltaE, alpha_s (degrees) and one array for each of PLOT_TYPES,
+            with shape (pixels, E)
+
+        """
+        if DeltaE is None:
+            DeltaE = self.Ei * reduced_geometry(self.S2, self._update_Emin(), self.n_points)["e"]
+        DeltaE = np.asarray(DeltaE, dtype=float).ravel()
+        kinematics = pixel_kinematics(self.detector, self.Ei, self.S2, self.alpha_p, DeltaE)
+        with np.errstate(invalid="ignore"):
+            data = {plot_type: function(kinematics["cos_ang_PQ"]) for plot_type, function in PLOT_FUNCTIONS.items()}
+        data.update(
+            modQ=kinematics["modQ"],
+            DeltaE=np.broadcast_to(DeltaE, kinematics["modQ"].shape),
+            alpha_s=data[PLOT_TYPES[0]],
+        )
+        return data
 
-        # Calculate lines for the edges of the tank
+    def calculate_pixel_coverage(self) -> np.array:
+        r"""Returns the points of the last map grid that are measured by at least one detector pixel
+
+        The map assumes a continuous tank in the horizontal plane; this mask shows the gaps between
+        the detector modules and the effect of the vertical size of the tubes.
+
+        Returns:
+            array of bool with the shape of the intensity, True if a pixel falls in the grid cell
+
+        """
+        geometry = reduced_geometry(self.S2, self._update_Emin(), self.n_points)
         ki = np.sqrt(self.Ei) * SE2K
-        kf = np.sqrt(self.Ei - E) * SE2K
-        Q_low = np.sqrt(ki**2 + kf**2 - 2 * ki * kf * np.cos(np.radians(np.abs(self.S2) - TANK_HALF_WIDTH)))
-        Q_hi = np.sqrt(ki**2 + kf**2 - 2 * ki * kf * np.cos(np.radians(np.abs(self.S2) + TANK_HALF_WIDTH)))
-
-        # Create 2D array
-        Q = np.linspace(0, np.max(Q_hi), N_POINTS)
-        E2d, Q2d = np.meshgrid(E, Q)
-        Ef2d = self.Ei - E2d
-        kf2d = np.sqrt(Ef2d) * SE2K
-
-        # Calculate the angle between Q and z axis. Set to NAN values outside the detector range
-        cos_theta = (ki**2 + kf2d**2 - Q2d**2) / (2 * ki * kf2d)
-        cos_theta[cos_theta < np.cos(np.radians(np.abs(self.S2) + TANK_HALF_WIDTH))] = np.nan
-        cos_theta[cos_theta > np.cos(np.radians(np.abs(self.S2) - TANK_HALF_WIDTH))] = np.nan
-
-        # Calculate Qz
-        Qz = ki - kf2d * cos_theta
-
-        # Calculate Qx. Note that is in the opposite direction as detector position
-        if self.S2 >= TANK_HALF_WIDTH:
-            Qx = (-1) * kf2d * np.sqrt((1 - cos_theta**2))
-        elif self.S2 <= -TANK_HALF_WIDTH:
-            Qx = kf2d * np.sqrt((1 - cos_theta**2))
-
-        # Transform polarization angle in the lab frame to vector
-        Px = np.sin(np.radians(self.alpha_p))
-        Pz = np.cos(np.radians(self.alpha_p))
-
-        # Calculate angle between polarization vector and momentum transfer
-        cos_ang_PQ = (Qx * Px + Qz * Pz) / Q2d
-
-        # Select return value for intensity
-        if self.plot_type == PLOT_TYPES[0]:  # alpha
-            ang_PQ = np.arccos(cos_ang_PQ)
-            intensity = np.degrees(ang_PQ)
-        elif self.plot_type == PLOT_TYPES[1]:  # cos^2(alpha)
-            intensity = cos_ang_PQ**2
-        elif self.plot_type == PLOT_TYPES[2]:  # "(cos^2(a)+1)/2"
-            intensity = (cos_ang_PQ**2 + 1) / 2
-        elif self.plot_type == PLOT_TYPES[3]:
-            intensity = 2 * cos_ang_PQ**2 - 1
-        return dict(Q_low=Q_low, Q_hi=Q_hi, E=E, Q2d=Q2d, E2d=E2d, intensity=intensity, plot_type=self.plot_type)
+        Q = ki * geometry["q"]
+        E = self.Ei * geometry["e"]
+        modQ = self.calculate_pixel_data(E)["modQ"]
+
+        # index of the nearest point of the uniform |Q| axis
+        q_step = Q[1] - Q[0] if len(Q) > 1 else 1.0
+        with np.errstate(invalid="ignore"):
+            q_index = np.rint((modQ - Q[0]) / q_step)
+        e_index = np.broadcast_to(np.arange(len(E)), modQ.shape)
+        valid = (q_index >= 0) & (q_index < len(Q))
+        coverage = np.zeros((len(Q), len(E)), dtype=bool)
+        coverage[q_index[valid].astype(int), e_index[valid]] = True
+        return coverage
+
+    def get_graph_task(self, n_points: int = None, exact_grid: bool = False) -> Callable[[], dict[str, np.array]]:
+        """Returns a function that calculates the graph data of the current state
+
+        The parameters are captured when this method is called, and the returned function does not
+        use the model, so it can run on a worker thread. It returns the dictionary of calculate_graph_data,
+        with the key of the map, to give to set_graph_data in the GUI thread. The memoized intensity of the
+        last map is reused.
+
+        Args:
+            n_points: number of points along each axis, N_POINTS if not set
+            exact_grid: if True, the map has n_points along each axis from Emin, see map_geometry
+
+        """
+        key = (self.S2, self._update_Emin(), n_points or N_POINTS, self.alpha_p, self.dtype, exact_grid)
+        intensity = self._intensity.get(self.plot_type) if key == self._map_key else None
+        return partial(_graph_data, self.Ei, key, self.plot_type, intensity)
+
+    def set_graph_data(self, data: dict[str, np.array]) -> None:
+        """Keep the map calculated by a function of get_graph_task, as the last calculated map
+
+        Args:
+            data: dictionary returned by the function
+
+        """
+        key = data["key"]
+        if key != self._map_key:
+            self._intensity = {}
+        self._map_key = key
+        self._intensity[data["plot_type"]] = data["intensity"]
+        self.n_points = key[2]
+
+    def _calculate_Emin(self, deltaE: float) -> float:
+        """Returns the minimum energy of the map for a crosshair DeltaE"""
+        if deltaE is not None and deltaE <= -self.Ei:
+            return 1.2 * deltaE
+        return -self.Ei
+
+    def _update_Emin(self) -> float:
+        """Adjust the minimum energy and return it in units of Ei"""
+        self.Emin = self._calculate_Emin(self.cp.DeltaE)
+        return self.Emin / self.Ei if self.Ei else -1.0
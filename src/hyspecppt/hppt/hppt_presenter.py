@@ -1,29 +1,146 @@
 """Presenter for the Main tab"""
 
-from .experiment_settings import PLOT_TYPES
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Optional
+
+from hyspecppt.cache import DEFAULT_MAX_SIZE_MB, ResultCache
+from hyspecppt.configuration import get_configuration
+from hyspecppt.session import LAST_SESSION, Session, SessionStore
+
+from .experiment_settings import N_POINTS, N_POINTS_COARSE, PLOT_TYPES
+from .hppt_model import set_geometry_cache
+
+logger = logging.getLogger("hyspecppt")
+
+
+def configure_model(model: any) -> int:
+    """Apply the performance settings to the model
+
+    Args:
+        model: hppt_model class type
+
+    Returns:
+        the number of worker threads of the plot calculations
+
+    """
+    performance = get_configuration()
+    model.set_progressive_grid_points(
+        coarse=performance.get_int("global.performance", "coarse_grid_points") or N_POINTS_COARSE,
+        maximum=performance.get_int("global.performance", "max_grid_points") or N_POINTS,
+    )
+    try:
+        model.set_dtype(performance.get_str("global.performance", "dtype", "float64"))
+    except (TypeError, ValueError) as err:
+        logger.error(str(err))
+    # the geometry of the maps is kept on disk between sessions, 0 MB disables the cache
+    cache_size = performance.get_float("global.performance", "cache_size_mb", DEFAULT_MAX_SIZE_MB)
+    set_geometry_cache(ResultCache(max_size_mb=cache_size) if cache_size > 0 else None)
+    return performance.get_int("global.performance", "workers", 0)
+
+
+def restore_last_session(model: any, store: SessionStore) -> Optional[Session]:
+    """Restore the state of the model, and its map, from the session saved when the application was closed
+
+    Args:
+        model: hppt_model class type
+        store: stored sessions
+
+    Returns:
+        the last session, or None if there is none
+
+    """
+    try:
+        session = store.load(LAST_SESSION)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as err:
+        logger.warning(f"The last session is not restored: {err}")
+        return None
+    session.restore(model)
+    return session
+
+
+def prepare_first_plot(model: any, workers: int, store: SessionStore = None) -> Optional[Future]:
+    """Start calculating the first map in a worker thread, while the widgets are built
+
+    The model is configured with configure_model beforehand. The state of the model is restored from the last
+    session first. Its map is drawn from the stored
+    arrays; otherwise the map is calculated at the last resolution of the progressive refinement.
+    Nothing is started if the map was restored or if the settings have no worker threads.
+
+    Args:
+        model: hppt_model class type
+        workers: number of worker threads of the plot calculations, from configure_model
+        store: stored sessions, the last session is not restored if None
+
+    Returns:
+        the future of the calculation, to pass to the presenter, or None
+
+    """
+    if store is not None:
+        restore_last_session(model, store)
+    if not workers or model.get_restored_grid_points():
+        return None
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hyspecppt-first-plot")
+    future = executor.submit(model.get_graph_task(model.progressive_grid_points[-1]))
+    # the thread ends when the calculation is done
+    executor.shutdown(wait=False)
+    return future
 
 
 class HyspecPPTPresenter:
     """Main presenter"""
 
-    def __init__(self, view: any, model: any):
+    def __init__(
+        self,
+        view: any,
+        model: any,
+        workers: int = 0,
+        first_plot: Optional[Future] = None,
+        store: Optional[SessionStore] = None,
+    ):
         """Constructor
         :view: hppt_view class type
-        :model:hppt_model class type
+        :model:hppt_model class type, configured with configure_model
+        :workers: number of worker threads of the plot calculations, from configure_model
+        :first_plot: geometry of the first map from prepare_first_plot, drawn instead of the progressive refinement
+        :store: stored sessions, SESSION_DIRECTORY if not set
         """
         self._view = view
         self._model = model
+        # named session of the shown configurations, None until a session is saved or opened
+        self.store = store or SessionStore()
+        self.session = None
+
+        # progressive refinement of the heatmap; stages of older requests are dropped
+        self.plot_generation = 0
+        # reflections overlay, enumerated in a worker thread; older requests are dropped
+        self.reflections_generation = 0
+        # grouped updates: the heatmap is recalculated once, when the group ends
+        self.batch = False
+        self.heatmap_pending = False
+        self.reflections_pending = False
+        self.first_plot = first_plot
+        # the kinematics of the refined stages are calculated in worker threads
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hyspecppt") if workers else None
 
         # M-V-P connections through callbacks
         self.view.connect_fields_update(self.handle_field_values_update)
         self.view.connect_powder_mode_switch(self.handle_switch_to_powder)
         self.view.connect_sc_mode_switch(self.handle_switch_to_sc)
+        self.view.connect_session_callbacks(
+            self.handle_session_save, self.handle_session_open, self.handle_configuration_select
+        )
 
         # populate fields
-        self.view.sc_widget.set_values(self.model.get_single_crystal_data())
-        self.view.experiment_widget.initializeCombo(PLOT_TYPES)
-        self.view.experiment_widget.set_values(self.model.get_experiment_data())
-        self.view.crosshair_widget.set_QZ_values(self.model.get_ang_Q_beam())
+        with self.batch_update():
+            self.view.sc_widget.set_values(self.model.get_single_crystal_data())
+            self.view.experiment_widget.initializeCombo(PLOT_TYPES)
+            self.view.experiment_widget.set_values(self.model.get_experiment_data())
+            self.view.crosshair_widget.set_QZ_values(self.model.get_ang_Q_beam())
 
         # set default selection mode from the model
         experiment_type = self.view.selection_widget.powder_label
@@ -42,7 +159,7 @@ class HyspecPPTPresenter:
         return self._model
 
     def handle_field_values_update(self, field_values):
-        """Save the values in the model"""
+        """Save the values in the model, then redraw what depends on the changed values"""
         section = field_values["name"]
         data = field_values["data"]
         if section == "crosshair":
@@ -51,24 +168,10 @@ class HyspecPPTPresenter:
             experiment_type = "powder"
             if experiment_type_label.startswith("Single"):
                 experiment_type = "single_crystal"
-            # check whether we need to replot - new deltae
-            replot = self.model.check_plot_update(float(data["DeltaE"]))
             # update crosshair
             self.model.set_crosshair_data(
                 current_experiment_type=experiment_type, DeltaE=float(data["DeltaE"]), modQ=float(data["modQ"])
             )
-            if replot:
-                # update the heatmap
-                plot_data = self.model.calculate_graph_data()
-                self.view.plot_widget.update_plot(
-                    q_min=plot_data["Q_low"],
-                    q_max=plot_data["Q_hi"],
-                    energy_transfer=plot_data["E"],
-                    q2d=plot_data["Q2d"],
-                    e2d=plot_data["E2d"],
-                    scharpf_angle=plot_data["intensity"],
-                    plot_label=plot_data["plot_type"],
-                )
             # update the plot crosshair, if valid values are passed from the model; could be invalid q
             self.view.plot_widget.update_crosshair(eline=data["DeltaE"], qline=data["modQ"])
 
@@ -77,18 +180,6 @@ class HyspecPPTPresenter:
                 float(data["Ei"]), float(data["S2"]), float(data["alpha_p"]), data["plot_type"]
             )
 
-            # update the heatmap, if valid values are passed
-            plot_data = self.model.calculate_graph_data()
-            self.view.plot_widget.update_plot(
-                q_min=plot_data["Q_low"],
-                q_max=plot_data["Q_hi"],
-                energy_transfer=plot_data["E"],
-                q2d=plot_data["Q2d"],
-                e2d=plot_data["E2d"],
-                scharpf_angle=plot_data["intensity"],
-                plot_label=plot_data["plot_type"],
-            )
-
         else:
             self.model.set_single_crystal_data(data)
             # update newly calculated qmod
@@ -99,56 +190,335 @@ class HyspecPPTPresenter:
             # update the plot crosshair, if valid values are passed from the model; could be invalid q
             if self.view.crosshair_widget.validation_status_all_inputs():
                 self.view.plot_widget.update_crosshair(eline=saved_values["DeltaE"], qline=saved_values["modQ"])
-        self.handle_QZ_angle()
+        self.update_dirty_products()
+
+    def update_dirty_products(self):
+        """Redraw the parts of the plot and the fields whose inputs changed in the model"""
+        dirty = self.model.get_dirty_products()
+        if dirty & {"E", "coverage", "geometry"}:
+            # new kinematics: the heatmap is recalculated
+            self.update_heatmap()
+        elif "intensity" in dirty:
+            # same kinematics: the geometry is reused, from the resolution of the shown heatmap
+            self.update_heatmap(self.model.n_points)
+        if "ang_Q_beam" in dirty:
+            self.handle_QZ_angle()
+        if "reflections" in dirty:
+            self.update_reflections()
+
+    @contextmanager
+    def batch_update(self):
+        """Group the updates of one user action
+
+        Field updates emitted by the view inside the block are merged per section and handled
+        when the block ends, then the heatmap is recalculated and drawn once.
+        """
+        if self.batch:
+            # nested group
+            yield
+            return
+        self.batch = True
+        self.heatmap_pending = False
+        self.reflections_pending = False
+        try:
+            with self.view.hold_updates():
+                yield
+        finally:
+            self.batch = False
+        if self.heatmap_pending:
+            self.update_heatmap()
+        if self.reflections_pending:
+            self.update_reflections()
+
+    def update_heatmap(self, n_points: Optional[int] = None):
+        """Draw the heatmap on a coarse grid and refine it while no newer request arrives
+
+        The refinement starts from the finest resolution whose geometry is already calculated. The maps
+        are calculated in worker threads from the state of the model when they are requested, and drawn
+        in the GUI thread.
+
+        Args:
+            n_points: lowest resolution of the first stage, the coarse grid if not set
+
+        """
+        if self.batch:
+            self.heatmap_pending = True
+            return
+        # the heatmap is drawn from the current state of the model
+        self.model.mark_clean("E", "coverage", "geometry", "intensity")
+        self.plot_generation += 1
+        grid_points = self.model.progressive_grid_points
+        restored = self.model.get_restored_grid_points()
+        calculated = self.model.get_calculated_grid_points()
+        if calculated:
+            # the stages whose geometry is calculated, such as a map restored from a session, are skipped:
+            # the finest one is drawn first, and refined only to a higher resolution
+            n_points = max(calculated[-1], n_points or 0)
+        if n_points is not None:
+            grid_points = [n_points] + [refined for refined in grid_points if refined > n_points]
+        if self.first_plot is not None:
+            # the first map was calculated while the window was built; wait until it is ready
+            first_plot, self.first_plot = self.first_plot, None
+            if first_plot.exception() is not None:
+                logger.error(f"Plot calculation failed: {first_plot.exception()}")
+            elif not restored:
+                self.update_heatmap_stage(self.plot_generation, grid_points[-1:], first_plot.result())
+                return
+        self.prepare_heatmap_stage(self.plot_generation, grid_points)
+
+    def update_heatmap_stage(self, generation: int, grid_points: list[int], plot_data: dict):
+        """Draw the heatmap at the first resolution in grid_points and schedule the next one
+
+        Args:
+            generation: request number, the stage is skipped if a newer request has arrived
+            grid_points: remaining resolutions to draw
+            plot_data: graph data of the first resolution, from a function of model.get_graph_task
+
+        """
+        if generation != self.plot_generation:
+            return
+        refine = None
+        if len(grid_points) > 1:
+            refine = partial(self.prepare_heatmap_stage, generation, grid_points[1:])
+        self.model.set_graph_data(plot_data)
+        self.view.plot_widget.update_plot(
+            q_min=plot_data["Q_low"],
+            q_max=plot_data["Q_hi"],
+            energy_transfer=plot_data["E"],
+            momentum_transfer=plot_data["Q"],
+            scharpf_angle=plot_data["intensity"],
+            plot_label=plot_data["plot_type"],
+            refine=refine,
+        )
+
+    def prepare_heatmap_stage(self, generation: int, grid_points: list[int]):
+        """Calculate the map of the next stage in a worker thread, then draw it in the GUI thread
+
+        Args:
+            generation: request number, the stage is skipped if a newer request has arrived
+            grid_points: remaining resolutions to draw
+
+        """
+        if generation != self.plot_generation:
+            return
+        task = self.model.get_graph_task(grid_points[0])
+        if self.executor is None:
+            self.update_heatmap_stage(generation, grid_points, task())
+            return
+        future = self.executor.submit(task)
+        future.add_done_callback(partial(self.post_heatmap_stage, generation, grid_points))
+
+    def post_heatmap_stage(self, generation: int, grid_points: list[int], future: Future):
+        """Post the drawing of a stage to the GUI thread when its map is ready; runs in the worker thread
+
+        Args:
+            generation: request number
+            grid_points: remaining resolutions to draw
+            future: finished map calculation
+
+        """
+        if future.exception() is not None:
+            logger.error(f"Plot calculation failed: {future.exception()}")
+            return
+        # the result of a superseded request is dropped
+        if generation == self.plot_generation:
+            self.view.plot_widget.post(partial(self.update_heatmap_stage, generation, grid_points, future.result()))
+
+    def update_reflections(self):
+        """Draw the reflections of the lattice in single crystal mode, at the crosshair energy transfer
+
+        The reflections are enumerated in a worker thread, then drawn in the GUI thread.
+        """
+        if self.batch:
+            self.reflections_pending = True
+            return
+        self.model.mark_clean("reflections")
+        self.reflections_generation += 1
+        if self.model.cp.get_experiment_type() != "single_crystal":
+            self.view.plot_widget.update_reflections(modQ=[], energy_transfer=0.0, in_coverage=[])
+            return
+        if self.executor is None:
+            self.draw_reflections(self.reflections_generation)
+            return
+        future = self.executor.submit(self.model.get_reflections_task())
+        future.add_done_callback(partial(self.post_reflections, self.reflections_generation))
+
+    def post_reflections(self, generation: int, future: Future):
+        """Post the drawing of the reflections to the GUI thread when they are enumerated; runs in the worker thread
+
+        Args:
+            generation: request number
+            future: finished enumeration of the reflections
+
+        """
+        if future.exception() is not None:
+            logger.error(f"Reflection calculation failed: {future.exception()}")
+            return
+        # the result of a superseded request is dropped
+        if generation == self.reflections_generation:
+            self.view.plot_widget.post(partial(self.draw_reflections, generation))
+
+    def draw_reflections(self, generation: int):
+        """Draw the reflections overlay, from the enumerated reflections
+
+        Args:
+            generation: request number, nothing is drawn if a newer request has arrived
+
+        """
+        if generation != self.reflections_generation:
+            return
+        overlay = self.model.calculate_reflection_overlay()
+        self.view.plot_widget.update_reflections(
+            modQ=overlay["modQ"], energy_transfer=overlay["DeltaE"], in_coverage=overlay["in_coverage"]
+        )
 
     def handle_QZ_angle(self):
         """Compute QZ_angle"""
+        self.model.mark_clean("ang_Q_beam")
         QZ_ang = self.model.get_ang_Q_beam()
         self.view.crosshair_widget.set_QZ_values(QZ_ang)
 
     def handle_switch_to_powder(self):
         """Switch to Powder mode"""
-        # update the fields' visibility
-        self.view.field_visibility_in_Powder()
-        # update the experiment type in the model
-        experiment_type = "powder"
-        self.model.set_crosshair_data(current_experiment_type=experiment_type)
-
-        # get the valid values for crosshair saved fields
-        # if the view contains an invalid value it is overwritten
-        saved_values = self.model.get_crosshair_data()
-        self.view.crosshair_widget.set_values(saved_values)
-        # update the plot crosshair
-        self.view.plot_widget.update_crosshair(eline=saved_values["DeltaE"], qline=saved_values["modQ"])
-
-        # update view values
-        saved_values = self.model.get_experiment_data()
-        self.view.experiment_widget.set_values(saved_values)
-        self.handle_QZ_angle()
+        with self.batch_update():
+            # update the fields' visibility
+            self.view.field_visibility_in_Powder()
+            # update the experiment type in the model
+            experiment_type = "powder"
+            self.model.set_crosshair_data(current_experiment_type=experiment_type)
+
+            # get the valid values for crosshair saved fields
+            # if the view contains an invalid value it is overwritten
+            saved_values = self.model.get_crosshair_data()
+            self.view.crosshair_widget.set_values(saved_values)
+            # update the plot crosshair
+            self.view.plot_widget.update_crosshair(eline=saved_values["DeltaE"], qline=saved_values["modQ"])
+
+            # update view values
+            saved_values = self.model.get_experiment_data()
+            self.view.experiment_widget.set_values(saved_values)
+            self.update_dirty_products()
 
     def handle_switch_to_sc(self):
         """Switch to Single Crystal mode"""
-        # update the fields' visibility
-        self.view.field_visibility_in_SC()
-        # update the experiment type in the model
-        experiment_type = "single_crystal"
-        self.model.set_crosshair_data(current_experiment_type=experiment_type)
-
-        # get the valid values for crosshair saved fields
-        # if the view contains an invalid value, except from calculated q, it is overwritten
-        saved_values = self.model.get_crosshair_data()
-        self.view.crosshair_widget.set_values(saved_values)
-        # update the plot crosshair, if valid values are passed from the model; could be invalid q
-        if self.view.crosshair_widget.validation_status_all_inputs():
+        with self.batch_update():
+            # update the fields' visibility
+            self.view.field_visibility_in_SC()
+            # update the experiment type in the model
+            experiment_type = "single_crystal"
+            self.model.set_crosshair_data(current_experiment_type=experiment_type)
+
+            # get the valid values for crosshair saved fields
+            # if the view contains an invalid value, except from calculated q, it is overwritten
+            saved_values = self.model.get_crosshair_data()
+            self.view.crosshair_widget.set_values(saved_values)
+            # update the plot crosshair, if valid values are passed from the model; could be invalid q
+            if self.view.crosshair_widget.validation_status_all_inputs():
+                self.view.plot_widget.update_crosshair(eline=saved_values["DeltaE"], qline=saved_values["modQ"])
+
+            # get the valid values for experiment saved fields
+            # if the view contains an invalid value it is overwritten
+            saved_values = self.model.get_experiment_data()
+            self.view.experiment_widget.set_values(saved_values)
+
+            # get the valid values for single crystal saved fields
+            # if the view contains an invalid value it is overwritten
+            saved_values = self.model.get_single_crystal_data()
+            self.view.sc_widget.set_values(saved_values)
+            self.update_dirty_products()
+
+    def handle_session_save(self):
+        """Ask the names of the session and of the configuration, then store the current configuration"""
+        configuration_name = self.session.current if self.session else "config_0000"
+        names = self.view.session_widget.ask_configuration_name(configuration_name)
+        if names is not None:
+            self.save_configuration(*names)
+
+    def save_configuration(self, session_name: str, configuration_name: str):
+        """Store the current configuration and its map in a session, and write the session
+
+        Args:
+            session_name: name of the session; a stored session with this name is extended
+            configuration_name: name of the configuration, replaced if it exists in the session
+
+        """
+        try:
+            if self.session is not None and self.session.name == session_name:
+                session = self.session
+            elif session_name in self.store.names():
+                session = self.store.load(session_name)
+            else:
+                session = Session(session_name)
+            session.store(self.model, configuration_name)
+            self.store.save(session)
+        except (OSError, ValueError) as err:
+            logger.error(f"Cannot save the session {session_name}: {err}")
+            return
+        self.session = session
+        self.update_session_view()
+
+    def handle_session_open(self):
+        """Ask the name of a stored session, then open it"""
+        session_name = self.view.session_widget.ask_session_name(self.store.names())
+        if session_name is not None:
+            self.open_session(session_name)
+
+    def open_session(self, session_name: str):
+        """Open a stored session and show its current configuration
+
+        Args:
+            session_name: name of the session
+
+        """
+        try:
+            session = self.store.load(session_name)
+        except (OSError, ValueError) as err:
+            logger.error(f"Cannot open the session {session_name}: {err}")
+            return
+        self.session = session
+        self.restore_configuration(session.current)
+
+    def handle_configuration_select(self, configuration_name: str):
+        """Show the configuration selected in the session"""
+        if self.session is not None and configuration_name in self.session.configurations:
+            self.restore_configuration(configuration_name)
+
+    def restore_configuration(self, configuration_name: str):
+        """Show a configuration of the open session; its stored map is drawn without calculating it again
+
+        Args:
+            configuration_name: name of the configuration
+
+        """
+        with self.batch_update():
+            self.session.restore(self.model, configuration_name)
+            self.update_session_view()
+            self.view.sc_widget.set_values(self.model.get_single_crystal_data())
+            self.view.experiment_widget.set_values(self.model.get_experiment_data())
+            saved_values = self.model.get_crosshair_data()
+            self.view.crosshair_widget.set_values(saved_values)
             self.view.plot_widget.update_crosshair(eline=saved_values["DeltaE"], qline=saved_values["modQ"])
+            # switching the mode updates the fields' visibility
+            experiment_type = self.view.selection_widget.powder_label
+            if self.model.cp.get_experiment_type().startswith("single"):
+                experiment_type = self.view.selection_widget.sc_label
+            self.view.selection_widget.selector_init(experiment_type)
+            self.update_dirty_products()
 
-        # get the valid values for experiment saved fields
-        # if the view contains an invalid value it is overwritten
-        saved_values = self.model.get_experiment_data()
-        self.view.experiment_widget.set_values(saved_values)
+    def update_session_view(self):
+        """Display the configurations of the open session"""
+        if self.session is None:
+            self.view.session_widget.set_session("", [], None)
+        else:
+            self.view.session_widget.set_session(
+                self.session.name, list(self.session.configurations), self.session.current
+            )
 
-        # get the valid values for single crystal saved fields
-        # if the view contains an invalid value it is overwritten
-        saved_values = self.model.get_single_crystal_data()
-        self.view.sc_widget.set_values(saved_values)
-        self.handle_QZ_angle()
+    def save_last_session(self):
+        """Store the current configuration and its map in the last session, restored at the next start"""
+        try:
+            session = Session(LAST_SESSION)
+            session.store(self.model, self.session.current if self.session else LAST_SESSION)
+            self.store.save(session)
+        except (OSError, ValueError) as err:
+            logger.error(f"Cannot save the last session: {err}")
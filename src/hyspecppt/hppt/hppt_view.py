@@ -1,11 +1,15 @@
 """Widgets for the main window"""
 
-from typing import Optional, Union
+from contextlib import contextmanager
+from typing import Callable, Optional, Union
 
+import numpy as np
 from matplotlib.backends.backend_qtagg import FigureCanvas
 from matplotlib.backends.backend_qtagg import NavigationToolbar2QT as NavigationToolbar
+from matplotlib.colors import to_rgba
 from matplotlib.figure import Figure
-from qtpy.QtCore import QObject, Signal
+from matplotlib.transforms import Affine2D
+from qtpy.QtCore import QObject, QTimer, Signal
 from qtpy.QtGui import QDoubleValidator, QValidator
 from qtpy.QtWidgets import (
     QButtonGroup,
@@ -13,8 +17,10 @@ from qtpy.QtWidgets import (
     QGridLayout,
     QGroupBox,
     QHBoxLayout,
+    QInputDialog,
     QLabel,
     QLineEdit,
+    QPushButton,
     QRadioButton,
     QSizePolicy,
     QSpacerItem,
@@ -25,6 +31,10 @@ from qtpy.QtWidgets import (
 from .experiment_settings import INVALID_QLINEEDIT, MAX_MODQ, PLOT_TYPES, alpha, beta, gamma
 from .hppt_view_validators import AbsValidator, AngleValidator
 
+# number of heatmap meshes kept, one for each of the last grid shapes, such as the stages of the progressive
+# refinement
+MAX_HEATMAPS = 4
+
 
 class HyspecPPTView(QWidget):
     """Main widget"""
@@ -40,8 +50,13 @@ class HyspecPPTView(QWidget):
 
         # callback functions defined by the presenter
         self.fields_callback = None
+        # field updates held until the end of a group of updates, by section name
+        self.pending_updates = None
         self.powder_mode_switch_callback = None
         self.sc_mode_switch_callback = None
+        self.session_save_callback = None
+        self.session_open_callback = None
+        self.configuration_select_callback = None
 
         layout = QHBoxLayout()
         self.setLayout(layout)
@@ -55,6 +70,8 @@ class HyspecPPTView(QWidget):
         left_side_layout.addWidget(self.selection_widget)
         left_side_layout.addWidget(self.sc_widget)
         left_side_layout.addWidget(self.crosshair_widget)
+        self.session_widget = SessionWidget(self)
+        left_side_layout.addWidget(self.session_widget)
         spacer = QSpacerItem(20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding)
         left_side_layout.addItem(spacer)
         self.plot_widget = PlotWidget(self)
@@ -83,10 +100,49 @@ class HyspecPPTView(QWidget):
         """
         self.sc_mode_switch_callback = callback
 
+    def connect_session_callbacks(
+        self, save: Callable[[], None], open_session: Callable[[], None], select: Callable[[str], None]
+    ):
+        """Callback functions for the session buttons and the configuration selection - set by the presenter
+
+        Args:
+            save: called to store the current configuration in a session
+            open_session: called to open a session
+            select: called with the name of the selected configuration of the session
+
+        """
+        self.session_save_callback = save
+        self.session_open_callback = open_session
+        self.configuration_select_callback = select
+
     def values_update(self, values):
         """Fields update"""
+        if self.pending_updates is not None:
+            # merge with the held update of the same section
+            if values["name"] in self.pending_updates:
+                self.pending_updates[values["name"]]["data"].update(values["data"])
+            else:
+                self.pending_updates[values["name"]] = dict(name=values["name"], data=dict(values["data"]))
+            return
         self.fields_callback(values)
 
+    @contextmanager
+    def hold_updates(self):
+        """Hold the fields updates emitted inside the block and send one merged update
+        per section when the block ends
+        """
+        if self.pending_updates is not None:
+            # nested block
+            yield
+            return
+        self.pending_updates = {}
+        try:
+            yield
+        finally:
+            pending_updates, self.pending_updates = self.pending_updates, None
+        for values in pending_updates.values():
+            self.fields_callback(values)
+
     def switch_to_sc(self) -> None:
         """Switch to Single Crystal mode"""
         if self.sc_mode_switch_callback:
@@ -97,6 +153,21 @@ class HyspecPPTView(QWidget):
         if self.powder_mode_switch_callback:
             self.powder_mode_switch_callback()
 
+    def save_session(self) -> None:
+        """Store the current configuration in a session"""
+        if self.session_save_callback:
+            self.session_save_callback()
+
+    def open_session(self) -> None:
+        """Open a session"""
+        if self.session_open_callback:
+            self.session_open_callback()
+
+    def select_configuration(self, configuration_name: str) -> None:
+        """Show a configuration of the session"""
+        if self.configuration_select_callback:
+            self.configuration_select_callback(configuration_name)
+
     def field_visibility_in_SC(self) -> None:
         """Set visibility for Single Crystal mode"""
         self.sc_widget.setVisible(True)
@@ -111,6 +182,9 @@ class HyspecPPTView(QWidget):
 class PlotWidget(QWidget):
     """Widget that displays the plot"""
 
+    # functions posted from worker threads, run in the GUI thread
+    posted = Signal(object)
+
     def __init__(self, parent: Optional["QObject"] = None) -> None:
         """Constructor for the plotting widget
 
@@ -130,17 +204,37 @@ class PlotWidget(QWidget):
         self.setLayout(layoutRight)
 
         # heatmap initialization
+        # the meshes are built in grid index units, and mapped to |Q| and DeltaE by heatmap_transform,
+        # so that the artists are reused for each grid shape; only the mesh of the shown shape is visible
         self.ax = self.static_canvas.figure.subplots()
         self.heatmap = self.ax.pcolormesh([[0, 0]], [[0, 0]], [[0, 0]])
+        self.heatmap_shape = None
+        self.heatmaps = {}
+        self.heatmap_transform = Affine2D()
         self.qmin_line = self.ax.plot([0, 0], [0, 0])[0]
         self.qmax_line = self.ax.plot([0, 0], [0, 0])[0]
         self.cb = self.figure.colorbar(self.heatmap, ax=self.ax, pad=0.0)
 
+        # reflections overlay: filled markers inside the detector coverage, hollow outside
+        self.reflections = self.ax.scatter(np.empty(0), np.empty(0), s=20, linewidths=0.8, zorder=3)
+
         # crosshair initialization
+        # the crosshair lines are animated: they are drawn over a cached copy of the plot,
+        # so moving them does not redraw the heatmap
         self.eline_data = 0
         self.qline_data = 0
-        self.eline = self.ax.axhline(y=self.eline_data)
-        self.qline = self.ax.axvline(x=self.qline_data)
+        self.eline = self.ax.axhline(y=self.eline_data, animated=True)
+        self.qline = self.ax.axvline(x=self.qline_data, animated=True)
+        self.background = None
+        self.data_limits = None
+        self.static_canvas.mpl_connect("draw_event", self.on_draw)
+
+        # progressive refinement of the plot: next stage, called from the event loop
+        self.refine_callback = None
+        self.refine_timer = QTimer(self)
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.timeout.connect(self.refine_plot)
+        self.posted.connect(self.run_posted)
 
         # draw the plot
         self.static_canvas.draw()
@@ -162,53 +256,186 @@ class PlotWidget(QWidget):
             qline (float): y
 
         """
+        # the crosshair is part of the autoscaled limits; the cached plot is reused
+        # only if the old and new positions do not change them
+        blit = self.crosshair_in_data_limits()
         self.eline_data = eline
         self.qline_data = qline
         self.eline.set_data([0, 1], [self.eline_data, self.eline_data])
         self.qline.set_data([self.qline_data, self.qline_data], [0, 1])
 
-        self.set_axes_meta_and_draw_plot()
+        if blit and self.crosshair_in_data_limits():
+            self.blit_crosshair()
+        else:
+            self.set_axes_meta_and_draw_plot()
+
+    def crosshair_in_data_limits(self) -> bool:
+        """Check whether the crosshair is inside the limits of the plotted data
+
+        Returns:
+            bool: True if both crosshair lines are inside the |Q| and DeltaE range of the tank edges
+
+        """
+        if self.data_limits is None:
+            return False
+        q_low, q_high, e_low, e_high = self.data_limits
+        return q_low <= float(self.qline_data) <= q_high and e_low <= float(self.eline_data) <= e_high
+
+    def on_draw(self, _event) -> None:
+        """Cache the plot after a full draw, then draw the crosshair over it
+
+        Args:
+            _event: matplotlib draw event
+
+        """
+        self.background = self.static_canvas.copy_from_bbox(self.figure.bbox)
+        self.ax.draw_artist(self.eline)
+        self.ax.draw_artist(self.qline)
+
+    def blit_crosshair(self) -> None:
+        """Repaint only the crosshair lines over the cached plot"""
+        if self.background is None:
+            # a full draw is pending, or the plot was not drawn yet
+            self.static_canvas.draw_idle()
+            return
+        self.static_canvas.restore_region(self.background)
+        self.ax.draw_artist(self.eline)
+        self.ax.draw_artist(self.qline)
+        self.static_canvas.blit(self.figure.bbox)
 
     def update_plot(
         self,
         q_min: list[float],
         q_max: list[float],
         energy_transfer: list[float],
-        q2d: list[list[float]],
-        e2d: list[list[float]],
+        momentum_transfer: list[float],
         scharpf_angle: list[list[float]],
         plot_label: str,
+        refine: Optional[Callable[[], None]] = None,
     ):
         """Update the colormesh, colorbar and redraw the crosshair
 
         Args:
             q_min: list of float numbers,
             q_max: list of float numbers,
-            energy_transfer: list of float numbers,
-            q2d: list of lists of float numbers,
-            e2d: list of lists of float numbers,
-            scharpf_angle: list of lists of float numbers,
+            energy_transfer: list of float numbers, the uniform energy axis of the grid
+            momentum_transfer: list of float numbers, the uniform |Q| axis of the grid
+            scharpf_angle: list of lists of float numbers, with shape (|Q|, energy transfer),
             plot_label: used for colormap label,
+            refine: progressive mode, called from the event loop after the plot is drawn
+                    to draw the next, finer stage
 
         """
-        # clear
-        self.cb.remove()
-        self.ax.clear()
+        q_axis = np.asarray(momentum_transfer)
+        e_axis = np.asarray(energy_transfer)
+        # rows of the mesh are energy transfer
+        intensity = np.transpose(scharpf_angle)
+
+        # update heatmap; a mesh is built only for a new grid shape, and the least recently shown is removed
+        shape = np.shape(scharpf_angle)
+        if shape != self.heatmap_shape:
+            if self.heatmap_shape is None:
+                self.heatmap.remove()
+            else:
+                self.heatmap.set_visible(False)
+            heatmap = self.heatmaps.pop(shape, None)
+            if heatmap is None:
+                heatmap = self.ax.pcolormesh(
+                    np.arange(len(q_axis) + 1) - 0.5,
+                    np.arange(len(e_axis) + 1) - 0.5,
+                    intensity,
+                    cmap="jet",
+                    transform=self.heatmap_transform + self.ax.transData,
+                )
+                if len(self.heatmaps) >= MAX_HEATMAPS:
+                    self.heatmaps.pop(next(iter(self.heatmaps))).remove()
+            heatmap.set_visible(True)
+            self.heatmaps[shape] = heatmap
+            self.heatmap = heatmap
+            self.heatmap_shape = shape
+        self.heatmap.set_array(intensity)
+
+        # map the grid indices to |Q| and DeltaE, on uniform axes
+        q_step = (q_axis[-1] - q_axis[0]) / (len(q_axis) - 1) if len(q_axis) > 1 else 1.0
+        e_step = (e_axis[-1] - e_axis[0]) / (len(e_axis) - 1) if len(e_axis) > 1 else 1.0
+        self.heatmap_transform.clear().scale(q_step, e_step).translate(q_axis[0], e_axis[0])
+        self.qmin_line.set_data(q_min, energy_transfer)
+        self.qmax_line.set_data(q_max, energy_transfer)
+        if np.isfinite(q_min).any() or np.isfinite(q_max).any():
+            self.data_limits = (
+                np.nanmin([q_min, q_max]),
+                np.nanmax([q_min, q_max]),
+                np.nanmin(energy_transfer),
+                np.nanmax(energy_transfer),
+            )
+        else:
+            self.data_limits = None
 
-        # update heatmap
-        self.heatmap = self.ax.pcolormesh(q2d, e2d, scharpf_angle, cmap="jet")
-        self.ax.plot(q_min, energy_transfer)
-        self.ax.plot(q_max, energy_transfer)
+        # update colorbar
+        self.update_colorbar(plot_label)
 
-        # Add colorbar
-        self.cb = self.figure.colorbar(self.heatmap, ax=self.ax, pad=0.0)
-        self.cb.set_label(plot_label)
+        self.set_axes_meta_and_draw_plot()
 
-        # redraw crosshair
-        self.eline = self.ax.axhline(y=self.eline_data)
-        self.qline = self.ax.axvline(x=self.qline_data)
+        # schedule the next stage after pending events, such as new user input, are processed
+        self.refine_callback = refine
+        if refine is not None:
+            self.refine_timer.start(0)
 
-        self.set_axes_meta_and_draw_plot()
+    def refine_plot(self) -> None:
+        """Draw the next stage of a progressive plot update"""
+        refine, self.refine_callback = self.refine_callback, None
+        if refine is not None:
+            refine()
+
+    def post(self, function: Callable[[], None]) -> None:
+        """Run function in the GUI thread; can be called from any thread
+
+        Args:
+            function: callable without arguments, for example a plot update
+
+        """
+        self.posted.emit(function)
+
+    def run_posted(self, function: Callable[[], None]) -> None:
+        """Run a function posted by a worker thread
+
+        Args:
+            function: callable without arguments
+
+        """
+        function()
+
+    def update_reflections(self, modQ: np.array, energy_transfer: float, in_coverage: np.array) -> None:
+        """Update the markers of the reflections in place
+
+        Equivalent reflections have the same position, so they are drawn once.
+
+        Args:
+            modQ: array of momentum transfers of the reflections, empty to hide the overlay
+            energy_transfer: energy transfer of the reflections
+            in_coverage: array of bool, True for reflections inside the detector coverage
+
+        """
+        modQ, index = np.unique(np.round(modQ, 9), return_index=True)
+        inside = np.asarray(in_coverage, dtype=bool)[index]
+        self.reflections.set_offsets(np.column_stack([modQ, np.full_like(modQ, energy_transfer)]))
+        self.reflections.set_facecolors(np.where(inside[:, None], to_rgba("white"), to_rgba("none")))
+        self.reflections.set_edgecolors(np.where(inside[:, None], to_rgba("black"), to_rgba("grey")))
+        self.background = None
+        self.static_canvas.draw_idle()
+
+    def update_colorbar(self, plot_label: str) -> None:
+        """Rescale the colormap to the heatmap values and update the colorbar
+
+        Args:
+            plot_label: used for colormap label,
+
+        """
+        # keep the previous limits if all the values are masked
+        if np.ma.count(self.heatmap.get_array()):
+            self.heatmap.autoscale()
+        self.cb.update_normal(self.heatmap)
+        self.cb.set_label(plot_label)
 
     def set_axes_meta_and_draw_plot(self):
         """Set labels, color and draw static canvas
@@ -222,7 +449,10 @@ class PlotWidget(QWidget):
         self.qline.set_color("darkgrey")
         self.eline.set_color("darkgrey")
 
-        self.static_canvas.draw()
+        # several updates in the same event loop iteration are drawn once;
+        # the cached plot is out of date until then
+        self.background = None
+        self.static_canvas.draw_idle()
 
 
 class SelectorWidget(QWidget):
@@ -301,6 +531,100 @@ class SelectorWidget(QWidget):
             return self.sc_label
 
 
+class SessionWidget(QWidget):
+    """Widget that stores configurations in named sessions and opens them"""
+
+    def __init__(self, parent: Optional["QObject"] = None) -> None:
+        """Constructor for the session widget
+
+        Args:
+            parent (QObject): Optional parent
+
+        """
+        super().__init__(parent)
+        self.session_name = ""
+
+        self.configuration_combobox = QComboBox(self)
+        self.configuration_label = QLabel("Configuration:", self)
+        self.configuration_label.setBuddy(self.configuration_combobox)
+        tooltip_configuration = "Configurations of the open session, shown with their last map."
+        self.configuration_combobox.setToolTip(tooltip_configuration)
+        self.configuration_label.setToolTip(tooltip_configuration)
+
+        self.save_button = QPushButton("Sa&ve...", self)
+        self.save_button.setToolTip("Store the current configuration and its map in a named session.")
+        self.open_button = QPushButton("&Open...", self)
+        self.open_button.setToolTip("Open a named session with all its configurations.")
+
+        box_layout = QHBoxLayout()
+        box_layout.addWidget(self.configuration_label)
+        box_layout.addWidget(self.configuration_combobox, 1)
+        box_layout.addWidget(self.save_button)
+        box_layout.addWidget(self.open_button)
+
+        self.groupBox = QGroupBox("Session")
+        self.groupBox.setLayout(box_layout)
+        layout = QVBoxLayout()
+        layout.addWidget(self.groupBox)
+        self.setLayout(layout)
+
+        if parent:
+            self.save_button.clicked.connect(parent.save_session)
+            self.open_button.clicked.connect(parent.open_session)
+            self.configuration_combobox.textActivated.connect(parent.select_configuration)
+
+    def set_session(self, session_name: str, configuration_names: list[str], current: str) -> None:
+        """Display the configurations of a session
+
+        Args:
+            session_name: name of the session, empty if no session is open
+            configuration_names: names of the configurations of the session
+            current: name of the current configuration
+
+        """
+        self.session_name = session_name
+        self.groupBox.setTitle(f"Session: {session_name}" if session_name else "Session")
+        self.configuration_combobox.blockSignals(True)
+        self.configuration_combobox.clear()
+        self.configuration_combobox.addItems(configuration_names)
+        if current in configuration_names:
+            self.configuration_combobox.setCurrentIndex(configuration_names.index(current))
+        self.configuration_combobox.blockSignals(False)
+
+    def ask_configuration_name(self, configuration_name: str) -> Optional[tuple[str, str]]:
+        """Ask the names of the session and of the configuration to store
+
+        Args:
+            configuration_name: proposed name of the configuration
+
+        Returns:
+            session name and configuration name, or None if cancelled
+
+        """
+        session_name, accepted = QInputDialog.getText(self, "Save configuration", "Session:", text=self.session_name)
+        if not accepted or not session_name:
+            return None
+        configuration_name, accepted = QInputDialog.getText(
+            self, "Save configuration", "Configuration:", text=configuration_name
+        )
+        if not accepted or not configuration_name:
+            return None
+        return session_name, configuration_name
+
+    def ask_session_name(self, session_names: list[str]) -> Optional[str]:
+        """Ask the name of the session to open
+
+        Args:
+            session_names: names of the stored sessions
+
+        Returns:
+            session name, or None if cancelled
+
+        """
+        session_name, accepted = QInputDialog.getItem(self, "Open session", "Session:", session_names, editable=False)
+        return session_name if accepted and session_name else None
+
+
 class SingleCrystalWidget(QWidget):
     """Widget for inputting single crystal parameters"""
 
@@ -0,0 +1,144 @@
+"""Orientation of a single crystal and sweeps over the sample rotation angle
+
+The laboratory frame has z along the incident beam, y vertical and x in the horizontal plane,
+so that the detector angle S2 is the angle of kf from z towards x. The sample rotation psi
+is a rotation about y.
+"""
+
+import numpy as np
+
+from .experiment_settings import SE2K, TANK_HALF_WIDTH
+
+# maximum number of (reflection, rotation step, energy transfer) elements evaluated at once
+CHUNK_SIZE = 1 << 18
+
+# tolerance on the vertical component of Q, relative to its magnitude, for reflections in the horizontal plane
+IN_PLANE_TOLERANCE = 1e-6
+
+
+def ub_matrix(B: np.array, u: np.array, v: np.array) -> np.array:
+    """Returns the UB matrix for two orientation vectors
+
+    At psi = 0 the reciprocal lattice vector u is along the incident beam, and v is in the horizontal
+    plane, on the positive x side. Q in the laboratory frame is 2 pi UB hkl.
+
+    Args:
+        B: B matrix of the lattice, without the 2 pi factor
+        u: h, k, l of the vector along the beam
+        v: h, k, l of a second vector in the horizontal plane, not parallel to u
+
+    """
+    t1 = B @ np.asarray(u, dtype=float)
+    t3 = np.cross(t1, B @ np.asarray(v, dtype=float))
+    if np.linalg.norm(t1) == 0 or np.linalg.norm(t3) < 1e-12 * np.linalg.norm(t1):
+        raise ValueError("The orientation vectors must be non-zero and not parallel")
+    t1 /= np.linalg.norm(t1)
+    t3 /= np.linalg.norm(t3)
+    t2 = np.cross(t3, t1)
+
+    # t1, t2, t3 are mapped to z, x, y
+    crystal_frame = np.column_stack([t1, t2, t3])
+    laboratory_frame = np.array([[0.0, 1.0, 0.0], [0.0, 0.0, 1.0], [1.0, 0.0, 0.0]])
+    return laboratory_frame @ crystal_frame.T @ B
+
+
+def _sweep_chunk(
+    Q: np.array, psi: np.array, ki: float, kf: np.array, S2: float, alpha_p: float
+) -> tuple[np.array, np.array, np.array, np.array]:
+    """Evaluate a block of reflections over all the rotation steps
+
+    Args:
+        Q: Q in the laboratory frame at psi = 0, with shape (N, 3)
+        psi: rotation angles in degrees, with shape (P,)
+        ki: incident momentum
+        kf: final momenta, with shape (E,)
+        S2: detector angle S2
+        alpha_p: polarization angle
+
+    """
+    cos_psi = np.cos(np.radians(psi))
+    sin_psi = np.sin(np.radians(psi))
+    # rotation about y
+    Qx = Q[:, 0, None] * cos_psi + Q[:, 2, None] * sin_psi
+    Qz = -Q[:, 0, None] * sin_psi + Q[:, 2, None] * cos_psi
+    modQ2 = np.sum(Q**2, axis=1)[:, None]
+
+    # kf = ki - Q; its angle from the beam is the scattering angle, with the sign of S2
+    two_theta = np.degrees(np.arctan2(-Qx, ki - Qz))
+    in_plane = np.abs(Q[:, 1, None]) <= IN_PLANE_TOLERANCE * np.sqrt(modQ2)
+    in_tank = in_plane & (two_theta >= S2 - TANK_HALF_WIDTH) & (two_theta <= S2 + TANK_HALF_WIDTH)
+
+    # the reflection is measured at the energy transfer where |ki - Q| = kf;
+    # it crosses this condition between a rotation step and the next if the sign changes
+    mismatch = (ki**2 + modQ2 - 2 * ki * Qz)[:, :, None] - kf**2
+    crossing = np.zeros(mismatch.shape, dtype=bool)
+    crossing[:, :-1, :] = mismatch[:, :-1, :] * mismatch[:, 1:, :] <= 0
+
+    with np.errstate(invalid="ignore"):
+        alpha_s = np.degrees(np.arccos(np.cos(np.arctan2(Qx, Qz) - np.radians(alpha_p))))
+    alpha_s[np.broadcast_to(modQ2 == 0, alpha_s.shape)] = np.nan
+    return two_theta, in_tank, crossing, alpha_s
+
+
+def rotation_sweep(
+    UB: np.array,
+    hkl: np.array,
+    psi: np.array,
+    DeltaE: np.array,
+    Ei: float,
+    S2: float,
+    alpha_p: float,
+    processes: int = 0,
+) -> dict[str, np.array]:
+    """Sweep the sample rotation for a set of reflections
+
+    The reflections are evaluated in chunks, each one vectorized over the reflections in the chunk,
+    the rotation steps and the energy transfers. The chunks run in a process pool if processes is
+    larger than 1.
+
+    Args:
+        UB: UB matrix, without the 2 pi factor
+        hkl: array of h, k, l with shape (N, 3)
+        psi: rotation angles in degrees, with shape (P,), in increasing order
+        DeltaE: energy transfers, with shape (E,)
+        Ei: incident energy
+        S2: detector angle S2
+        alpha_p: polarization angle
+        processes: number of worker processes, 0 or 1 to run in this process
+
+    Returns:
+        dictionary with, for each reflection and rotation step, the scattering angle two_theta (degrees),
+        in_tank (bool, the reflection is in the horizontal plane and kf is inside the detector tank),
+        alpha_s (Scharpf angle, degrees), all with shape (N, P), and measured (bool, with shape (N, P, E),
+        True if the reflection crosses the scattering condition at the energy transfer between this
+        rotation step and the next, inside the tank)
+
+    """
+    hkl = np.asarray(hkl, dtype=float).reshape(-1, 3)
+    psi = np.asarray(psi, dtype=float).ravel()
+    DeltaE = np.asarray(DeltaE, dtype=float).ravel()
+    Q = 2 * np.pi * hkl @ np.asarray(UB).T
+    ki = np.sqrt(Ei) * SE2K
+    with np.errstate(invalid="ignore"):
+        kf = np.sqrt(Ei - DeltaE) * SE2K
+
+    chunk = max(1, CHUNK_SIZE // max(1, len(psi) * len(DeltaE)))
+    arguments = [(Q[start : start + chunk], psi, ki, kf, S2, alpha_p) for start in range(0, len(Q), chunk)]
+    if processes > 1 and len(arguments) > 1:
+        # imported here, the process pool is only used for large sweeps
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_sweep_chunk, *zip(*arguments)))
+    else:
+        results = [_sweep_chunk(*args) for args in arguments]
+
+    if not results:
+        results = [_sweep_chunk(Q, psi, ki, kf, S2, alpha_p)]
+    two_theta, in_tank, crossing, alpha_s = (np.concatenate(arrays) for arrays in zip(*results))
+    return dict(
+        two_theta=two_theta,
+        in_tank=in_tank,
+        alpha_s=alpha_s,
+        measured=crossing & in_tank[:, :, None],
+    )
@@ -0,0 +1,129 @@
+"""Index of the reflections of a single crystal, sorted by momentum transfer"""
+
+import logging
+
+import numpy as np
+
+from .experiment_settings import MAX_MODQ
+
+logger = logging.getLogger("hyspecppt")
+
+# reflection conditions of the lattice centerings, for h, k, l in the conventional cell:
+# a reflection is allowed if c_h*h + c_k*k + c_l*l is a multiple of n for each ((c_h, c_k, c_l), n)
+CENTERINGS = {
+    "P": [],
+    "A": [((0, 1, 1), 2)],
+    "B": [((1, 0, 1), 2)],
+    "C": [((1, 1, 0), 2)],
+    "I": [((1, 1, 1), 2)],
+    "F": [((1, 1, 0), 2), ((0, 1, 1), 2)],
+    "R": [((-1, 1, 1), 3)],  # obverse setting, hexagonal axes
+}
+
+# maximum number of h, k, l triplets evaluated at once
+CHUNK_SIZE = 1 << 20
+# maximum number of reflections of an index; the maximum |Q| of large cells is reduced to keep below it
+MAX_REFLECTIONS = 1 << 20
+
+
+class ReflectionIndex:
+    r"""Reflections of a lattice with \|Q\| below a maximum, sorted by \|Q\|
+
+    The reflections are stored in arrays: hkl with shape (N, 3) and modQ with shape (N,),
+    both read-only. Range queries are binary searches, and return views of these arrays.
+    """
+
+    hkl: np.array
+    modQ: np.array
+    centering: str
+    max_modQ: float
+
+    def __init__(self, B: np.array, max_modQ: float = MAX_MODQ, centering: str = "P") -> None:
+        r"""Enumerate the reflections
+
+        Args:
+            B: B matrix of the lattice, without the 2 pi factor
+            max_modQ: maximum \|Q\|, reduced if the lattice has more than MAX_REFLECTIONS reflections below it
+            centering: lattice centering, one of CENTERINGS, for the systematic extinctions
+
+        """
+        if centering not in CENTERINGS:
+            raise ValueError(f"Unknown centering {centering}, expected one of {', '.join(CENTERINGS)}")
+        self.centering = centering
+        B = 2 * np.pi * np.asarray(B, dtype=float)
+
+        # number of reflections in the sphere of radius max_modQ, from the volume of the reciprocal cell
+        reciprocal_volume = abs(np.linalg.det(B))
+        if 4 / 3 * np.pi * max_modQ**3 / reciprocal_volume > MAX_REFLECTIONS:
+            limit = float(np.cbrt(MAX_REFLECTIONS * reciprocal_volume * 3 / (4 * np.pi)))
+            logger.warning(f"The reflections of this lattice are only listed up to |Q| = {limit:.2f}")
+            max_modQ = limit
+        self.max_modQ = max_modQ
+
+        # |h| <= max_modQ * |a| / 2 pi; the rows of inv(B) are the real space lattice vectors over 2 pi
+        h_max, k_max, l_max = np.floor(max_modQ * np.linalg.norm(np.linalg.inv(B), axis=1)).astype(int)
+        h = np.arange(-h_max, h_max + 1)
+        k = np.arange(-k_max, k_max + 1)
+        l = np.arange(-l_max, l_max + 1)
+
+        # metric tensor of the reciprocal lattice, |Q|^2 = hkl G hkl
+        G = B.T @ B
+        hkl_chunks = []
+        modQ_chunks = []
+        # the grid is evaluated a few planes of constant h at a time, to limit the memory
+        planes = max(1, CHUNK_SIZE // (len(k) * len(l)))
+        for start in range(0, len(h), planes):
+            # broadcast h, k, l along the three axes of the block
+            hh = h[start : start + planes, None, None]
+            kk = k[None, :, None]
+            ll = l[None, None, :]
+            modQ2 = (
+                G[0, 0] * hh**2
+                + G[1, 1] * kk**2
+                + G[2, 2] * ll**2
+                + 2 * (G[0, 1] * hh * kk + G[0, 2] * hh * ll + G[1, 2] * kk * ll)
+            )
+            keep = modQ2 < max_modQ**2
+            for (c_h, c_k, c_l), n in CENTERINGS[centering]:
+                keep &= (c_h * hh + c_k * kk + c_l * ll) % n == 0
+            i_h, i_k, i_l = np.nonzero(keep)
+            hkl_chunks.append(np.stack([hh[i_h, 0, 0], k[i_k], l[i_l]], axis=1))
+            modQ_chunks.append(np.sqrt(modQ2[i_h, i_k, i_l]))
+
+        modQ = np.concatenate(modQ_chunks)
+        order = np.argsort(modQ, kind="stable")
+        # skip h = k = l = 0, at the start after sorting
+        order = order[np.count_nonzero(modQ == 0) :]
+        self.modQ = modQ[order]
+        self.hkl = np.concatenate(hkl_chunks)[order]
+        self.modQ.flags.writeable = False
+        self.hkl.flags.writeable = False
+
+    def __len__(self) -> int:
+        """Number of reflections"""
+        return len(self.modQ)
+
+    def modQ_range(self, modQ_min: float, modQ_max: float) -> slice:
+        r"""Returns the slice of the reflections with modQ_min <= \|Q\| <= modQ_max
+
+        Args:
+            modQ_min: minimum \|Q\|
+            modQ_max: maximum \|Q\|
+
+        """
+        if not modQ_min <= modQ_max:
+            return slice(0, 0)
+        start = np.searchsorted(self.modQ, modQ_min, side="left")
+        stop = np.searchsorted(self.modQ, modQ_max, side="right")
+        return slice(int(start), int(stop))
+
+    def near(self, modQ: float, delta: float) -> tuple[np.array, np.array]:
+        r"""Returns the h, k, l and \|Q\| of the reflections within delta of modQ
+
+        Args:
+            modQ: momentum transfer, for example of the crosshair
+            delta: half width of the range
+
+        """
+        selection = self.modQ_range(modQ - delta, modQ + delta)
+        return self.hkl[selection], self.modQ[selection]
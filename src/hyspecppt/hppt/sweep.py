@@ -0,0 +1,208 @@
+r"""Sweeps of the polarization map over the detector angle and the polarization angle
+
+The map only depends on Ei through the scale of its axes, so a sweep is calculated in reduced units,
+q = \|Q\|/ki and e = DeltaE/Ei, on axes shared by all the detector angles. The result is one array
+with shape (alpha_p, S2, q, e). The angle between Q and the beam is calculated once for each detector
+angle. With worker processes, the workers share it through shared memory, and write each block into
+its own shared memory array, copied into the result when the block is done. Only the parameters of
+the blocks are sent to the workers.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .experiment_settings import N_POINTS, PLOT_TYPES, SE2K
+from .hppt_model import PLOT_KERNELS, _reduced_phi_Q, _tank_edges
+
+# number of blocks per worker process, so that the blocks of slower detector angles are balanced
+BLOCKS_PER_PROCESS = 4
+
+
+def sweep_axes(S2: np.array, e_min: float = -1.0, n_points: int = N_POINTS) -> tuple[np.array, np.array]:
+    r"""Returns the reduced energy and momentum axes shared by all the detector angles
+
+    The energy axis has the step of the map, linspace(-1, 0.9, n_points), and is extended below -1
+    with the same step if needed. The momentum axis has n_points from 0 to the largest \|Q\| of the
+    tank for any of the detector angles.
+
+    Args:
+        S2: detector angles
+        e_min: minimum energy transfer in units of Ei
+        n_points: number of points along each axis, for e_min = -1
+
+    """
+    e = np.linspace(-1, 0.9, n_points)
+    if n_points > 1 and e_min < -1:
+        e_step = e[1] - e[0]
+        n_rows = int(np.ceil((-1 - e_min) / e_step - 1e-9))
+        e = np.concatenate([-1 - e_step * np.arange(n_rows, 0, -1), e])
+    q_max = max(np.max(_tank_edges(angle, e)[1]) for angle in np.atleast_1d(S2))
+    return e, np.linspace(0, q_max, n_points)
+
+
+def _sweep_block(intensity: np.array, phi_Q: np.array, alpha_p: np.array, plot_type: str) -> None:
+    """Fill intensity[index] for each polarization angle alpha_p[index], from phi_Q of one detector angle"""
+    with np.errstate(invalid="ignore"):
+        for target, angle in zip(intensity, alpha_p):
+            np.subtract(phi_Q, np.radians(angle), out=target)
+            np.cos(target, out=target)
+            PLOT_KERNELS[plot_type](target, target)
+
+
+def _sweep_shared_phi_Q(name: str, shape: tuple[int, ...], S2_index: int, S2: float, e: np.array, q: np.array) -> None:
+    """Calculate phi_Q of one detector angle in a worker process, into the shared memory block of all the angles"""
+    # the workers share the resource tracker of the parent process, which unlinks the block
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        np.ndarray(shape, dtype=float, buffer=block.buf)[S2_index] = _reduced_phi_Q(S2, e, q)
+    finally:
+        block.close()
+
+
+def _sweep_shared_block(
+    phi_Q_name: str, phi_Q_shape: tuple[int, ...], name: str, S2_index: int, alpha_p: np.array, plot_type: str
+) -> None:
+    """Run _sweep_block in a worker process, from the shared phi_Q into the shared memory block of this block"""
+    phi_Q_block = shared_memory.SharedMemory(name=phi_Q_name)
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        _sweep_block(
+            np.ndarray((len(alpha_p), *phi_Q_shape[1:]), dtype=float, buffer=block.buf),
+            np.ndarray(phi_Q_shape, dtype=float, buffer=phi_Q_block.buf)[S2_index],
+            alpha_p,
+            plot_type,
+        )
+    finally:
+        block.close()
+        phi_Q_block.close()
+
+
+def _sweep_blocks_in_pool(
+    executor: ProcessPoolExecutor,
+    processes: int,
+    phi_Q_name: str,
+    intensity: np.array,
+    blocks: list[tuple[int, int, np.array]],
+    plot_type: str,
+) -> None:
+    """Run the blocks in the process pool, and copy each one into intensity when it is done
+
+    Each running block has its own shared memory block, and at most processes blocks run at a time,
+    so that the shared memory only holds a fraction of the sweep.
+    """
+    phi_Q_shape = intensity.shape[1:]
+    remaining = iter(blocks)
+    running = {}
+    try:
+        while True:
+            for S2_index, start, angles in islice(remaining, processes - len(running)):
+                block = shared_memory.SharedMemory(
+                    create=True, size=max(1, len(angles) * int(np.prod(phi_Q_shape[1:])) * 8)
+                )
+                running[
+                    executor.submit(
+                        _sweep_shared_block, phi_Q_name, phi_Q_shape, block.name, S2_index, angles, plot_type
+                    )
+                ] = (block, S2_index, start, len(angles))
+            if not running:
+                return
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                block, S2_index, start, n_angles = running.pop(future)
+                try:
+                    # raise the exception of the worker
+                    future.result()
+                    intensity[start : start + n_angles, S2_index] = np.ndarray(
+                        (n_angles, *phi_Q_shape[1:]), dtype=float, buffer=block.buf
+                    )
+                finally:
+                    block.close()
+                    block.unlink()
+    finally:
+        for block, *_ in running.values():
+            block.close()
+            block.unlink()
+
+
+def parameter_sweep(
+    S2: np.array,
+    alpha_p: np.array,
+    Ei: np.array = None,
+    plot_type: str = PLOT_TYPES[1],
+    e_min: float = -1.0,
+    n_points: int = N_POINTS,
+    processes: int = 0,
+    out: np.array = None,
+) -> dict[str, np.array]:
+    """Calculate the map for all the combinations of detector and polarization angles
+
+    The angle phi_Q between Q and the beam is calculated once for each detector angle. If processes is
+    larger than 1, it is calculated in a process pool into a shared memory array, then the blocks of the
+    sweep, one detector angle and a range of polarization angles, run in the pool. Each block is copied
+    into the returned array when it is done, so that the sweep is never held twice in memory.
+
+    Args:
+        S2: detector angles, with shape (S,)
+        alpha_p: polarization angles, with shape (A,)
+        Ei: incident energies, with shape (I,), only used to scale the axes
+        plot_type: plotted quantity, one of PLOT_TYPES
+        e_min: minimum energy transfer in units of Ei
+        n_points: number of points along each axis, for e_min = -1
+        processes: number of worker processes, 0 or 1 to run in this process
+        out: float64 array with shape (A, S, q, e) to fill with the intensity, a new array if None
+
+    Returns:
+        dictionary with S2, alpha_p, the reduced axes q and e, and intensity with shape (A, S, q, e),
+        NAN outside the detector tank; with Ei, also Q with shape (I, q) and E with shape (I, e)
+
+    Raises:
+        ValueError: if out does not have the shape or the type of the intensity
+
+    """
+    S2 = np.atleast_1d(np.asarray(S2, dtype=float))
+    alpha_p = np.atleast_1d(np.asarray(alpha_p, dtype=float))
+    e, q = sweep_axes(S2, e_min, n_points)
+    shape = (len(alpha_p), len(S2), len(q), len(e))
+    if out is None:
+        intensity = np.empty(shape)
+    elif out.shape != shape or out.dtype != np.float64:
+        raise ValueError(f"out must be a float64 array with shape {shape}, not {out.dtype} with shape {out.shape}")
+    else:
+        intensity = out
+
+    if processes > 1 and len(S2) * len(alpha_p) > 1:
+        # phi_Q is calculated once for each detector angle, then the blocks of polarization angles
+        # for each detector angle read it
+        n_blocks = max(1, -(-BLOCKS_PER_PROCESS * processes // len(S2)))
+        block_size = max(1, -(-len(alpha_p) // n_blocks))
+        blocks = [
+            (S2_index, start, alpha_p[start : start + block_size])
+            for S2_index in range(len(S2))
+            for start in range(0, len(alpha_p), block_size)
+        ]
+        phi_Q_block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape[1:])) * 8))
+        try:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                # consume the results to raise the exceptions of the workers
+                list(
+                    executor.map(
+                        _sweep_shared_phi_Q,
+                        *zip(*[(phi_Q_block.name, shape[1:], index, angle, e, q) for index, angle in enumerate(S2)]),
+                    )
+                )
+                _sweep_blocks_in_pool(executor, processes, phi_Q_block.name, intensity, blocks, plot_type)
+        finally:
+            phi_Q_block.close()
+            phi_Q_block.unlink()
+    else:
+        for S2_index, angle in enumerate(S2):
+            _sweep_block(intensity[:, S2_index], _reduced_phi_Q(angle, e, q), alpha_p, plot_type)
+
+    data = dict(S2=S2, alpha_p=alpha_p, q=q, e=e, intensity=intensity)
+    if Ei is not None:
+        Ei = np.atleast_1d(np.asarray(Ei, dtype=float))
+        data.update(Ei=Ei, Q=np.sqrt(Ei)[:, None] * SE2K * q, E=Ei[:, None] * e)
+    return data
@@ -1,40 +1,24 @@
-"""Main Qt application"""
+"""Main Qt application
+
+Qt and the widgets are imported after the command line is parsed, so that --version does not load them.
+"""
 
 import argparse
 import logging
 import sys
 
-from qtpy.QtWidgets import QApplication, QMainWindow
-
 from hyspecppt import __version__
-from hyspecppt.configuration import Configuration
-from hyspecppt.mainwindow import MainWindow
 
 logger = logging.getLogger("hyspecppt")
 
 
-class HyspecPPT(QMainWindow):
-    """Main Package window"""
-
-    def __init__(self, parent=None):
-        """Constructor"""
-        super().__init__(parent)
-        logger.info(f"Hyspecppt version: {__version__}")
-        config = Configuration()
+def __getattr__(name):
+    """Import the main window class when it is first used"""
+    if name == "HyspecPPT":
+        from hyspecppt.mainwindow import HyspecPPT
 
-        if not config.is_valid():
-            msg = (
-                "Error with configuration settings!",
-                f"Check and update your file: {config.config_file_path}",
-                "with the latest settings found here:",
-                f"{config.template_file_path} and start the application again.",
-            )
-
-            print(" ".join(msg))
-            sys.exit(-1)
-        self.setWindowTitle(f"Hyspecppt - {__version__}")
-        self.main_window = MainWindow(self)
-        self.setCentralWidget(self.main_window)
+        return HyspecPPT
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def gui():
@@ -46,6 +30,10 @@ def gui():
         print(__version__)
         sys.exit()
     else:
+        from qtpy.QtWidgets import QApplication
+
+        from hyspecppt.mainwindow import HyspecPPT
+
         app = QApplication(sys.argv)
         window = HyspecPPT()
         window.show()
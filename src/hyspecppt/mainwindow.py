@@ -1,11 +1,48 @@
 """Main Qt window"""
 
-from qtpy.QtWidgets import QHBoxLayout, QPushButton, QVBoxLayout, QWidget
+import logging
+import sys
 
+from qtpy.QtWidgets import QHBoxLayout, QMainWindow, QPushButton, QVBoxLayout, QWidget
+
+from hyspecppt import __version__
+from hyspecppt.configuration import Configuration
 from hyspecppt.help.help_model import help_function
 from hyspecppt.hppt.hppt_model import HyspecPPTModel
-from hyspecppt.hppt.hppt_presenter import HyspecPPTPresenter
+from hyspecppt.hppt.hppt_presenter import HyspecPPTPresenter, configure_model, prepare_first_plot
 from hyspecppt.hppt.hppt_view import HyspecPPTView
+from hyspecppt.session import SessionStore
+
+logger = logging.getLogger("hyspecppt")
+
+
+class HyspecPPT(QMainWindow):
+    """Main Package window"""
+
+    def __init__(self, parent=None):
+        """Constructor"""
+        super().__init__(parent)
+        logger.info(f"Hyspecppt version: {__version__}")
+        config = Configuration()
+
+        if not config.is_valid():
+            msg = (
+                "Error with configuration settings!",
+                f"Check and update your file: {config.config_file_path}",
+                "with the latest settings found here:",
+                f"{config.template_file_path} and start the application again.",
+            )
+
+            print(" ".join(msg))
+            sys.exit(-1)
+        self.setWindowTitle(f"Hyspecppt - {__version__}")
+        self.main_window = MainWindow(self)
+        self.setCentralWidget(self.main_window)
+
+    def closeEvent(self, event):
+        """Save the last session, restored at the next start"""
+        self.main_window.HPPT_presenter.save_last_session()
+        super().closeEvent(event)
 
 
 class MainWindow(QWidget):
@@ -16,9 +53,14 @@ class MainWindow(QWidget):
         super().__init__(parent)
 
         ### Create widgets here ###
-        HPPT_view = HyspecPPTView(self)
         HPPT_model = HyspecPPTModel()
-        self.HPPT_presenter = HyspecPPTPresenter(HPPT_view, HPPT_model)
+        # the settings are applied once; the last session is restored, and the first map is calculated
+        # while the widgets are built
+        workers = configure_model(HPPT_model)
+        store = SessionStore()
+        first_plot = prepare_first_plot(HPPT_model, workers, store)
+        HPPT_view = HyspecPPTView(self)
+        self.HPPT_presenter = HyspecPPTPresenter(HPPT_view, HPPT_model, workers, first_plot, store)
 
         ### Set the layout
         layout = QVBoxLayout()
@@ -0,0 +1,204 @@
+"""Named sessions of configurations in the SHOME/.hyspecppt/sessions directory
+
+A session is a list of named configurations, each with the state of the model and the last map
+calculated for it. The configurations are stored in <name>.json, in the format of the configuration
+files of hyspecppt-batch, and the maps in the compressed <name>.npz sidecar file. A configuration
+restored with its map is drawn from the stored arrays, without calculating the map again.
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from hyspecppt import __version__
+from hyspecppt.batch import normalize_configuration
+from hyspecppt.hppt.hppt_model import MAP_ARRAY_KEYS
+
+logger = logging.getLogger("hyspecppt")
+
+# session directory, next to the configuration file
+SESSION_DIRECTORY = os.path.join(Path.home(), ".hyspecppt", "sessions")
+# session saved when the application is closed, and restored when it starts
+LAST_SESSION = "last"
+
+
+class Session:
+    """Named configurations and the maps calculated for them"""
+
+    name: str
+    current: str
+    configurations: dict[str, dict]
+    maps: dict[str, dict[str, np.array]]
+
+    def __init__(self, name: str) -> None:
+        """Constructor
+
+        Args:
+            name: name of the session, used for the file names
+
+        Raises:
+            ValueError: if the name cannot be used as a file name
+
+        """
+        if not name or name != os.path.basename(name) or name.startswith("."):
+            raise ValueError(f"Invalid session name {name!r}")
+        self.name = name
+        self.current = None
+        self.configurations = {}
+        self.maps = {}
+
+    def store(self, model: any, configuration_name: str) -> None:
+        """Store the state of the model and its last map as a configuration, and make it the current one
+
+        Args:
+            model: hppt_model class type
+            configuration_name: name of the configuration, replaced if it exists
+
+        Raises:
+            ValueError: if the name is empty
+
+        """
+        if not configuration_name:
+            raise ValueError("The name of the configuration is empty")
+        self.configurations[configuration_name] = dict(name=configuration_name, **model.get_session_state())
+        arrays = model.get_map_arrays()
+        if arrays is None:
+            self.maps.pop(configuration_name, None)
+        else:
+            self.maps[configuration_name] = arrays
+        self.current = configuration_name
+
+    def restore(self, model: any, configuration_name: str = None) -> None:
+        """Set the state of the model from a configuration, and restore its map
+
+        Args:
+            model: hppt_model class type
+            configuration_name: name of the configuration, the current one if not set
+
+        """
+        configuration_name = configuration_name or self.current
+        model.set_session_state(self.configurations[configuration_name])
+        if configuration_name in self.maps:
+            try:
+                model.restore_map_arrays(self.maps[configuration_name])
+            except (KeyError, TypeError, ValueError) as err:
+                logger.warning(f"The map of {configuration_name} is calculated again: {err}")
+        self.current = configuration_name
+
+
+class SessionStore:
+    """Sessions stored in a directory"""
+
+    directory: str
+
+    def __init__(self, directory: str = None) -> None:
+        """Constructor
+
+        Args:
+            directory: session directory, created when the first session is saved, SESSION_DIRECTORY if not set
+
+        """
+        self.directory = directory or SESSION_DIRECTORY
+
+    def _path(self, name: str, extension: str) -> str:
+        """Returns the path of a file of a session"""
+        return os.path.join(self.directory, f"{name}{extension}")
+
+    def names(self) -> list[str]:
+        """Returns the names of the stored sessions, without the last session"""
+        if not os.path.isdir(self.directory):
+            return []
+        names = [entry.name[: -len(".json")] for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+        return sorted(name for name in names if name != LAST_SESSION and not name.startswith("."))
+
+    def save(self, session: Session) -> None:
+        """Write the configurations and the maps of a session
+
+        Args:
+            session: session to write, replacing the files of a session with the same name
+
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        description = dict(
+            hyspecppt_version=__version__,
+            name=session.name,
+            current=session.current,
+            configurations=list(session.configurations.values()),
+        )
+        arrays = {
+            f"{configuration}/{key}": array
+            for configuration, map_arrays in session.maps.items()
+            if configuration in session.configurations
+            for key, array in map_arrays.items()
+        }
+        # the maps are written first, so that a session file is never newer than its sidecar
+        self._write(session.name, ".npz", lambda npz_file: np.savez_compressed(npz_file, **arrays))
+        text = json.dumps(description, indent=2)
+        self._write(session.name, ".json", lambda json_file: json_file.write(text.encode("utf8")))
+
+    def _write(self, name: str, extension: str, write: Callable[[object], None]) -> None:
+        """Write a file through a temporary file, so that a partial file is never read"""
+        temporary_path = os.path.join(self.directory, f".{name}{extension}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(temporary_path, "wb") as session_file:
+                write(session_file)
+            os.replace(temporary_path, self._path(name, extension))
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def load(self, name: str) -> Session:
+        """Read a session
+
+        The maps are not restored if they were stored by another version of the application,
+        or if the sidecar file is missing or invalid.
+
+        Args:
+            name: name of the session
+
+        Raises:
+            OSError: if the session cannot be read
+            ValueError: if the session is invalid
+
+        """
+        with open(self._path(name, ".json"), encoding="utf8") as json_file:
+            description = json.load(json_file)
+        session = Session(name)
+        for index, configuration in enumerate(description.get("configurations", [])):
+            configuration = normalize_configuration(configuration, index)
+            session.configurations[configuration["name"]] = configuration
+        if not session.configurations:
+            raise ValueError(f"The session {name} has no configuration")
+        current = description.get("current")
+        session.current = current if current in session.configurations else next(iter(session.configurations))
+
+        if description.get("hyspecppt_version") != __version__:
+            logger.info(f"The maps of the session {name} are calculated again by this version")
+            return session
+        try:
+            with np.load(self._path(name, ".npz")) as npz_file:
+                for key in npz_file.files:
+                    configuration, array = key.rsplit("/", 1)
+                    session.maps.setdefault(configuration, {})[array] = npz_file[key]
+        except (OSError, ValueError) as err:
+            logger.warning(f"The maps of the session {name} are calculated again: {err}")
+            session.maps = {}
+        session.maps = {
+            configuration: arrays
+            for configuration, arrays in session.maps.items()
+            if configuration in session.configurations and set(MAP_ARRAY_KEYS) <= set(arrays)
+        }
+        return session
+
+    def remove(self, name: str) -> None:
+        """Remove the files of a session"""
+        for extension in (".json", ".npz"):
+            try:
+                os.remove(self._path(name, extension))
+            except FileNotFoundError:
+                pass
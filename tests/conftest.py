@@ -7,12 +7,24 @@ import pytest
 import qtpy  # noqa: F401
 
 from hyspecppt import Hyspecppt
+from hyspecppt.hppt import hppt_model
+
+
+@pytest.fixture(autouse=True)
+def result_cache(monkeypatch, tmp_path):
+    """Keep the result cache and the sessions of each test in a temporary directory"""
+    monkeypatch.setattr("hyspecppt.cache.CACHE_DIRECTORY", str(tmp_path / "cache"))
+    monkeypatch.setattr("hyspecppt.session.SESSION_DIRECTORY", str(tmp_path / "sessions"))
+    monkeypatch.setattr(hppt_model, "GEOMETRY_CACHE", None)
+    monkeypatch.setattr(hppt_model, "_RESTORED_GEOMETRY", {})
 
 
 @pytest.fixture
-def hyspec_app(qapp):  # noqa: ARG001
+def hyspec_app(qapp, qtbot):  # noqa: ARG001
     """Create a Hyspecppt app"""
     app = Hyspecppt()
+    # close and delete the window at teardown, so that pending plot updates are discarded
+    qtbot.addWidget(app)
     app.show()
     return app
 
@@ -0,0 +1,67 @@
+import numpy as np
+
+from hyspecppt.hppt.detector import DetectorGeometry, pixel_kinematics
+from hyspecppt.hppt.experiment_settings import PLOT_TYPES, SE2K, TANK_HALF_WIDTH
+from hyspecppt.hppt.hppt_model import HyspecPPTModel
+
+
+def test_hyspec_geometry():
+    """Test the nominal pixel angles of the tank"""
+    geometry = DetectorGeometry.hyspec()
+    assert len(geometry) == 20 * 8 * 128
+    assert geometry.horizontal.dtype == np.float32
+    assert not geometry.horizontal.flags.writeable
+    assert -TANK_HALF_WIDTH < geometry.horizontal.min() < geometry.horizontal.max() < TANK_HALF_WIDTH
+    assert np.allclose(geometry.vertical.mean(), 0, atol=1e-6)
+    assert 7 < geometry.vertical.max() < 8
+
+    # gaps between the eight-packs
+    tubes = np.unique(geometry.horizontal)
+    assert len(tubes) == 160
+    assert np.diff(tubes).max() > np.diff(tubes).min() + 0.1
+
+    assert len(DetectorGeometry.hyspec(pixels_per_tube=4)) == 640
+
+
+def test_pixel_kinematics():
+    """Test the momentum transfer and the Scharpf angle of single pixels"""
+    # in plane pixels along the beam and at 90 degrees
+    geometry = DetectorGeometry(horizontal=[-60.0, 30.0], vertical=[0.0, 0.0])
+    data = pixel_kinematics(geometry, Ei=20.0, S2=60.0, alpha_p=0.0, DeltaE=[0.0])
+    ki = np.sqrt(20.0) * SE2K
+    assert np.allclose(data["modQ"][:, 0], [0, np.sqrt(2) * ki], rtol=1e-4)
+    # Q at 90 degrees scattering is at -45 degrees from the beam
+    assert np.isclose(data["cos_ang_PQ"][1, 0], np.cos(np.radians(45)))
+
+    # out of plane pixel: larger |Q|, the vertical component is perpendicular to the polarization
+    geometry = DetectorGeometry(horizontal=[0.0, 0.0], vertical=[0.0, 5.0])
+    data = pixel_kinematics(geometry, Ei=20.0, S2=60.0, alpha_p=90.0, DeltaE=[0.0, 25.0])
+    assert data["modQ"][1, 0] > data["modQ"][0, 0]
+    kf = ki * np.array([np.cos(np.radians(5)) * np.sin(np.radians(60)), np.sin(np.radians(5))])
+    Q = np.array([-kf[0], -kf[1], ki - ki * np.cos(np.radians(5)) * np.cos(np.radians(60))])
+    assert np.isclose(data["modQ"][1, 0], np.linalg.norm(Q))
+    assert np.isclose(data["cos_ang_PQ"][1, 0], Q[0] / np.linalg.norm(Q))
+    assert np.isnan(data["modQ"][:, 1]).all()
+
+
+def test_pixel_data_and_coverage():
+    """Test the pixel coverage against the continuous tank of the map"""
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[1])
+    pixel_data = model.calculate_pixel_data(DeltaE=[0.0, 5.0])
+    assert pixel_data["modQ"].shape == (len(model.detector), 2)
+    assert np.allclose(pixel_data[PLOT_TYPES[1]], np.cos(np.radians(pixel_data["alpha_s"])) ** 2)
+
+    # the pixels measure the points of the map, except close to the edges of the tank
+    data = model.calculate_graph_data(n_points=100)
+    coverage = model.calculate_pixel_coverage()
+    continuous = ~np.isnan(data["intensity"])
+    assert coverage.shape == data["intensity"].shape
+    assert (coverage & continuous).sum() > 0.98 * continuous.sum()
+    assert (coverage & ~continuous).sum() < 0.02 * continuous.sum()
+
+    # at high resolution the gaps between the eight-packs are visible
+    data = model.calculate_graph_data(n_points=800)
+    coverage = model.calculate_pixel_coverage()
+    continuous = ~np.isnan(data["intensity"])
+    assert (continuous & ~coverage).sum() > 0.05 * continuous.sum()
@@ -1,7 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
+import pytest
 
+from hyspecppt.hppt import hppt_model
 from hyspecppt.hppt.experiment_settings import DEFAULT_CROSSHAIR, DEFAULT_EXPERIMENT, DEFAULT_LATTICE, PLOT_TYPES
-from hyspecppt.hppt.hppt_model import HyspecPPTModel  # noqa: F401
+from hyspecppt.hppt.hppt_model import PRODUCT_INPUTS, HyspecPPTModel, reduced_geometry
 
 
 def test_defaultvalues():
@@ -61,14 +65,12 @@ def test_calculate_graph_data_alpha():
     assert np.isclose(max(model.calculate_graph_data()["Q_hi"]), 5.3811)
     assert model.calculate_graph_data()["E"].all() == np.linspace(-20, 18, 200).all()
 
-    assert model.calculate_graph_data()["Q2d"][0][0] == 0.0
-    assert model.calculate_graph_data()["Q2d"][0][1] == 0.0
+    assert model.calculate_graph_data()["Q"][0] == 0.0
 
-    assert np.isclose(model.calculate_graph_data()["Q2d"][199][0], 5.38106)
-    assert np.isclose(model.calculate_graph_data()["Q2d"][199][1], 5.38106)
+    assert np.isclose(model.calculate_graph_data()["Q"][199], 5.38106)
 
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][0], -20)
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][199], 18.0)
+    assert np.isclose(model.calculate_graph_data()["E"][0], -20)
+    assert np.isclose(model.calculate_graph_data()["E"][199], 18.0)
 
     assert np.isnan(model.calculate_graph_data()["intensity"][0][0])  # not allowed (Q, E) positions
     assert np.isnan(model.calculate_graph_data()["intensity"][84][4])  # not allowed (Q, E) positions
@@ -89,14 +91,12 @@ def test_calculate_graph_data_cos2_alpha():
     assert np.isclose(max(model.calculate_graph_data()["Q_hi"]), 5.3811)
     assert model.calculate_graph_data()["E"].all() == np.linspace(-20, 18, 200).all()
 
-    assert model.calculate_graph_data()["Q2d"][0][0] == 0.0
-    assert model.calculate_graph_data()["Q2d"][0][1] == 0.0
+    assert model.calculate_graph_data()["Q"][0] == 0.0
 
-    assert np.isclose(model.calculate_graph_data()["Q2d"][199][0], 5.38106)
-    assert np.isclose(model.calculate_graph_data()["Q2d"][199][1], 5.38106)
+    assert np.isclose(model.calculate_graph_data()["Q"][199], 5.38106)
 
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][0], -20)
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][199], 18.0)
+    assert np.isclose(model.calculate_graph_data()["E"][0], -20)
+    assert np.isclose(model.calculate_graph_data()["E"][199], 18.0)
 
     assert np.isnan(model.calculate_graph_data()["intensity"][0][0])  # not allowed (Q, E) positions
     assert np.isnan(model.calculate_graph_data()["intensity"][84][4])  # not allowed (Q, E) positions
@@ -117,14 +117,12 @@ def test_calculate_graph_data_intensity():
     assert np.isclose(max(model.calculate_graph_data()["Q_hi"]), 5.3811)
     assert model.calculate_graph_data()["E"].all() == np.linspace(-20, 18, 200).all()
 
-    assert model.calculate_graph_data()["Q2d"][0][0] == 0.0
-    assert model.calculate_graph_data()["Q2d"][0][1] == 0.0
+    assert model.calculate_graph_data()["Q"][0] == 0.0
 
-    assert np.isclose(model.calculate_graph_data()["Q2d"][199][0], 5.38106)
-    assert np.isclose(model.calculate_graph_data()["Q2d"][199][1], 5.38106)
+    assert np.isclose(model.calculate_graph_data()["Q"][199], 5.38106)
 
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][0], -20)
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][199], 18.0)
+    assert np.isclose(model.calculate_graph_data()["E"][0], -20)
+    assert np.isclose(model.calculate_graph_data()["E"][199], 18.0)
 
     assert np.isnan(model.calculate_graph_data()["intensity"][0][0])  # not allowed (Q, E) positions
     assert np.isnan(model.calculate_graph_data()["intensity"][84][4])  # not allowed (Q, E) positions
@@ -140,20 +138,24 @@ def test_DeltaE_less_than_negative_Ei():
     model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[2])
     model.cp.DeltaE = -30.0
 
-    # if DeltaE is < -Ei, set Emin to 1.2 * DeltaE
-    assert min(model.calculate_graph_data()["E"]) == -36.0
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][0], -36.0)
+    # if DeltaE is < -Ei, set Emin to 1.2 * DeltaE; the map starts at the first grid row below it
+    data = model.calculate_graph_data()
+    E_step = 20.0 * 1.9 / 199
+    assert model.Emin == -36.0
+    assert -36.0 - E_step < min(data["E"]) <= -36.0
+    assert np.allclose(np.diff(data["E"]), E_step)
+    assert data["E"][0] == min(data["E"])
 
     # now chang DeltaE > -Ei, Emin should go back to -Ei
     model.cp.DeltaE = -19.0
     assert min(model.calculate_graph_data()["E"]) == -20.0
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][0], -20.0)
+    assert np.isclose(model.calculate_graph_data()["E"][0], -20.0)
 
     # if we don't initialize DeltaE, Emin by default is -Ei
     model = HyspecPPTModel()
     model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[2])
     assert min(model.calculate_graph_data()["E"]) == -20.0
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][0], -20.0)
+    assert np.isclose(model.calculate_graph_data()["E"][0], -20.0)
 
 
 def test_calculate_graph_data_intensity_negative_S2():
@@ -167,14 +169,12 @@ def test_calculate_graph_data_intensity_negative_S2():
     assert np.isclose(max(model.calculate_graph_data()["Q_hi"]), 5.3811)
     assert model.calculate_graph_data()["E"].all() == np.linspace(-20, 18, 200).all()
 
-    assert model.calculate_graph_data()["Q2d"][0][0] == 0.0
-    assert model.calculate_graph_data()["Q2d"][0][1] == 0.0
+    assert model.calculate_graph_data()["Q"][0] == 0.0
 
-    assert np.isclose(model.calculate_graph_data()["Q2d"][199][0], 5.38106)
-    assert np.isclose(model.calculate_graph_data()["Q2d"][199][1], 5.38106)
+    assert np.isclose(model.calculate_graph_data()["Q"][199], 5.38106)
 
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][0], -20)
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][199], 18.0)
+    assert np.isclose(model.calculate_graph_data()["E"][0], -20)
+    assert np.isclose(model.calculate_graph_data()["E"][199], 18.0)
 
     assert np.isnan(model.calculate_graph_data()["intensity"][0][0])  # not allowed (Q, E) positions
     assert np.isnan(model.calculate_graph_data()["intensity"][84][4])  # not allowed (Q, E) positions
@@ -184,6 +184,16 @@ def test_calculate_graph_data_intensity_negative_S2():
     assert np.isnan(model.calculate_graph_data()["intensity"][199][1])  # not allowed (Q, E) positions
 
 
+def test_graph_data_axes():
+    """Test that the map is returned with 1-D axes"""
+    model = HyspecPPTModel()
+    data = model.calculate_graph_data(n_points=50)
+    assert set(data) == {"Q_low", "Q_hi", "E", "Q", "intensity", "plot_type"}
+    assert data["Q"].shape == (50,)
+    assert data["E"].shape == data["Q_low"].shape == data["Q_hi"].shape == (50,)
+    assert data["intensity"].shape == (50, 50)
+
+
 def test_calculate_graph_data_consistency():
     """Test consistency for graph data"""
     model = HyspecPPTModel()
@@ -200,8 +210,8 @@ def test_calculate_graph_data_consistency():
     assert np.array_equal(d_45_45["Q_low"], d_45_m45["Q_low"])
     assert np.array_equal(d_45_45["Q_hi"], d_m45_m45["Q_hi"])
     assert np.array_equal(d_45_45["E"], d_m45_45["E"])
-    assert np.array_equal(d_45_45["Q2d"], d_45_m45["Q2d"])
-    assert np.array_equal(d_45_45["E2d"], d_m45_m45["E2d"])
+    assert np.array_equal(d_45_45["Q"], d_45_m45["Q"])
+    assert np.array_equal(d_45_45["E"], d_m45_m45["E"])
 
     # check that cosines are equal in equivalent conditions
     assert np.array_equal(d_45_45["intensity"], d_m45_m45["intensity"], equal_nan=True)
@@ -293,14 +303,12 @@ def test_cos2_sin2():
     assert np.isclose(max(model.calculate_graph_data()["Q_hi"]), 5.3811)
     assert model.calculate_graph_data()["E"].all() == np.linspace(-20, 18, 200).all()
 
-    assert model.calculate_graph_data()["Q2d"][0][0] == 0.0
-    assert model.calculate_graph_data()["Q2d"][0][1] == 0.0
+    assert model.calculate_graph_data()["Q"][0] == 0.0
 
-    assert np.isclose(model.calculate_graph_data()["Q2d"][199][0], 5.38106)
-    assert np.isclose(model.calculate_graph_data()["Q2d"][199][1], 5.38106)
+    assert np.isclose(model.calculate_graph_data()["Q"][199], 5.38106)
 
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][0], -20)
-    assert np.isclose(model.calculate_graph_data()["E2d"][0][199], 18.0)
+    assert np.isclose(model.calculate_graph_data()["E"][0], -20)
+    assert np.isclose(model.calculate_graph_data()["E"][199], 18.0)
 
     assert np.isnan(model.calculate_graph_data()["intensity"][0][0])  # not allowed (Q, E) positions
     assert np.isnan(model.calculate_graph_data()["intensity"][84][4])  # not allowed (Q, E) positions
@@ -315,3 +323,307 @@ def test_cos2_sin2():
         np.cos(np.radians(84.7356103)) ** 2 - np.sin(np.radians(84.7356103)) ** 2,
     )
     assert np.isnan(model.calculate_graph_data()["intensity"][199][1])  # not allowed (Q, E) positions
+
+
+def test_calculate_graph_data_scales_with_Ei():
+    """Test that changing Ei only rescales the axes of the map"""
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[1])
+    d_20 = model.calculate_graph_data()
+    hits = reduced_geometry.cache_info().hits
+    model.set_experiment_data(Ei=5.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[1])
+    d_5 = model.calculate_graph_data()
+
+    # the reduced geometry was reused
+    assert reduced_geometry.cache_info().hits == hits + 1
+    assert np.array_equal(d_20["intensity"], d_5["intensity"], equal_nan=True)
+    assert np.allclose(d_5["Q"], d_20["Q"] / 2)
+    assert np.allclose(d_5["Q_hi"], d_20["Q_hi"] / 2)
+    assert np.allclose(d_5["E"], d_20["E"] / 4)
+    assert np.isclose(d_5["E"][0], -5.0)
+    assert np.isclose(d_5["E"][-1], 4.5)
+
+
+def test_energy_axis_extension(monkeypatch):
+    """Test that a lower Emin only calculates the newly exposed energy band"""
+    calculated = []
+    reduced_phi_Q = hppt_model._reduced_phi_Q
+
+    def counting_phi_Q(S2, e_axis, q_axis):
+        calculated.append(len(e_axis) * len(q_axis))
+        return reduced_phi_Q(S2, e_axis, q_axis)
+
+    monkeypatch.setattr(hppt_model, "_reduced_phi_Q", counting_phi_Q)
+    geometry = reduced_geometry(47.0, -1.0, 60)
+    assert geometry["phi_Q"].shape == (60, 60)
+    assert calculated == [60 * 60]
+
+    # rows below -1 with the same energy step, and more |Q| columns for the larger tank range
+    extended = reduced_geometry(47.0, -1.5, 60)
+    n_e, n_q = len(extended["e"]), len(extended["q"])
+    assert extended["e"][0] <= -1.5 < extended["e"][1]
+    assert np.allclose(np.diff(extended["e"]), geometry["e"][1] - geometry["e"][0])
+    assert np.allclose(np.diff(extended["q"]), geometry["q"][1] - geometry["q"][0])
+    assert extended["q"][-1] >= extended["q_hi"].max() > extended["q"][-2]
+    assert sum(calculated) == 60 * 60 + (n_e - 60) * n_q + 60 * (n_q - 60)
+
+    # the old rows are unchanged, and the new ones match a full calculation
+    assert np.array_equal(extended["phi_Q"][:60, n_e - 60 :], geometry["phi_Q"], equal_nan=True)
+    assert np.allclose(extended["phi_Q"], reduced_phi_Q(47.0, extended["e"], extended["q"]), equal_nan=True, atol=1e-12)
+
+    # a value in between is a view of the extended grid
+    calculated.clear()
+    between = reduced_geometry(47.0, -1.2, 60)
+    assert calculated == []
+    assert between["e"][0] <= -1.2 < between["e"][1]
+    assert np.shares_memory(between["phi_Q"], extended["phi_Q"])
+
+
+def test_energy_axis_extension_limit():
+    """Test that a map far below the grid is calculated on a new grid instead of extending it"""
+    grid = hppt_model._geometry_grid(47.0, 60)
+    geometry = reduced_geometry(47.0, -101.0, 60)
+    assert geometry["phi_Q"].shape == (60, 60)
+    assert geometry["e"][0] == -101.0
+    assert geometry["q"][-1] == geometry["q_hi"].max()
+    assert len(grid.e) <= 2 * 60 and len(grid.q) <= 2 * 60
+
+    # the largest extension within the limit
+    reduced_geometry(47.0, -1.0, 60)
+    extended = reduced_geometry(47.0, -2.9, 60)
+    assert extended["phi_Q"].shape[0] <= 2 * 60
+    assert np.shares_memory(extended["phi_Q"], grid.phi_Q)
+
+
+def test_geometry_memory_bounded(monkeypatch):
+    """Test that the geometry kept in memory is bounded by its size, not by the number of maps"""
+    hppt_model._geometry_grid.cache_clear()
+    hppt_model.reduced_geometry.cache_clear()
+    reduced_geometry(31.0, -1.0, 100)
+    grid_nbytes = hppt_model._geometry_grid.cache_info().nbytes
+    monkeypatch.setattr(hppt_model._geometry_grid, "max_bytes", 2.5 * grid_nbytes)
+    for S2 in (32.0, 33.0):
+        reduced_geometry(S2, -1.0, 100)
+    info = hppt_model._geometry_grid.cache_info()
+    assert (info.currsize, info.nbytes) == (2, 2 * grid_nbytes)
+    # the views of the evicted grid are dropped as well, to release it
+    assert not hppt_model.geometry_calculated(31.0, -1.0, 100)
+    assert hppt_model.geometry_calculated(33.0, -1.0, 100)
+
+    # the last grid is kept even if it is larger
+    hppt_model._geometry_grid.max_bytes = 1
+    reduced_geometry(34.0, -1.0, 100)
+    assert hppt_model._geometry_grid.cache_info().currsize == 1
+
+    # restored maps
+    monkeypatch.setattr(hppt_model, "MAX_RESTORED_BYTES", 2.5 * grid_nbytes)
+    geometries = [dict(reduced_geometry(S2, -1.0, 100)) for S2 in (35.0, 36.0, 37.0)]
+    for S2, geometry in zip((35.0, 36.0, 37.0), geometries):
+        hppt_model._restore_geometry(S2, -1.0, 100, geometry)
+    assert list(hppt_model._RESTORED_GEOMETRY) == [(36.0, -1.0, 100), (37.0, -1.0, 100)]
+    assert reduced_geometry(36.0, -1.0, 100) is geometries[1]
+
+
+def test_calculate_graph_data_large_energy_transfer():
+    """Test that a large negative energy transfer does not grow the map"""
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=1.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[0])
+    model.set_crosshair_data(current_experiment_type="powder", DeltaE=-100.0, modQ=1.0)
+    data = model.calculate_graph_data()
+    assert data["intensity"].shape == (200, 200)
+
+
+def test_calculate_graph_data_polarization_rotation():
+    """Test that rotating the polarization reuses the geometry"""
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[0])
+    d_30 = model.calculate_graph_data()
+    misses = reduced_geometry.cache_info().misses
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=210.0, plot_type=PLOT_TYPES[0])
+    d_210 = model.calculate_graph_data()
+
+    assert reduced_geometry.cache_info().misses == misses
+    # reversing the polarization changes the Scharpf angle to 180 - alpha_s
+    assert np.isclose(d_30["intensity"][84][5], 136.5994336)
+    assert np.isclose(d_210["intensity"][84][5], 180 - 136.5994336)
+    assert np.array_equal(np.isnan(d_30["intensity"]), np.isnan(d_210["intensity"]))
+
+
+def test_map_dtype():
+    """Test the single precision maps"""
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[1])
+    reference = model.calculate_graph_data()["intensity"]
+    model.set_dtype("float32")
+    intensity = model.calculate_graph_data()["intensity"]
+    assert intensity.dtype == np.float32
+    assert np.allclose(intensity, reference, equal_nan=True, atol=1e-6)
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[0])
+    assert model.calculate_graph_data()["intensity"].dtype == np.float32
+
+    with pytest.raises(ValueError):
+        model.set_dtype("int32")
+
+
+def test_grid_workspace():
+    """Test that the maps reuse the buffers of the workspace, and that the kept arrays are distinct"""
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[2])
+    model.calculate_graph_data(n_points=200)
+    workspace = hppt_model._thread_workspace()
+    nbytes = workspace.nbytes
+    intensities = []
+    for n_points, alpha_p in [(50, 10.0), (100, 20.0), (200, 30.0), (50, 40.0)]:
+        model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=alpha_p, plot_type=PLOT_TYPES[2])
+        data = model.calculate_graph_data(n_points=n_points)
+        intensities.append(data["intensity"])
+        with np.errstate(invalid="ignore"):
+            cos_ang_PQ = np.cos(reduced_geometry(60.0, -1.0, n_points)["phi_Q"] - np.radians(alpha_p))
+            assert np.array_equal(
+                data["intensity"], hppt_model.PLOT_FUNCTIONS[PLOT_TYPES[2]](cos_ang_PQ), equal_nan=True
+            )
+    # the smaller grids are views of the buffer of the largest one
+    assert workspace.nbytes == nbytes
+    cos_ang_PQ = workspace.get("cos_ang_PQ", (200, 200))
+    assert not any(np.shares_memory(intensity, cos_ang_PQ) for intensity in intensities)
+
+    # the stages calculated in a worker thread use the workspace of the thread
+    worker_nbytes = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for n_points in model.progressive_grid_points * 2:
+            model.alpha_p += 5.0
+            model.set_graph_data(executor.submit(model.get_graph_task(n_points)).result())
+            worker_nbytes.append(executor.submit(lambda: hppt_model._thread_workspace().nbytes).result())
+    assert worker_nbytes[2:] == [8 * 200 * 200] * 4
+
+    # same values as the functions of the plot types, in place
+    cos_ang_PQ = np.cos(np.linspace(0, 7, 101))
+    for plot_type in PLOT_TYPES:
+        out = cos_ang_PQ.copy()
+        hppt_model.PLOT_KERNELS[plot_type](out, out)
+        assert np.array_equal(out, hppt_model.PLOT_FUNCTIONS[plot_type](cos_ang_PQ))
+
+
+def test_progressive_grid_points():
+    """Test the resolutions of the progressive plot refinement"""
+    model = HyspecPPTModel()
+    assert model.progressive_grid_points == [50, 100, 200]
+    model.set_progressive_grid_points(coarse=50, maximum=2000)
+    assert model.progressive_grid_points == [50, 100, 200, 400, 800, 1600, 2000]
+    model.set_progressive_grid_points(coarse=300, maximum=200)
+    assert model.progressive_grid_points == [200]
+
+    # the grid resolution of the map
+    data = model.calculate_graph_data(n_points=50)
+    assert data["intensity"].shape == (50, 50)
+    assert data["E"].shape == (50,)
+    assert model.n_points == 50
+    assert model.calculate_graph_data()["intensity"].shape == (200, 200)
+
+
+def test_graph_task():
+    """Test that the graph task calculates the map of the captured state without using the model"""
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=-55.0, alpha_p=30.0, plot_type=PLOT_TYPES[1])
+    task = model.get_graph_task(n_points=60)
+    model.set_experiment_data(Ei=10.0, S2=45.0, alpha_p=0.0, plot_type=PLOT_TYPES[0])
+    data = task()
+    assert model._map_key is None
+
+    reference = HyspecPPTModel()
+    reference.set_experiment_data(Ei=20.0, S2=-55.0, alpha_p=30.0, plot_type=PLOT_TYPES[1])
+    expected = reference.calculate_graph_data(n_points=60)
+    for key in ("Q_low", "Q_hi", "E", "Q", "intensity"):
+        assert np.allclose(data[key], expected[key], equal_nan=True)
+    assert not data["intensity"].flags.writeable
+
+    # the intensity is kept by the model, another plot type is calculated
+    model.set_experiment_data(Ei=20.0, S2=-55.0, alpha_p=30.0, plot_type=PLOT_TYPES[1])
+    model.set_graph_data(data)
+    assert model.n_points == 60
+    assert model.get_graph_task(n_points=60).args[3] is data["intensity"]
+    model.set_experiment_data(Ei=20.0, S2=-55.0, alpha_p=30.0, plot_type=PLOT_TYPES[0])
+    assert model.get_graph_task(n_points=60).args[3] is None
+
+
+def test_calculate_point_data():
+    """Test that the point query agrees with the map and the crosshair Q-beam angle"""
+    model = HyspecPPTModel()
+    for S2 in [60.0, -45.0, 10.0]:
+        model.set_experiment_data(Ei=20.0, S2=S2, alpha_p=30.0, plot_type=PLOT_TYPES[0])
+        data = model.calculate_graph_data(n_points=100)
+        Q2d, E2d = np.broadcast_arrays(data["Q"][:, np.newaxis], data["E"])
+        points = model.calculate_point_data(Q2d.ravel(), E2d.ravel())
+
+        # same values as the map where the map is defined, which is the detector coverage
+        covered = ~np.isnan(data["intensity"].ravel())
+        assert np.array_equal(points["in_coverage"] & (Q2d.ravel() > 0), covered)
+        for plot_type in PLOT_TYPES:
+            model.plot_type = plot_type
+            intensity = model.calculate_graph_data(n_points=100)["intensity"].ravel()
+            assert np.allclose(points[plot_type][covered], intensity[covered])
+        assert np.array_equal(points["alpha_s"], points[PLOT_TYPES[0]], equal_nan=True)
+
+    # single points, and the Q-beam angle of the crosshair
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[0])
+    model.set_crosshair_data(current_experiment_type="powder", DeltaE=5.0, modQ=2.5)
+    points = model.calculate_point_data(np.array([2.5, 0.1, 100.0]), np.array([5.0, 5.0, 5.0]))
+    assert np.isclose(points["ang_Q_beam"][0], model.get_ang_Q_beam())
+    assert list(points["in_coverage"]) == [True, False, False]
+    # scattering triangle not closed
+    assert np.isnan(points["alpha_s"][2])
+    assert np.isnan(points["ang_Q_beam"][2])
+
+
+def test_dirty_products():
+    """Test that the derived products depend only on their inputs"""
+    model = HyspecPPTModel()
+    # nothing was calculated yet
+    assert model.get_dirty_products() == set(PRODUCT_INPUTS)
+    model.mark_clean(*PRODUCT_INPUTS)
+    assert model.get_dirty_products() == set()
+
+    # same values
+    model.set_experiment_data(**model.get_experiment_data())
+    assert model.get_dirty_products() == set()
+
+    # plot type only changes the intensity
+    model.set_experiment_data(Ei=20, S2=30, alpha_p=0, plot_type=PLOT_TYPES[0])
+    assert model.get_dirty_products() == {"intensity"}
+    model.mark_clean("intensity")
+
+    # crosshair: DeltaE above -Ei does not change the map
+    model.set_crosshair_data("powder", DeltaE=5.0, modQ=1.0)
+    assert model.get_dirty_products() == {"ang_Q_beam", "reflections"}
+    model.mark_clean(*PRODUCT_INPUTS)
+    model.set_crosshair_data("powder", modQ=2.0)
+    assert model.get_dirty_products() == {"ang_Q_beam"}
+    model.mark_clean(*PRODUCT_INPUTS)
+    model.set_crosshair_data("powder", DeltaE=-30.0)
+    assert {"E", "coverage", "geometry", "intensity"} <= model.get_dirty_products()
+    model.mark_clean(*PRODUCT_INPUTS)
+
+    # direct assignment is tracked as well
+    model.Ei = 40.0
+    assert {"E", "coverage", "geometry", "intensity", "ang_Q_beam"} <= model.get_dirty_products()
+
+
+def test_ang_Q_beam_recalculated_when_inputs_change(monkeypatch):
+    """Test that the Q-beam angle is cached until one of its inputs changes"""
+    model = HyspecPPTModel()
+    model.set_crosshair_data("powder", DeltaE=0, modQ=2.0)
+    calls = []
+    ang_Q_beam_at = model._ang_Q_beam_at
+
+    def count_ang_Q_beam_at(*args):
+        calls.append(args)
+        return ang_Q_beam_at(*args)
+
+    monkeypatch.setattr(model, "_ang_Q_beam_at", count_ang_Q_beam_at)
+    assert np.isclose(model.get_ang_Q_beam(), -71.22, 0.01)
+    model.set_experiment_data(Ei=20, S2=30, alpha_p=45, plot_type=PLOT_TYPES[2])
+    assert np.isclose(model.get_ang_Q_beam(), -71.22, 0.01)
+    assert len(calls) == 1
+    model.set_crosshair_data("powder", DeltaE=0, modQ=3.107)
+    assert np.isclose(model.get_ang_Q_beam(), -60, 0.01)
+    assert len(calls) == 2
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from hyspecppt.hppt import orientation
+from hyspecppt.hppt.hppt_model import HyspecPPTModel, SingleCrystalParameters
+from hyspecppt.hppt.orientation import rotation_sweep, ub_matrix
+
+
+def cubic_B(a):
+    """B matrix of a cubic lattice"""
+    scp = SingleCrystalParameters()
+    scp.set_parameters(dict(a=a, b=a, c=a, alpha=90.0, beta=90.0, gamma=90.0, h=0, k=0, l=0))
+    return scp.get_B_matrix()
+
+
+def test_ub_matrix():
+    """Test the orientation vectors in the laboratory frame"""
+    UB = ub_matrix(cubic_B(5.0), u=[1, 0, 0], v=[0, 1, 0])
+    # u along the beam, v along x, u x v vertical
+    assert np.allclose(UB @ [1, 0, 0], [0, 0, 0.2])
+    assert np.allclose(UB @ [0, 1, 0], [0.2, 0, 0])
+    assert np.allclose(UB @ [0, 0, 1], [0, 0.2, 0])
+
+    # v only needs to be in the plane
+    assert np.allclose(ub_matrix(cubic_B(5.0), u=[1, 0, 0], v=[1, 1, 0]), UB)
+
+    with pytest.raises(ValueError):
+        ub_matrix(cubic_B(5.0), u=[1, 0, 0], v=[2, 0, 0])
+
+
+def test_rotation_sweep_bragg_condition():
+    """Test that an elastic reflection is measured at the Bragg angle, on the side of the detector"""
+    UB = ub_matrix(cubic_B(5.0), u=[1, 0, 0], v=[0, 1, 0])
+    psi = np.arange(-180, 180, 0.05)
+    hkl = np.array([[2, 0, 0], [0, 1, 1], [0, 0, 1]])
+    sweep = rotation_sweep(UB, hkl, psi, DeltaE=[0.0, 2.0], Ei=20.0, S2=60.0, alpha_p=30.0)
+    assert sweep["two_theta"].shape == (3, len(psi))
+    assert sweep["measured"].shape == (3, len(psi), 2)
+
+    # 2 theta of the (2, 0, 0) reflection
+    ki = np.sqrt(20.0) * orientation.SE2K
+    two_theta = 2 * np.degrees(np.arcsin(2 * np.pi * 2 / 5.0 / (2 * ki)))
+    measured = sweep["measured"][0, :, 0]
+    assert measured.sum() == 1
+    assert np.isclose(sweep["two_theta"][0][measured][0], two_theta, atol=0.1)
+
+    # same Scharpf angle as the map at the same |Q| and DeltaE
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=model.plot_type)
+    alpha_s = model.calculate_point_data(2 * np.pi * 2 / 5.0, 0.0)["alpha_s"]
+    assert np.isclose(sweep["alpha_s"][0][measured][0], alpha_s, atol=0.2)
+
+    # inelastic: measured at a different angle
+    assert sweep["measured"][0, :, 1].sum() == 1
+    assert not np.array_equal(sweep["measured"][0, :, 0], sweep["measured"][0, :, 1])
+
+    # out of the horizontal plane
+    assert not sweep["in_tank"][1].any()
+    assert not sweep["measured"][2].any()
+
+
+def test_rotation_sweep_chunks_and_processes(monkeypatch):
+    """Test that chunked and process pool sweeps give the same results"""
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=-50.0, alpha_p=10.0, plot_type=model.plot_type)
+    model.set_single_crystal_data(dict(a=6.0, b=7.0, c=8.0, alpha=90.0, beta=90.0, gamma=120.0, h=0, k=0, l=0))
+    psi = np.linspace(0, 90, 91)
+    DeltaE = np.linspace(-5, 5, 3)
+    reference = model.calculate_rotation_sweep(u=[1, 0, 0], v=[0, 1, 0], psi=psi, DeltaE=DeltaE)
+    assert len(reference["hkl"]) == len(reference["two_theta"])
+    assert reference["measured"].any()
+
+    monkeypatch.setattr(orientation, "CHUNK_SIZE", 1000)
+    for processes in [0, 2]:
+        sweep = model.calculate_rotation_sweep(
+            u=[1, 0, 0], v=[0, 1, 0], psi=psi, DeltaE=DeltaE, hkl=reference["hkl"], processes=processes
+        )
+        for key in ["two_theta", "in_tank", "measured", "alpha_s"]:
+            assert np.array_equal(sweep[key], reference[key], equal_nan=True)
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+from hyspecppt.hppt import reflections as reflections_module
+from hyspecppt.hppt.hppt_model import SE2K, HyspecPPTModel, SingleCrystalParameters, tank_modQ_range
+from hyspecppt.hppt.reflections import ReflectionIndex
+
+
+def brute_force_reflections(scp, max_modQ, n=12):
+    """All h, k, l in a box, with |Q| below max_modQ"""
+    hkl = np.array([(h, k, l) for h in range(-n, n + 1) for k in range(-n, n + 1) for l in range(-n, n + 1)])
+    modQ = scp.calculate_modQ_hkl(hkl)
+    keep = (modQ < max_modQ) & (modQ > 0)
+    return hkl[keep], modQ[keep]
+
+
+def test_reflection_index_enumeration():
+    """Test that the index contains all reflections below the maximum |Q|, sorted"""
+    scp = SingleCrystalParameters()
+    scp.set_parameters(dict(a=5.0, b=6.0, c=7.5, alpha=70.0, beta=85.0, gamma=100.0, h=0, k=0, l=0))
+    reflections = ReflectionIndex(scp.get_B_matrix(), max_modQ=6.0)
+    hkl, modQ = brute_force_reflections(scp, 6.0)
+
+    assert len(reflections) == len(modQ)
+    assert np.all(np.diff(reflections.modQ) >= 0)
+    assert np.allclose(reflections.modQ, np.sort(modQ))
+    assert set(map(tuple, reflections.hkl)) == set(map(tuple, hkl))
+    assert np.allclose(scp.calculate_modQ_hkl(reflections.hkl), reflections.modQ)
+    assert not reflections.modQ.flags.writeable
+
+
+def test_reflection_index_centering():
+    """Test the systematic extinctions of centered lattices"""
+    scp = SingleCrystalParameters()
+    scp.set_parameters(dict(a=4.0, b=4.0, c=4.0, alpha=90.0, beta=90.0, gamma=90.0, h=0, k=0, l=0))
+    primitive = ReflectionIndex(scp.get_B_matrix(), max_modQ=8.0)
+    body_centered = ReflectionIndex(scp.get_B_matrix(), max_modQ=8.0, centering="I")
+    face_centered = ReflectionIndex(scp.get_B_matrix(), max_modQ=8.0, centering="F")
+
+    assert tuple(primitive.hkl[0]) in {(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)}
+    assert np.all(body_centered.hkl.sum(axis=1) % 2 == 0)
+    assert np.isclose(body_centered.modQ[0], 2 * np.pi * np.sqrt(2) / 4)
+    assert np.all((face_centered.hkl % 2 == 0).all(axis=1) | (face_centered.hkl % 2 == 1).all(axis=1))
+    assert np.isclose(face_centered.modQ[0], 2 * np.pi * np.sqrt(3) / 4)
+    assert len(primitive) > len(body_centered) > len(face_centered)
+
+    with pytest.raises(ValueError):
+        ReflectionIndex(scp.get_B_matrix(), centering="X")
+
+
+def test_reflection_index_range_queries():
+    """Test the reflections near a |Q| and inside the detector coverage"""
+    model = HyspecPPTModel()
+    model.set_single_crystal_data(dict(a=5.0, b=5.0, c=5.0, alpha=90.0, beta=90.0, gamma=90.0, h=1, k=0, l=0))
+    reflections = model.get_reflections()
+    # kept until the lattice changes
+    assert model.get_reflections() is reflections
+    model.set_single_crystal_data(dict(a=5.0, b=5.0, c=5.0, alpha=90.0, beta=90.0, gamma=90.0, h=1, k=1, l=0))
+    assert model.get_reflections() is reflections
+    assert model.get_reflections(centering="I") is not reflections
+
+    # the six equivalent (1, 0, 0) reflections
+    hkl, modQ = reflections.near(2 * np.pi / 5, 0.01)
+    assert len(hkl) == 6
+    assert np.all(np.abs(hkl).sum(axis=1) == 1)
+
+    # the reflections in the tank at DeltaE = 0, for S2 = 60
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=0.0, plot_type=model.plot_type)
+    hkl, modQ = model.get_reflections_in_coverage(DeltaE=0)
+    q_low, q_hi = tank_modQ_range(20.0, 60.0, 0)
+    all_modQ = reflections.modQ
+    assert np.array_equal(modQ, all_modQ[(all_modQ >= q_low) & (all_modQ <= q_hi)])
+    assert len(modQ) > 0
+
+    # no coverage if DeltaE > Ei
+    hkl, modQ = model.get_reflections_in_coverage(DeltaE=25.0)
+    assert hkl.shape == (0, 3)
+
+
+def test_reflection_index_bounded():
+    """Test that the reflections are only enumerated up to the requested |Q|"""
+    model = HyspecPPTModel()
+    model.set_single_crystal_data(dict(a=5.0, b=5.0, c=5.0, alpha=90.0, beta=90.0, gamma=90.0, h=1, k=0, l=0))
+    reflections = model.get_reflections(max_modQ=3.2)
+    assert reflections.max_modQ == 4.0
+    assert reflections.modQ[-1] < 4.0
+    # rebuilt only for a larger |Q|
+    assert model.get_reflections(max_modQ=2.0) is reflections
+    assert model.get_reflections(max_modQ=3.9) is reflections
+    larger = model.get_reflections(max_modQ=4.5)
+    assert larger is not reflections
+    assert np.array_equal(larger.modQ[: len(reflections)], reflections.modQ)
+    # no coverage
+    model = HyspecPPTModel()
+    assert len(model.get_reflections(max_modQ=np.nan)) == 0
+
+
+def test_reflection_index_large_cell(monkeypatch):
+    """Test that the maximum |Q| of a large cell is reduced"""
+    monkeypatch.setattr(reflections_module, "MAX_REFLECTIONS", 10000)
+    scp = SingleCrystalParameters()
+    scp.set_parameters(dict(a=50.0, b=50.0, c=50.0, alpha=90.0, beta=90.0, gamma=90.0, h=0, k=0, l=0))
+    reflections = ReflectionIndex(scp.get_B_matrix(), max_modQ=15.0)
+    assert reflections.max_modQ < 15.0
+    assert 0.5 * 10000 < len(reflections) < 1.5 * 10000
+    assert reflections.modQ[-1] < reflections.max_modQ
+
+
+def test_reflection_overlay():
+    """Test the coverage and the Scharpf angle of the reflections overlay"""
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=model.plot_type)
+    model.set_single_crystal_data(dict(a=8.0, b=8.0, c=8.0, alpha=90.0, beta=90.0, gamma=90.0, h=1, k=0, l=0))
+    model.set_crosshair_data(current_experiment_type="single_crystal", DeltaE=5.0)
+
+    # reflections of the lattice up to the largest |Q| of the map, at the crosshair DeltaE
+    overlay = model.calculate_reflection_overlay()
+    q_low, q_hi = tank_modQ_range(20.0, 60.0, 5.0)
+    assert overlay["DeltaE"] == 5.0
+    assert overlay["modQ"].max() <= tank_modQ_range(20.0, 60.0, model.Emin)[1]
+    assert np.array_equal(overlay["in_coverage"], (overlay["modQ"] >= q_low) & (overlay["modQ"] <= q_hi))
+    # the scattering triangle is not closed below ki - kf
+    assert np.all(np.isnan(overlay["alpha_s"]) == (overlay["modQ"] < (np.sqrt(20) - np.sqrt(15)) * SE2K))
+
+    # given reflections, at a chosen DeltaE
+    overlay = model.calculate_reflection_overlay(hkl=[[3, 0, 0], [4, 1, 0], [1, 0, 0]], DeltaE=0.0)
+    assert np.allclose(overlay["modQ"], 2 * np.pi / 8 * np.array([3, np.sqrt(17), 1]))
+    assert list(overlay["in_coverage"]) == [True, True, False]
+    points = model.calculate_point_data(overlay["modQ"], 0.0)
+    assert np.allclose(overlay["alpha_s"], points["alpha_s"])
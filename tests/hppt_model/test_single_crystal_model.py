@@ -63,6 +63,33 @@ def test_single_crystal_parameter_calculate_modQ():
     assert np.isclose(scp.calculate_modQ(), 1.469240)
 
 
+def test_single_crystal_parameter_calculate_modQ_hkl():
+    """Test SingleCrystalParameters calculate_modQ_hkl function and the cached B matrix"""
+    scp = SingleCrystalParameters()
+    sc_data = {"a": 10, "b": 10, "c": 15.12312, "alpha": 60, "beta": 60, "gamma": 90, "h": 1, "k": 2, "l": 3}
+    scp.set_parameters(sc_data)
+    B = scp.get_B_matrix()
+
+    # changing h, k, l keeps the B matrix
+    sc_data["h"] = 2
+    scp.set_parameters(sc_data)
+    assert scp.get_B_matrix() is B
+
+    # batched calculation agrees with the single reflection
+    hkl = np.array([[1, 2, 3], [0, 0, 0], [2, 2, 3], [-1, 0, 4]])
+    modQ = scp.calculate_modQ_hkl(hkl)
+    assert modQ.shape == (4,)
+    assert np.isclose(modQ[0], 1.469240)
+    assert modQ[1] == 0.0
+    assert np.isclose(modQ[2], scp.calculate_modQ())
+
+    # changing the lattice recalculates the B matrix
+    sc_data["a"] = 5
+    scp.set_parameters(sc_data)
+    assert scp.get_B_matrix() is not B
+    assert not np.isclose(scp.calculate_modQ_hkl(hkl)[0], 1.469240)
+
+
 def test_cross_hair_parameters_set_crosshair():
     """Test Crosshair set_crosshair function"""
     cp = CrosshairParameters()
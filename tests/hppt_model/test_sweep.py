@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from hyspecppt.hppt.experiment_settings import PLOT_TYPES, SE2K
+from hyspecppt.hppt.hppt_model import HyspecPPTModel
+from hyspecppt.hppt.sweep import parameter_sweep, sweep_axes
+
+
+def test_sweep_axes():
+    """Test the reduced axes shared by the detector angles"""
+    e, q = sweep_axes([30.0, 60.0], n_points=50)
+    assert np.array_equal(e, np.linspace(-1, 0.9, 50))
+    assert len(q) == 50
+    assert q[0] == 0
+
+    # extended with the same energy step
+    e_extended, q_extended = sweep_axes([30.0, 60.0], e_min=-1.5, n_points=50)
+    assert e_extended[0] <= -1.5 < e_extended[1]
+    assert np.allclose(np.diff(e_extended), e[1] - e[0])
+    assert q_extended[-1] > q[-1]
+
+
+def test_parameter_sweep():
+    """Test the sweep against the map at single points, with and without worker processes"""
+    S2 = [-45.0, 35.0, 60.0]
+    alpha_p = np.linspace(0, 180, 7)
+    sweep = parameter_sweep(S2, alpha_p, Ei=[5.0, 20.0], plot_type=PLOT_TYPES[1], n_points=40)
+    assert sweep["intensity"].shape == (7, 3, 40, 40)
+    assert np.allclose(sweep["Q"][1], np.sqrt(20) * SE2K * sweep["q"])
+    assert np.allclose(sweep["E"][0], 5 * sweep["e"])
+
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=alpha_p[2], plot_type=PLOT_TYPES[1])
+    Q2d, E2d = np.meshgrid(sweep["Q"][1], sweep["E"][1], indexing="ij")
+    point = model.calculate_point_data(Q2d, E2d)
+    expected = np.where(point["in_coverage"], point[PLOT_TYPES[1]], np.nan)
+    assert np.allclose(sweep["intensity"][2, 2], expected, equal_nan=True)
+
+    parallel = parameter_sweep(S2, alpha_p, plot_type=PLOT_TYPES[1], n_points=40, processes=2)
+    assert np.array_equal(parallel["intensity"], sweep["intensity"], equal_nan=True)
+    assert "Q" not in parallel
+
+
+def test_parameter_sweep_out():
+    """Test that the sweep fills the array of the caller"""
+    S2 = [-45.0, 60.0]
+    alpha_p = np.linspace(0, 180, 5)
+    reference = parameter_sweep(S2, alpha_p, n_points=30)["intensity"]
+    for processes in (0, 3):
+        out = np.zeros(reference.shape)
+        sweep = parameter_sweep(S2, alpha_p, n_points=30, processes=processes, out=out)
+        assert sweep["intensity"] is out
+        assert np.array_equal(out, reference, equal_nan=True)
+
+    with pytest.raises(ValueError, match="shape"):
+        parameter_sweep(S2, alpha_p, n_points=30, out=np.zeros((5, 2, 30, 29)))
@@ -1,7 +1,14 @@
+import threading
+from concurrent.futures import Future
+
+import numpy as np
 from PySide6.QtCore import Qt
 from pytest import approx
 
-from hyspecppt.hppt.experiment_settings import INVALID_QLINEEDIT
+from hyspecppt import Hyspecppt
+from hyspecppt.hppt import hppt_model, hppt_presenter
+from hyspecppt.hppt.experiment_settings import INVALID_QLINEEDIT, PLOT_TYPES
+from hyspecppt.hppt.hppt_view import MAX_HEATMAPS
 
 
 def test_presenter_init(qtbot, hyspec_app):
@@ -545,7 +552,8 @@ def test_update_plot_data(hyspec_app, qtbot):
     # assert heatmap
     assert plot_widget.ax.get_ylabel() == r"$\Delta E$"
     assert plot_widget.ax.get_xlabel() == "$|Q|$"
-    assert plot_widget.cb.ax.get_ylabel() == alpha + subscript_s
+    # the map is calculated in a worker thread
+    qtbot.waitUntil(lambda: plot_widget.cb.ax.get_ylabel() == alpha + subscript_s, timeout=5000)
 
 
 def test_emin_deltae_updated_values(hyspec_app, qtbot):
@@ -561,6 +569,8 @@ def test_emin_deltae_updated_values(hyspec_app, qtbot):
     plot_widget = hyspec_view.plot_widget
 
     assert hyspec_model.Emin == -20
+    # wait for the progressive refinement of the plot
+    qtbot.waitUntil(lambda: hyspec_model.n_points == hyspec_model.progressive_grid_points[-1], timeout=5000)
     default_axes = plot_widget.heatmap.get_array()
     # set a valid DeltaE value
     crosshair_widget.DeltaE_edit.clear()
@@ -575,8 +585,8 @@ def test_emin_deltae_updated_values(hyspec_app, qtbot):
     # assert emin has changed
     assert hyspec_model.Emin == -36
 
-    # plot should be updated
-    assert not (default_axes == plot_widget.heatmap.get_array()).all()
+    # plot should be updated; the energy axis is extended below -Ei with the same step
+    qtbot.waitUntil(lambda: plot_widget.heatmap.get_array().shape[0] > default_axes.shape[0], timeout=5000)
 
     # assert crosshair
     assert plot_widget.eline_data == -30.0
@@ -761,3 +771,455 @@ def test_handle_Q_beam_ang_values_scattering_triangle_not_closed(hyspec_app, qtb
     qtbot.keyPress(crosshair_widget.modQ_edit, Qt.Key_Return)
 
     assert crosshair_widget.QZ_angle_edit.text() == "nan"
+
+
+def test_plot_type_update_reuses_kinematics(hyspec_app, qtbot, monkeypatch):
+    """Test that changing only the plot type redraws the colormap without recalculating the map"""
+    # unicode
+    alpha = "\u03b1"
+    subscript_s = "\u209b"
+
+    # show the app
+    hyspec_app.show()
+    qtbot.waitUntil(hyspec_app.show, timeout=5000)
+    assert hyspec_app.isVisible()
+
+    hyspec_view = hyspec_app.main_window.HPPT_view
+    hyspec_model = hyspec_app.main_window.HPPT_presenter.model
+    experiment_widget = hyspec_view.experiment_widget
+    plot_widget = hyspec_view.plot_widget
+
+    calls = []
+    reduced_phi_Q = hppt_model._reduced_phi_Q
+
+    def count_reduced_phi_Q(*args, **kwargs):
+        calls.append(args)
+        return reduced_phi_Q(*args, **kwargs)
+
+    # wait for the progressive refinement of the plot
+    qtbot.waitUntil(lambda: hyspec_model.n_points == hyspec_model.progressive_grid_points[-1], timeout=5000)
+    monkeypatch.setattr(hppt_model, "_reduced_phi_Q", count_reduced_phi_Q)
+    default_array = plot_widget.heatmap.get_array()
+
+    # update type to first item
+    experiment_widget.Type_combobox.setCurrentIndex(0)
+    assert hyspec_model.plot_type == alpha + subscript_s
+    qtbot.waitUntil(lambda: plot_widget.cb.ax.get_ylabel() == alpha + subscript_s, timeout=5000)
+
+    # the geometry was not recalculated, and the map is drawn at the same resolution
+    assert calls == []
+    assert plot_widget.heatmap.get_array().shape == default_array.shape
+    assert not (default_array == plot_widget.heatmap.get_array()).all()
+
+
+def test_progressive_plot_refinement(hyspec_app, qtbot):
+    """Test that the heatmap is drawn on a coarse grid first and then refined"""
+    # show the app
+    hyspec_app.show()
+    qtbot.waitUntil(hyspec_app.show, timeout=5000)
+    assert hyspec_app.isVisible()
+
+    hyspec_view = hyspec_app.main_window.HPPT_view
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    hyspec_model = hyspec_presenter.model
+    experiment_widget = hyspec_view.experiment_widget
+    plot_widget = hyspec_view.plot_widget
+
+    hyspec_model.set_progressive_grid_points(coarse=20, maximum=80)
+    assert hyspec_model.progressive_grid_points == [20, 40, 80]
+
+    # set a valid Ei value
+    experiment_widget.Ei_edit.clear()
+    qtbot.keyClicks(experiment_widget.Ei_edit, "10")
+    experiment_widget.Ei_edit.setFocus()
+    qtbot.keyPress(experiment_widget.Ei_edit, Qt.Key_Return)
+
+    # coarse plot is drawn first
+    qtbot.waitUntil(lambda: plot_widget.heatmap.get_array().shape == (20, 20), timeout=5000)
+
+    # a newer request drops the remaining stages of the previous one
+    generation = hyspec_presenter.plot_generation
+    hyspec_presenter.update_heatmap()
+    assert hyspec_presenter.plot_generation == generation + 1
+
+    # then it is refined up to the maximum resolution
+    qtbot.waitUntil(lambda: plot_widget.heatmap.get_array().shape == (80, 80), timeout=5000)
+    assert hyspec_model.n_points == 80
+
+
+def test_calculated_stages_skipped(hyspec_app, qtbot, monkeypatch):
+    """Test that a new Ei draws the finest calculated geometry directly"""
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    hyspec_model = hyspec_presenter.model
+    plot_widget = hyspec_app.main_window.HPPT_view.plot_widget
+    hyspec_model.set_progressive_grid_points(coarse=20, maximum=80)
+    hyspec_presenter.update_heatmap()
+    qtbot.waitUntil(lambda: plot_widget.heatmap_shape == (80, 80), timeout=5000)
+    assert hyspec_model.get_calculated_grid_points() == [20, 40, 80]
+
+    stages = []
+    get_graph_task = hyspec_model.get_graph_task
+
+    def record_graph_task(n_points=None):
+        stages.append(n_points)
+        return get_graph_task(n_points)
+
+    monkeypatch.setattr(hyspec_model, "get_graph_task", record_graph_task)
+    # the geometry does not depend on Ei
+    hyspec_presenter.handle_field_values_update(
+        dict(name="experiment", data=dict(Ei=10.0, S2=30.0, alpha_p=0.0, plot_type=PLOT_TYPES[1]))
+    )
+    qtbot.waitUntil(lambda: hyspec_model.get_map_arrays() is not None, timeout=5000)
+    assert stages == [80]
+
+    # a new detector angle is refined again
+    stages.clear()
+    hyspec_presenter.handle_field_values_update(
+        dict(name="experiment", data=dict(Ei=10.0, S2=35.0, alpha_p=0.0, plot_type=PLOT_TYPES[1]))
+    )
+    qtbot.waitUntil(lambda: stages == [20, 40, 80] and hyspec_model.get_map_arrays() is not None, timeout=5000)
+
+
+def test_worker_drops_superseded_results(hyspec_app, qtbot):
+    """Test that only the newest result of the worker threads is drawn"""
+    # show the app
+    hyspec_app.show()
+    qtbot.waitUntil(hyspec_app.show, timeout=5000)
+    assert hyspec_app.isVisible()
+
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    hyspec_model = hyspec_presenter.model
+    plot_widget = hyspec_app.main_window.HPPT_view.plot_widget
+    assert hyspec_presenter.executor is not None
+
+    hyspec_model.set_progressive_grid_points(coarse=20, maximum=20)
+    hyspec_presenter.update_heatmap()
+    old_generation = hyspec_presenter.plot_generation
+
+    # superseded request
+    hyspec_presenter.prepare_heatmap_stage(old_generation, [30])
+    hyspec_presenter.update_heatmap()
+    # newest request
+    hyspec_presenter.prepare_heatmap_stage(hyspec_presenter.plot_generation, [40])
+
+    qtbot.waitUntil(lambda: plot_widget.heatmap.get_array().shape == (40, 40), timeout=5000)
+    qtbot.wait(100)
+    assert plot_widget.heatmap.get_array().shape == (40, 40)
+
+
+def test_batch_update_recalculates_once(hyspec_app, qtbot, monkeypatch):
+    """Test that field updates inside a group are merged per section and the heatmap is updated once"""
+    # show the app
+    hyspec_app.show()
+    qtbot.waitUntil(hyspec_app.show, timeout=5000)
+    assert hyspec_app.isVisible()
+
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    hyspec_view = hyspec_app.main_window.HPPT_view
+    hyspec_model = hyspec_presenter.model
+
+    handled = []
+    handle_field_values_update = hyspec_presenter.handle_field_values_update
+
+    def count_field_values_update(values):
+        handled.append(values["name"])
+        handle_field_values_update(values)
+
+    get_graph_task = hyspec_model.get_graph_task
+    calculated = []
+
+    def count_get_graph_task(*args, **kwargs):
+        calculated.append(args)
+        return get_graph_task(*args, **kwargs)
+
+    hyspec_model.set_progressive_grid_points(coarse=50, maximum=50)
+    hyspec_view.connect_fields_update(count_field_values_update)
+    monkeypatch.setattr(hyspec_model, "get_graph_task", count_get_graph_task)
+
+    with hyspec_presenter.batch_update():
+        hyspec_view.values_update(
+            dict(name="experiment", data=dict(Ei=10.0, S2=40.0, alpha_p=0.0, plot_type=PLOT_TYPES[1]))
+        )
+        hyspec_view.values_update(dict(name="crosshair", data=dict(DeltaE=-15.0, modQ=1.0)))
+        hyspec_view.values_update(
+            dict(name="experiment", data=dict(Ei=12.0, S2=40.0, alpha_p=0.0, plot_type=PLOT_TYPES[1]))
+        )
+        assert handled == []
+
+    assert handled == ["experiment", "crosshair"]
+    assert len(calculated) == 1
+    assert hyspec_model.Ei == 12.0
+    assert hyspec_model.Emin == -15 * 1.2
+
+
+def test_heatmap_updated_in_place(hyspec_app, qtbot):
+    """Test that the heatmap artist is reused while the grid shape is unchanged"""
+    # show the app
+    hyspec_app.show()
+    qtbot.waitUntil(hyspec_app.show, timeout=5000)
+    assert hyspec_app.isVisible()
+
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    hyspec_model = hyspec_presenter.model
+    plot_widget = hyspec_app.main_window.HPPT_view.plot_widget
+
+    hyspec_model.set_progressive_grid_points(coarse=20, maximum=20)
+    hyspec_presenter.update_heatmap()
+    qtbot.waitUntil(lambda: plot_widget.heatmap_shape == (20, 20), timeout=5000)
+    heatmap = plot_widget.heatmap
+
+    # new Ei changes the data coordinates, not the artist
+    hyspec_model.Ei = 40.0
+    hyspec_presenter.update_heatmap()
+    qtbot.waitUntil(lambda: plot_widget.heatmap_transform.get_matrix()[1, 2] == approx(-40.0), timeout=5000)
+    assert plot_widget.heatmap is heatmap
+    assert plot_widget.heatmap_transform.get_matrix()[1, 1] == approx((0.9 * 40 - hyspec_model.Emin) / 19)
+
+    # new grid shape builds another artist, and the previous one is hidden
+    hyspec_model.set_progressive_grid_points(coarse=30, maximum=30)
+    hyspec_presenter.update_heatmap()
+    qtbot.waitUntil(lambda: plot_widget.heatmap_shape == (30, 30), timeout=5000)
+    assert plot_widget.heatmap is not heatmap
+    assert not heatmap.get_visible()
+
+    # the stages of the progressive refinement reuse their artists
+    fine_heatmap = plot_widget.heatmap
+
+    def draw_stage(n_points):
+        energy_transfer = np.linspace(-20, 18, n_points)
+        plot_widget.update_plot(
+            q_min=np.zeros(n_points),
+            q_max=np.full(n_points, 5.0),
+            energy_transfer=energy_transfer,
+            momentum_transfer=np.linspace(0, 5, n_points),
+            scharpf_angle=np.full((n_points, n_points), 0.5),
+            plot_label=PLOT_TYPES[1],
+        )
+        return plot_widget.heatmap
+
+    assert draw_stage(20) is heatmap
+    assert heatmap.get_visible() and not fine_heatmap.get_visible()
+    assert draw_stage(30) is fine_heatmap
+    assert np.all(fine_heatmap.get_array() == 0.5)
+
+    # only the meshes of the last shapes are kept
+    for n_points in range(40, 40 + MAX_HEATMAPS):
+        draw_stage(n_points)
+    assert heatmap.axes is None and fine_heatmap.axes is None
+    assert len(plot_widget.heatmaps) == MAX_HEATMAPS
+
+
+def test_crosshair_blitted(hyspec_app, qtbot, monkeypatch):
+    """Test that moving the crosshair inside the plotted data repaints only the crosshair lines"""
+    # show the app
+    hyspec_app.show()
+    qtbot.waitUntil(hyspec_app.show, timeout=5000)
+    assert hyspec_app.isVisible()
+
+    plot_widget = hyspec_app.main_window.HPPT_view.plot_widget
+    canvas = plot_widget.static_canvas
+    plot_widget.update_crosshair(eline=1.0, qline=1.0)
+    qtbot.waitUntil(lambda: plot_widget.background is not None, timeout=5000)
+
+    draws = []
+    monkeypatch.setattr(canvas, "draw_idle", lambda *args: draws.append(args))
+    monkeypatch.setattr(canvas, "draw", lambda *args: draws.append(args))
+
+    # inside the tank edges and energy range: blitted
+    plot_widget.update_crosshair(eline=2.0, qline=1.5)
+    assert plot_widget.eline.get_ydata() == [2.0, 2.0]
+    assert plot_widget.qline.get_xdata() == [1.5, 1.5]
+    assert draws == []
+
+    # outside the plotted data the axes limits can change: full draw
+    plot_widget.update_crosshair(eline=2.0, qline=100.0)
+    assert len(draws) == 1
+    assert plot_widget.background is None
+
+
+def test_reflections_overlay(hyspec_app, qtbot):
+    """Test that the reflections of the lattice are drawn in single crystal mode only"""
+    # show the app
+    hyspec_app.show()
+    qtbot.waitUntil(hyspec_app.show, timeout=5000)
+    assert hyspec_app.isVisible()
+
+    hyspec_view = hyspec_app.main_window.HPPT_view
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    sc_widget = hyspec_view.sc_widget
+    plot_widget = hyspec_view.plot_widget
+
+    # single crystal mode with a larger unit cell
+    hyspec_view.selection_widget.sc_rb.setChecked(True)
+    sc_widget.a_edit.clear()
+    qtbot.keyClicks(sc_widget.a_edit, "8")
+    sc_widget.a_edit.setFocus()
+    qtbot.keyPress(sc_widget.a_edit, Qt.Key_Return)
+
+    # enumerated in a worker thread
+    qtbot.waitUntil(lambda: len(plot_widget.reflections.get_offsets()) > 0, timeout=5000)
+    offsets = plot_widget.reflections.get_offsets()
+    # one marker for each distinct |Q|, at the crosshair energy transfer
+    assert len(np.unique(offsets[:, 0])) == len(offsets)
+    assert np.all(offsets[:, 1] == hyspec_presenter.model.cp.DeltaE)
+
+    # changing h, k, l does not recalculate the overlay
+    sc_widget.h_edit.clear()
+    qtbot.keyClicks(sc_widget.h_edit, "1")
+    sc_widget.h_edit.setFocus()
+    qtbot.keyPress(sc_widget.h_edit, Qt.Key_Return)
+    assert plot_widget.reflections.get_offsets() is offsets
+
+    # hidden in powder mode
+    hyspec_view.selection_widget.powder_rb.setChecked(True)
+    assert len(plot_widget.reflections.get_offsets()) == 0
+
+
+def test_reflections_superseded(hyspec_app):
+    """Test that the overlay of an older lattice is not drawn after a newer one"""
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    hyspec_app.main_window.HPPT_view.selection_widget.sc_rb.setChecked(True)
+
+    generation = hyspec_presenter.reflections_generation
+    hyspec_presenter.update_reflections()
+    hyspec_presenter.update_reflections()
+    assert hyspec_presenter.reflections_generation == generation + 2
+    drawn = []
+    hyspec_presenter.view.plot_widget.update_reflections = lambda **kwargs: drawn.append(kwargs)
+    hyspec_presenter.draw_reflections(generation + 1)
+    assert drawn == []
+    hyspec_presenter.draw_reflections(generation + 2)
+    assert len(drawn) == 1
+
+
+def test_crosshair_edit_keeps_heatmap(hyspec_app, qtbot):
+    """Test that crosshair and unchanged field updates do not recalculate the heatmap"""
+    # show the app
+    hyspec_app.show()
+    qtbot.waitUntil(hyspec_app.show, timeout=5000)
+    assert hyspec_app.isVisible()
+
+    hyspec_view = hyspec_app.main_window.HPPT_view
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    hyspec_model = hyspec_presenter.model
+    hyspec_view.selection_widget.powder_rb.setChecked(True)
+    generation = hyspec_presenter.plot_generation
+
+    # new |Q| and a DeltaE that does not change Emin
+    hyspec_view.values_update(dict(name="crosshair", data=dict(DeltaE=3.0, modQ=1.5)))
+    assert hyspec_presenter.plot_generation == generation
+    assert hyspec_view.crosshair_widget.QZ_angle_edit.text() == f"{hyspec_model.get_ang_Q_beam():.3f}"
+
+    # same experiment values
+    hyspec_view.values_update(dict(name="experiment", data=hyspec_model.get_experiment_data()))
+    assert hyspec_presenter.plot_generation == generation
+
+    # DeltaE below -Ei changes the energy axis
+    hyspec_view.values_update(dict(name="crosshair", data=dict(DeltaE=-25.0, modQ=1.5)))
+    assert hyspec_presenter.plot_generation == generation + 1
+
+
+def test_first_plot_prepared_while_building(qtbot, monkeypatch):
+    """Test that the window opens with the refined map, calculated in a worker thread"""
+    threads = []
+    reduced_phi_Q = hppt_model._reduced_phi_Q
+
+    def recording_phi_Q(S2, e_axis, q_axis):
+        threads.append(threading.current_thread().name)
+        return reduced_phi_Q(S2, e_axis, q_axis)
+
+    monkeypatch.setattr(hppt_model, "_reduced_phi_Q", recording_phi_Q)
+    caches = []
+    monkeypatch.setattr(hppt_presenter, "set_geometry_cache", caches.append)
+    hppt_model._geometry_grid.cache_clear()
+    hppt_model.reduced_geometry.cache_clear()
+
+    hyspec_app = Hyspecppt()
+    qtbot.addWidget(hyspec_app)
+    model = hyspec_app.main_window.HPPT_presenter.model
+    plot_widget = hyspec_app.main_window.HPPT_view.plot_widget
+
+    # no coarse stage on the GUI thread
+    assert threads == ["hyspecppt-first-plot_0"]
+    assert model.n_points == model.progressive_grid_points[-1]
+    assert plot_widget.heatmap_shape == (model.n_points, model.n_points)
+    assert hyspec_app.main_window.HPPT_presenter.first_plot is None
+    # the settings are applied once, so the first map is not calculated into a replaced cache
+    assert len(caches) == 1
+
+
+def test_first_plot_with_restored_map(hyspec_app, monkeypatch, caplog):
+    """Test that a first map calculated next to a restored one is not reported as failed"""
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    hyspec_presenter.model.set_progressive_grid_points(coarse=20, maximum=40)
+    monkeypatch.setattr(hyspec_presenter.model, "get_restored_grid_points", lambda: [40])
+    first_plot = Future()
+    first_plot.set_result(None)
+    hyspec_presenter.first_plot = first_plot
+    hyspec_presenter.update_heatmap()
+    assert hyspec_presenter.first_plot is None
+    assert "Plot calculation failed" not in caplog.text
+
+    first_plot = Future()
+    first_plot.set_exception(MemoryError("out of memory"))
+    hyspec_presenter.first_plot = first_plot
+    hyspec_presenter.update_heatmap()
+    assert "Plot calculation failed: out of memory" in caplog.text
+
+
+def test_sessions_restored_without_calculation(qtbot, monkeypatch):
+    """Test that the last session and the named sessions are drawn from the stored maps"""
+    hyspec_app = Hyspecppt()
+    qtbot.addWidget(hyspec_app)
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    hyspec_presenter.model.set_progressive_grid_points(coarse=20, maximum=40)
+
+    # named session with two configurations
+    def refined():
+        arrays = hyspec_presenter.model.get_map_arrays()
+        return arrays is not None and arrays["n_points"] == 40
+
+    hyspec_presenter.handle_field_values_update(
+        dict(name="experiment", data=dict(Ei=35.0, S2=-50.0, alpha_p=20.0, plot_type=PLOT_TYPES[2]))
+    )
+    qtbot.waitUntil(refined, timeout=5000)
+    hyspec_presenter.save_configuration("proposal", "first")
+    hyspec_presenter.handle_field_values_update(
+        dict(name="experiment", data=dict(Ei=35.0, S2=60.0, alpha_p=20.0, plot_type=PLOT_TYPES[2]))
+    )
+    qtbot.waitUntil(refined, timeout=5000)
+    hyspec_presenter.save_configuration("proposal", "second")
+    first_map = hyspec_presenter.session.maps["first"]["intensity"]
+    hyspec_app.close()
+
+    calculations = []
+    monkeypatch.setattr(hppt_model, "_reduced_phi_Q", lambda *args: calculations.append(args))
+    hppt_model._geometry_grid.cache_clear()
+    hppt_model.reduced_geometry.cache_clear()
+    monkeypatch.setattr(hppt_model, "_RESTORED_GEOMETRY", {})
+
+    # the window opens with the last configuration and its map
+    hyspec_app = Hyspecppt()
+    qtbot.addWidget(hyspec_app)
+    hyspec_presenter = hyspec_app.main_window.HPPT_presenter
+    hyspec_view = hyspec_app.main_window.HPPT_view
+    hyspec_presenter.model.set_progressive_grid_points(coarse=20, maximum=40)
+    assert hyspec_view.experiment_widget.S2_edit.text() == "60.0"
+    assert hyspec_view.experiment_widget.Type_combobox.currentText() == PLOT_TYPES[2]
+    qtbot.waitUntil(lambda: hyspec_view.plot_widget.heatmap_shape == (40, 40), timeout=5000)
+
+    # all the configurations of a named session
+    hyspec_presenter.open_session("proposal")
+    combobox = hyspec_view.session_widget.configuration_combobox
+    assert [combobox.itemText(index) for index in range(combobox.count())] == ["first", "second"]
+    assert combobox.currentText() == "second"
+    hyspec_presenter.handle_configuration_select("first")
+    assert hyspec_view.experiment_widget.S2_edit.text() == "-50.0"
+    qtbot.waitUntil(
+        lambda: np.array_equal(hyspec_view.plot_widget.heatmap.get_array().T, first_map, equal_nan=True), timeout=5000
+    )
+    assert calculations == []
+
+    # a stored session that cannot be read is reported, and the shown configuration is kept
+    hyspec_presenter.open_session("missing")
+    assert hyspec_presenter.session.name == "proposal"
@@ -88,6 +88,23 @@ def test_selector_widget(qtbot):
     assert selector_widget.sc_rb.text() == "Single C&rystal"
 
 
+def test_session_widget(qtbot, monkeypatch):
+    """Test the configurations of the session and the dialogs"""
+    session_widget = hppt_view.SessionWidget()
+    qtbot.addWidget(session_widget)
+    session_widget.set_session("proposal", ["first", "second"], "second")
+    assert session_widget.groupBox.title() == "Session: proposal"
+    assert session_widget.configuration_combobox.currentText() == "second"
+
+    answers = iter([("proposal", True), ("third", True)])
+    monkeypatch.setattr(hppt_view.QInputDialog, "getText", lambda *_, **__: next(answers))
+    assert session_widget.ask_configuration_name("second") == ("proposal", "third")
+    monkeypatch.setattr(hppt_view.QInputDialog, "getText", lambda *_, **__: ("", False))
+    assert session_widget.ask_configuration_name("second") is None
+    monkeypatch.setattr(hppt_view.QInputDialog, "getItem", lambda *_, **__: ("proposal", True))
+    assert session_widget.ask_session_name(["proposal"]) == "proposal"
+
+
 def test_combo_box_plot_options():
     """Test the combo box text are set correctly"""
     # unicode
@@ -0,0 +1,113 @@
+"""Tests for the batch calculation of polarization maps"""
+
+import json
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from hyspecppt.batch import main, read_configurations, run_batch
+from hyspecppt.hppt.experiment_settings import PLOT_TYPES
+from hyspecppt.hppt.hppt_model import HyspecPPTModel
+
+
+def test_read_configurations(tmp_path):
+    """Test the JSON, CSV and INI configuration files"""
+    json_path = tmp_path / "configurations.json"
+    json_path.write_text(
+        json.dumps(
+            dict(
+                configurations=[
+                    dict(Ei=20, S2=60, alpha_p=30, plot_type=1, crosshair=dict(DeltaE=5, modQ=2), mode="powder"),
+                    dict(name="crystal", experiment=dict(Ei=10), lattice=dict(a=5, b=5, c=5, h=1)),
+                ]
+            )
+        )
+    )
+    csv_path = tmp_path / "configurations.csv"
+    csv_path.write_text("Ei,S2,alpha_p,plot_type,DeltaE,modQ,mode\n20,60,30,1,5,2,powder\n10,,,,,,\n")
+    ini_path = tmp_path / "configurations.ini"
+    ini_path.write_text(
+        "[config_0000]\nEi = 20\nS2 = 60\nalpha_p = 30\nplot_type = 1\nDeltaE = 5\nmodQ = 2\nmode = powder\n"
+    )
+
+    powder = read_configurations(str(json_path))[0]
+    assert powder["name"] == "config_0000"
+    assert powder["plot_type"] == PLOT_TYPES[1]
+    assert powder["DeltaE"] == 5.0
+    assert read_configurations(str(csv_path))[0] == powder
+    assert read_configurations(str(ini_path)) == [powder]
+
+    # missing parameters take the default values
+    crystal = read_configurations(str(json_path))[1]
+    assert crystal["name"] == "crystal"
+    assert crystal["Ei"] == 10.0
+    assert crystal["h"] == 1.0
+    assert crystal["mode"] == "single_crystal"
+    assert read_configurations(str(csv_path))[1]["S2"] == 30.0
+
+    json_path.write_text(json.dumps([dict(Ei=20, S3=60)]))
+    with pytest.raises(ValueError):
+        read_configurations(str(json_path))
+    json_path.write_text(json.dumps([dict(plot_type=7)]))
+    with pytest.raises(ValueError):
+        read_configurations(str(json_path))
+
+
+def test_run_batch():
+    """Test that the batch results match the model, with and without worker processes"""
+    configurations = [
+        dict(name="a", Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[1], mode="powder", DeltaE=5.0, modQ=2.0),
+        dict(name="b", Ei=10.0, S2=-45.0, alpha_p=0.0, plot_type=PLOT_TYPES[0], mode="powder", DeltaE=-15.0, modQ=1.0),
+    ]
+    configurations = [
+        dict(configuration, a=1.0, b=1.0, c=1.0, alpha=90.0, beta=90.0, gamma=90.0, h=0.0, k=0.0, l=0.0)
+        for configuration in configurations
+    ]
+    results = run_batch(configurations, n_points=40)
+
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=60.0, alpha_p=30.0, plot_type=PLOT_TYPES[1])
+    data = model.calculate_graph_data(n_points=40)
+    assert np.array_equal(results[0]["intensity"], data["intensity"], equal_nan=True)
+    assert np.array_equal(results[0]["E"], data["E"])
+    assert results[0]["in_coverage"]
+    assert np.isclose(results[0]["intensity_at_crosshair"], model.calculate_point_data(2.0, 5.0)[PLOT_TYPES[1]])
+    assert 0 < results[0]["coverage_fraction"] < 1
+    # Emin follows the crosshair, on a map with the requested number of points
+    assert results[1]["Emin"] == -18.0
+    assert results[1]["intensity"].shape == (40, 40)
+    assert np.isclose(results[1]["E"][0], -18.0)
+
+    for result, reference in zip(run_batch(configurations, n_points=40, processes=2), results):
+        for key in ["intensity", "Q", "E", "alpha_s", "coverage_fraction"]:
+            assert np.array_equal(result[key], reference[key], equal_nan=True)
+
+
+def test_batch_command_line(tmp_path):
+    """Test the command line, without Qt, matplotlib and scipy"""
+    json_path = tmp_path / "configurations.json"
+    json_path.write_text(json.dumps([dict(name="first", Ei=20, S2=60), dict(name="second", Ei=20, S2=-60)]))
+    output = tmp_path / "maps.npz"
+    script = (
+        "import sys; from hyspecppt.batch import main; "
+        f"main([{str(json_path)!r}, '-o', {str(output)!r}, '-n', '30', '--cache-size', '0']); "
+        "assert not [name for name in sys.modules if name.split('.')[0] in ('qtpy', 'PySide6', 'matplotlib', 'scipy')]"
+    )
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    with np.load(output) as maps:
+        assert list(maps["summary/name"]) == ["first", "second"]
+        assert maps["first/intensity"].shape == (30, 30)
+        assert maps["summary/coverage_fraction"].shape == (2,)
+        # mirror image of the tank
+        assert np.array_equal(maps["first/Q_hi"], maps["second/Q_hi"])
+
+    # rendering
+    main([str(json_path), "-o", str(output), "-n", "30", "--render", str(tmp_path / "images")])
+    assert (tmp_path / "images" / "first.png").exists()
+
+    with pytest.raises(SystemExit):
+        main([str(tmp_path / "missing.json")])
@@ -0,0 +1,98 @@
+"""Tests for the persistent result cache"""
+
+import os
+
+import numpy as np
+
+from hyspecppt.cache import ResultCache
+from hyspecppt.hppt import hppt_model
+from hyspecppt.hppt.hppt_model import HyspecPPTModel
+
+
+def test_cache_keys():
+    """Test that the keys depend on the quantized inputs"""
+    key = ResultCache.key("geometry", S2=30.0, n_points=200)
+    assert key == ResultCache.key("geometry", n_points=200, S2=30.0 + 1e-12)
+    assert key == ResultCache.key("geometry", S2=np.float32(30.0), n_points=np.int64(200))
+    assert key != ResultCache.key("geometry", S2=30.001, n_points=200)
+    assert key != ResultCache.key("intensity", S2=30.0, n_points=200)
+
+
+def test_cache_load_and_save(tmp_path, monkeypatch):
+    """Test the memory-mapped arrays and the hit and miss counters"""
+    cache = ResultCache(str(tmp_path))
+    calls = []
+
+    def calculate():
+        calls.append(1)
+        return np.arange(12.0).reshape(3, 4)
+
+    first = cache.get_or_calculate("test", calculate, x=1.0)
+    second = cache.get_or_calculate("test", calculate, x=1.0)
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert isinstance(second, np.memmap)
+    assert not second.flags.writeable
+    assert np.array_equal(first, second)
+
+    # a read-only cache directory keeps its files
+    key = cache.key("test", x=1.0)
+
+    def read_only_utime(path):
+        raise PermissionError(f"Read-only file system: {path!r}")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "utime", read_only_utime)
+        assert np.array_equal(cache.load(key), first)
+    assert os.path.exists(os.path.join(str(tmp_path), f"{key}.npy"))
+    assert cache.hits == 2
+
+    # an invalid file is a miss
+    with open(os.path.join(str(tmp_path), f"{key}.npy"), "wb") as npy_file:
+        npy_file.write(b"invalid")
+    assert cache.load(key) is None
+    assert cache.misses == 2
+
+    # disabled cache
+    disabled = ResultCache(str(tmp_path / "disabled"), max_size_mb=0)
+    disabled.get_or_calculate("test", calculate, x=1.0)
+    assert not os.path.exists(disabled.directory)
+
+
+def test_cache_eviction(tmp_path):
+    """Test that the least recently used arrays are removed first"""
+    array = np.zeros(1024 * 1024 // 8)
+    cache = ResultCache(str(tmp_path), max_size_mb=2.5)
+    keys = [cache.key("test", index=index) for index in range(3)]
+    cache.save(keys[0], array)
+    cache.save(keys[1], array)
+    os.utime(os.path.join(str(tmp_path), f"{keys[0]}.npy"), (0, 0))
+    os.utime(os.path.join(str(tmp_path), f"{keys[1]}.npy"), (1, 1))
+    # keys[0] is used again
+    assert cache.load(keys[0]) is not None
+    cache.save(keys[2], array)
+    assert cache.load(keys[1]) is None
+    assert cache.load(keys[0]) is not None
+    assert cache.load(keys[2]) is not None
+
+    cache.clear()
+    assert cache.load(keys[2]) is None
+
+
+def test_model_geometry_cache(tmp_path):
+    """Test that the geometry of the map is reused from the disk"""
+    model = HyspecPPTModel()
+    cache = ResultCache(str(tmp_path))
+    hppt_model.set_geometry_cache(cache)
+    assert hppt_model.GEOMETRY_CACHE is cache
+    model.set_experiment_data(Ei=20.0, S2=43.21, alpha_p=30.0, plot_type=model.plot_type)
+    data = model.calculate_graph_data(n_points=30)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # a new session
+    hppt_model._geometry_grid.cache_clear()
+    hppt_model.reduced_geometry.cache_clear()
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=20.0, S2=43.21, alpha_p=30.0, plot_type=model.plot_type)
+    assert np.array_equal(model.calculate_graph_data(n_points=30)["intensity"], data["intensity"], equal_nan=True)
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -8,7 +8,7 @@ import pytest
 from qtpy.QtWidgets import QApplication
 
 from hyspecppt import Hyspecppt
-from hyspecppt.configuration import Configuration, get_data
+from hyspecppt.configuration import Configuration, get_configuration, get_data
 
 
 def test_config_path_default():
@@ -204,3 +204,57 @@ def test_conf_init_invalid(capsys, user_conf_file, monkeypatch):
 
     captured = capsys.readouterr()
     assert captured[0].startswith("Error with configuration settings!")
+
+
+def test_configuration_service(monkeypatch, tmp_path):
+    """Test that the file is parsed again only when it changes, and the typed values"""
+    user_path = os.path.join(tmp_path, "test_config.ini")
+    monkeypatch.setattr("hyspecppt.configuration.CONFIG_PATH_FILE", user_path)
+    Configuration()
+    service = get_configuration()
+    assert service is get_configuration()
+
+    reads = []
+    read = ConfigParser.read
+    monkeypatch.setattr(
+        ConfigParser, "read", lambda self, *args, **kwargs: reads.append(1) or read(self, *args, **kwargs)
+    )
+    assert service.get_int("global.performance", "max_grid_points") == 200
+    assert get_data("global.performance", "workers") == "1"
+    assert service.get_float("global.performance", "cache_size_mb", 0.0) == 512.0
+    assert service.get_str("global.performance", "dtype") == "float64"
+    assert len(reads) == 1
+
+    # defaults for missing and invalid values
+    assert service.get_int("global.performance", "missing", 7) == 7
+    assert service.get_int("global.performance", "dtype", 3) == 3
+
+    # a new value when the file changes
+    config = ConfigParser(allow_no_value=True, comment_prefixes="/")
+    read(config, user_path)
+    config["global.performance"]["max_grid_points"] = "400"
+    with open(user_path, "w", encoding="utf8") as config_file:
+        config.write(config_file)
+    os.utime(user_path, ns=(0, 0))
+    assert service.get_int("global.performance", "max_grid_points") == 400
+    assert len(reads) == 2
+
+
+def test_validate_writes_only_added_fields(monkeypatch, tmp_path):
+    """Test that a complete configuration file is not written again"""
+    user_path = os.path.join(tmp_path, "test_config.ini")
+    monkeypatch.setattr("hyspecppt.configuration.CONFIG_PATH_FILE", user_path)
+    Configuration()
+    os.utime(user_path, ns=(0, 0))
+    Configuration()
+    assert os.stat(user_path).st_mtime_ns == 0
+
+    # a missing field is added
+    with open(user_path, encoding="utf8") as config_file:
+        lines = [line for line in config_file if not line.startswith("workers")]
+    with open(user_path, "w", encoding="utf8") as config_file:
+        config_file.writelines(lines)
+    os.utime(user_path, ns=(0, 0))
+    assert Configuration().is_valid()
+    assert os.stat(user_path).st_mtime_ns > 0
+    assert get_data("global.performance", "workers") == "1"
@@ -1,6 +1,7 @@
 """UI tests for the application"""
 
 import subprocess
+import sys
 
 import pytest
 
@@ -31,6 +32,18 @@ def test_gui_v():
     assert version_result == __version__
 
 
+def test_gui_lazy_imports():
+    """Test that the command line is parsed without importing Qt and scipy"""
+    script = (
+        "import sys; import hyspecppt.hyspecpptmain as main; "
+        "assert not [name for name in sys.modules if name.split('.')[0] in ('qtpy', 'PySide6', 'scipy')]; "
+        "from hyspecppt.hyspecpptmain import HyspecPPT; from hyspecppt.mainwindow import HyspecPPT as window; "
+        "assert HyspecPPT is window"
+    )
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
 def test_gui_invalid_parameter():
     """Test that invalid parameter prints usage"""
     full_command = ["hyspecppt", "-invalid"]
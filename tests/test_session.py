@@ -0,0 +1,75 @@
+"""Tests for the named sessions"""
+
+import json
+
+import numpy as np
+import pytest
+
+from hyspecppt.batch import read_configurations
+from hyspecppt.hppt import hppt_model
+from hyspecppt.hppt.experiment_settings import PLOT_TYPES
+from hyspecppt.hppt.hppt_model import HyspecPPTModel
+from hyspecppt.session import LAST_SESSION, Session, SessionStore
+
+
+def test_session_store(tmp_path):
+    """Test that the configurations and their maps are stored and restored"""
+    model = HyspecPPTModel()
+    model.set_experiment_data(Ei=25.0, S2=-45.0, alpha_p=30.0, plot_type=PLOT_TYPES[2])
+    model.set_crosshair_data(current_experiment_type="powder", DeltaE=-30.0, modQ=1.5)
+    other_plot_type = model.calculate_graph_data(n_points=40)
+    model.set_experiment_data(Ei=25.0, S2=-45.0, alpha_p=30.0, plot_type=PLOT_TYPES[0])
+    reference = model.calculate_graph_data(n_points=40)
+
+    session = Session("proposal")
+    session.store(model, "first")
+    model.set_experiment_data(Ei=10.0, S2=60.0, alpha_p=0.0, plot_type=PLOT_TYPES[1])
+    session.store(model, "no map")
+    # the map of a configuration is only stored if it was calculated for its state
+    assert "no map" not in session.maps
+    store = SessionStore(str(tmp_path))
+    store.save(session)
+    store.save(Session(LAST_SESSION))
+    assert store.names() == ["proposal"]
+
+    # the session file is a configuration file of hyspecppt-batch
+    names = [configuration["name"] for configuration in read_configurations(str(tmp_path / "proposal.json"))]
+    assert names == ["first", "no map"]
+
+    restored = store.load("proposal")
+    assert restored.current == "no map"
+    assert list(restored.maps) == ["first"]
+    # the cosine of the Scharpf angle is derived from phi_Q when the map is restored
+    assert "cos_ang_PQ" not in restored.maps["first"]
+
+    # the first configuration is drawn without calculating the map
+    hppt_model._geometry_grid.cache_clear()
+    hppt_model.reduced_geometry.cache_clear()
+    new_model = HyspecPPTModel()
+    restored.restore(new_model, "first")
+    state = dict(restored.configurations["first"])
+    assert state.pop("name") == "first"
+    assert new_model.get_session_state() == state
+    assert new_model.get_restored_grid_points() == [40]
+    assert hppt_model._geometry_grid.cache_info().currsize == 0
+    data = new_model.calculate_graph_data(n_points=40)
+    assert hppt_model._geometry_grid.cache_info().currsize == 0
+    for key in ["E", "Q_low", "Q_hi", "intensity"]:
+        assert np.array_equal(data[key], reference[key], equal_nan=True)
+    new_model.plot_type = PLOT_TYPES[2]
+    data = new_model.calculate_graph_data(n_points=40)
+    assert hppt_model._geometry_grid.cache_info().currsize == 0
+    assert np.array_equal(data["intensity"], other_plot_type["intensity"], equal_nan=True)
+
+    # maps of another version are calculated again
+    description = json.loads((tmp_path / "proposal.json").read_text())
+    description["hyspecppt_version"] = "0.0.0"
+    (tmp_path / "proposal.json").write_text(json.dumps(description))
+    assert store.load("proposal").maps == {}
+
+    store.remove("proposal")
+    assert store.names() == []
+    with pytest.raises(FileNotFoundError):
+        store.load("proposal")
+    with pytest.raises(ValueError):
+        Session("../proposal")